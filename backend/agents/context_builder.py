@@ -0,0 +1,134 @@
+import re
+import math
+import time
+import hashlib
+import tiktoken
+from collections import Counter
+from typing import List, Dict, Optional
+
+# MinHash parameters: 64 permutations over 3-word shingles
+MINHASH_PERMUTATIONS = 64
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_SEEDS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % MINHASH_PRIME or 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % MINHASH_PRIME)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+def _tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if len(t) > 2]
+
+def minhash_signature(text: str, shingle_size: int = 3) -> List[int]:
+    """MinHash signature of the text's word shingles (near-duplicate detection)."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles]
+    return [min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in MINHASH_SEEDS]
+
+def estimate_jaccard(sig_a: List[int], sig_b: List[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+class ResearchContextBuilder:
+    """
+    Incrementally builds the synthesis context while search results stream in.
+    1. Near-duplicate removal (MinHash) as snippets arrive.
+    2. BM25 reranking against the query and the plan's required concepts.
+    3. Packing into a fixed token budget (most relevant first).
+    """
+
+    def __init__(
+        self,
+        query: str,
+        concepts: Optional[List[str]] = None,
+        token_budget: int = 12000,
+        dedup_threshold: float = 0.8,
+        concept_weight: float = 0.5
+    ):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+
+        # Query terms count fully, concept terms are a softer signal
+        self.query_weights = Counter()
+        for term in _tokenize(query):
+            self.query_weights[term] = 1.0
+        for term in _tokenize(" ".join(concepts or [])):
+            self.query_weights[term] = max(self.query_weights[term], concept_weight)
+
+        self.snippets: List[Dict] = []
+        self.total_tokens = 0 # Unique (post-dedup) candidate tokens
+        self.stats = {"input_tokens": 0, "duplicate_tokens": 0, "duplicates_removed": 0, "dedup_ms": 0.0}
+
+    def add(self, findings: List[Dict]):
+        """Adds a batch of findings ([{'content': ..., 'url': ...}]) from one completed search."""
+        start = time.perf_counter()
+
+        for item in findings:
+            content = (item.get('content') or '').strip()
+            if not content: continue
+
+            tokens = len(self.tokenizer.encode(content))
+            self.stats["input_tokens"] += tokens
+
+            signature = minhash_signature(content)
+            if any(estimate_jaccard(signature, s["signature"]) >= self.dedup_threshold for s in self.snippets):
+                self.stats["duplicates_removed"] += 1
+                self.stats["duplicate_tokens"] += tokens
+                continue
+
+            self.snippets.append({
+                "content": content,
+                "url": item.get('url') or 'Deep Research',
+                "tokens": tokens,
+                "terms": Counter(_tokenize(content)),
+                "signature": signature
+            })
+            self.total_tokens += tokens
+
+        self.stats["dedup_ms"] += (time.perf_counter() - start) * 1000
+
+    @property
+    def is_full(self) -> bool:
+        """True once enough unique candidate material exists to fill the budget."""
+        return self.total_tokens >= self.token_budget
+
+    def _bm25_scores(self, k1: float = 1.5, b: float = 0.75) -> List[float]:
+        """BM25 over the collected snippets, with weighted query/concept terms."""
+        n = len(self.snippets)
+        if n == 0:
+            return []
+
+        avg_len = sum(sum(s["terms"].values()) for s in self.snippets) / n or 1.0
+        doc_freq = Counter()
+        for snippet in self.snippets:
+            doc_freq.update(term for term in snippet["terms"] if term in self.query_weights)
+
+        scores = []
+        for snippet in self.snippets:
+            doc_len = sum(snippet["terms"].values())
+            score = 0.0
+            for term, weight in self.query_weights.items():
+                tf = snippet["terms"].get(term, 0)
+                if not tf: continue
+                idf = math.log(1 + (n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                score += weight * idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avg_len))
+            scores.append(score)
+        return scores
+
+    def build(self) -> str:
+        """Reranks the unique snippets and packs the best ones into the token budget."""
+        start = time.perf_counter()
+        ranked = sorted(zip(self._bm25_scores(), self.snippets), key=lambda pair: pair[0], reverse=True)
+
+        parts = []
+        used = 0
+        for _, snippet in ranked:
+            if used + snippet["tokens"] > self.token_budget:
+                continue
+            parts.append(f"Source: {snippet['url']}\nContent: {snippet['content']}\n\n")
+            used += snippet["tokens"]
+
+        self.stats["packed_tokens"] = used
+        self.stats["tokens_saved"] = self.stats["input_tokens"] - used
+        self.stats["rerank_ms"] = (time.perf_counter() - start) * 1000
+        return "".join(parts)
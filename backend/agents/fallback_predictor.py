@@ -0,0 +1,99 @@
+import re
+import time
+from collections import OrderedDict, deque, Counter
+from typing import Tuple
+
+# Queries about "now" are rarely answered by a personal knowledge base
+RECENCY_PATTERN = re.compile(
+    r"\b(today|tonight|yesterday|tomorrow|latest|current(ly)?|right now|news|this (week|month|year)|"
+    r"recent(ly)?|breaking|price|stock|weather|score|release[sd]?|update[sd]?|20\d\d)\b",
+    re.IGNORECASE
+)
+
+def _terms(text: str) -> set:
+    return {t for t in re.findall(r"[a-z0-9]+", text.lower()) if len(t) > 3}
+
+class FallbackPredictor:
+    """
+    Cheap, local guess of whether RAG will be too weak and the web fallback will run.
+    Signals:
+    - Recency keywords in the query.
+    - Query novelty: share of query terms never seen in this user's previous well-answered queries.
+    - The user's recent RAG miss rate (e.g. a nearly empty index).
+    Also owns the per-user budget for speculative web searches.
+    Memory is bounded: state is kept for the max_users most recently active users,
+    with at most max_terms known terms each (the most frequent ones survive).
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.6,
+        budget_per_hour: int = 20,
+        history_size: int = 50,
+        min_history: int = 5,
+        max_users: int = 10000,
+        max_terms: int = 2000
+    ):
+        self.threshold = threshold
+        self.budget_per_hour = budget_per_hour
+        self.history_size = history_size
+        self.min_history = min_history
+        self.max_users = max_users
+        self.max_terms = max_terms
+
+        # user_id -> (known terms, recent RAG outcomes, speculative spend times), LRU order
+        self._users: "OrderedDict[int, Tuple[Counter, deque, deque]]" = OrderedDict()
+
+    def _state(self, user_id: int) -> Tuple[Counter, deque, deque]:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = (Counter(), deque(maxlen=self.history_size), deque())
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def score(self, user_id: int, query: str) -> float:
+        """Estimated probability-like score (0..1) that the web fallback will be needed."""
+        if RECENCY_PATTERN.search(query):
+            return 1.0
+
+        known, outcomes, _ = self._state(user_id)
+        if len(outcomes) < self.min_history:
+            # Not enough history to judge novelty: rely on the miss rate seen so far
+            return sum(1 for strong in outcomes if not strong) / len(outcomes) if outcomes else 0.0
+
+        miss_rate = sum(1 for strong in outcomes if not strong) / len(outcomes)
+
+        terms = _terms(query)
+        novelty = sum(1 for t in terms if t not in known) / len(terms) if terms else 0.0
+
+        return max(miss_rate, novelty)
+
+    def should_speculate(self, user_id: int, query: str) -> bool:
+        """True if a fallback is likely AND the user still has speculative budget this hour."""
+        if self.score(user_id, query) < self.threshold:
+            return False
+        return self._try_spend(user_id)
+
+    def _try_spend(self, user_id: int) -> bool:
+        now = time.monotonic()
+        spent = self._state(user_id)[2]
+        while spent and now - spent[0] > 3600:
+            spent.popleft()
+        if len(spent) >= self.budget_per_hour:
+            return False
+        spent.append(now)
+        return True
+
+    def record_outcome(self, user_id: int, query: str, rag_was_strong: bool):
+        """Learns from the actual RAG result. Terms of well-answered queries count as 'in the index'."""
+        known, outcomes, _ = self._state(user_id)
+        outcomes.append(rag_was_strong)
+        if rag_was_strong:
+            known.update(_terms(query))
+            if len(known) > self.max_terms:
+                kept = known.most_common(self.max_terms)
+                known.clear()
+                known.update(dict(kept))
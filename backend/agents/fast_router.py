@@ -0,0 +1,207 @@
+import re
+import math
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from backend.core.metrics import metrics
+
+# Keyword/regex rules per mode. A match is a vote (RULE_VOTE_WEIGHT added to that mode's
+# centroid similarity), never a decision on its own: words like "function" or "research" are too common.
+ROUTING_RULES: Dict[str, List[str]] = {
+    "research": [
+        r"\bresearch\b", r"\bin[- ]depth\b", r"\bcomprehensive (report|overview|analysis)\b",
+        r"\bcompare\b.+\b(and|vs\.?|versus)\b", r"\bhistory of\b", r"\bstate of the art\b",
+    ],
+    "coder": [
+        r"\b(python|javascript|typescript|java|rust|golang|sql|regex|bash)\b", r"\b(bug|stack ?trace|exception|compile|refactor)\b",
+        r"\b(function|class|api|endpoint|unit test)s?\b", r"```",
+    ],
+    "analyst": [
+        r"\banaly[sz]e\b", r"\b(dataset|csv|spreadsheet|excel)\b", r"\b(trend|outlier|correlation|regression|statistic)s?\b",
+    ],
+    "academic": [
+        r"\b(cite|citation|paper|journal|peer[- ]review|theory|thesis)s?\b", r"\bexplain the concept\b",
+    ],
+    "creative": [
+        r"\bbrainstorm\b", r"\b(story|poem|lyrics|slogan|name ideas)\b", r"\bcreative\b", r"\bimagine\b",
+    ],
+    "casual": [
+        r"^(hi|hey|hello|yo|thanks|thank you)\b", r"\bhow are you\b", r"\bi feel\b", r"\b(lonely|sad|bored|stressed)\b", r"\bjoke\b",
+    ],
+    "productivity": [
+        r"\b(deadline|schedule|to-?do|procrastinat\w*|prioriti[sz]e|time block\w*)\b", r"\bfocus\b", r"\bplan my (day|week)\b",
+    ],
+}
+
+# A rule vote never picks these on its own: the centroid must rank them first too
+# ('research' hands off to the multi-step, web-searching ResearchAgent)
+AGREEMENT_REQUIRED = {"research"}
+
+# Labeled example queries (nearest-centroid classifier)
+ROUTING_EXAMPLES: Dict[str, List[str]] = {
+    "productivity": [
+        "How should I organize my week to finish the project on time?",
+        "I keep getting distracted, help me stay on track",
+        "What should I work on first today?",
+        "Help me break down my tasks for tomorrow",
+    ],
+    "academic": [
+        "What is the difference between epistemology and ontology?",
+        "Summarize the main arguments of Kant's critique of pure reason",
+        "Explain how CRISPR gene editing works with sources",
+        "What does the literature say about spaced repetition?",
+    ],
+    "coder": [
+        "Write a function that reverses a linked list",
+        "Why does my React component re-render twice?",
+        "How do I fix this TypeError in my script?",
+        "Design a database schema for a todo app",
+    ],
+    "analyst": [
+        "What patterns do you see in my monthly spending numbers?",
+        "Calculate the average growth rate from these figures",
+        "Which product category performed best last quarter?",
+        "Find anomalies in this sales data",
+        "Analyze this spreadsheet and summarize the trends",
+    ],
+    "research": [
+        "Research the current state of solid-state batteries",
+        "Give me a deep dive on the causes of the 2008 financial crisis",
+        "Compare the healthcare systems of Germany and Japan in depth",
+        "Investigate the latest evidence on intermittent fasting",
+    ],
+    "casual": [
+        "Hey, how is it going?",
+        "I had a rough day at work",
+        "Tell me something fun",
+        "Can you cheer me up a bit?",
+        "Hi there!",
+        "Thanks, that really helped",
+        "I feel so stressed and tired lately",
+    ],
+    "creative": [
+        "Give me ideas for a fantasy novel plot",
+        "Help me come up with a name for my bakery",
+        "Write a short poem about autumn",
+        "Brainstorm unusual birthday party themes",
+    ],
+}
+
+EMBEDDING_DIM = 512
+
+def normalize_query(query: str) -> str:
+    """Cache key: lowercase, punctuation stripped, whitespace collapsed."""
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+def embed_local(text: str) -> List[float]:
+    """
+    Local feature-hashing embedding (word unigrams + character trigrams).
+    No network call, so routing stays in the sub-millisecond range.
+    """
+    vec = [0.0] * EMBEDDING_DIM
+    words = normalize_query(text).split()
+    features = words + [w[i:i + 3] for w in words for i in range(max(1, len(w) - 2))]
+
+    for feature in features:
+        digest = hashlib.md5(feature.encode()).digest()
+        idx = int.from_bytes(digest[:4], "little") % EMBEDDING_DIM
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vec[idx] += sign
+
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+class FastRouter:
+    """
+    Local routing tier in front of the LLM router.
+    1. Cache: previously routed (normalized) queries.
+    2. Nearest centroid over locally embedded example queries, with keyword/regex rules
+       adding a vote (rule_weight) to the modes they match.
+    The best mode must be similar enough and lead the next by min_margin, so a rule only wins
+    when the centroid agrees or nearly ties; AGREEMENT_REQUIRED modes need the centroid's top spot.
+    Otherwise returns None and the caller falls back to the LLM router.
+    """
+
+    def __init__(
+        self,
+        modes: List[str],
+        min_similarity: float = 0.25,
+        min_margin: float = 0.08,
+        rule_weight: float = 0.1,
+        cache_size: int = 5000
+    ):
+        self.modes = modes
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.rule_weight = rule_weight
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+        self.rules = {
+            mode: [re.compile(p, re.IGNORECASE) for p in patterns]
+            for mode, patterns in ROUTING_RULES.items() if mode in modes
+        }
+        self.centroids = {
+            mode: self._centroid([embed_local(q) for q in examples])
+            for mode, examples in ROUTING_EXAMPLES.items() if mode in modes
+        }
+
+    @staticmethod
+    def _centroid(vectors: List[List[float]]) -> List[float]:
+        summed = [sum(col) for col in zip(*vectors)]
+        norm = math.sqrt(sum(v * v for v in summed)) or 1.0
+        return [v / norm for v in summed]
+
+    def _rule_votes(self, query: str) -> Set[str]:
+        return {mode for mode, patterns in self.rules.items() if any(p.search(query) for p in patterns)}
+
+    def _decide(self, query: str, votes: Set[str]) -> Optional[str]:
+        vec = embed_local(query)
+        similarity = {mode: sum(a * b for a, b in zip(vec, centroid)) for mode, centroid in self.centroids.items()}
+        if not similarity:
+            return None
+
+        scored = sorted(
+            ((sim + (self.rule_weight if mode in votes else 0.0), mode) for mode, sim in similarity.items()),
+            reverse=True
+        )
+        best_score, best_mode = scored[0]
+        margin = best_score - (scored[1][0] if len(scored) > 1 else 0.0)
+        if similarity[best_mode] < self.min_similarity or margin < self.min_margin:
+            return None
+        if best_mode in AGREEMENT_REQUIRED and best_mode != max(similarity, key=similarity.get):
+            return None
+        return best_mode
+
+    def classify(self, query: str) -> Optional[str]:
+        """Returns a mode when confident, None when the LLM router should decide."""
+        start = time.perf_counter()
+        key = normalize_query(query)
+
+        try:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                metrics.incr("router.cache_hits")
+                return self._cache[key]
+
+            votes = self._rule_votes(query)
+            mode = self._decide(query, votes)
+            if mode:
+                metrics.incr("router.rule_hits" if mode in votes else "router.centroid_hits")
+
+            if mode:
+                self.remember(query, mode)
+            return mode
+
+        finally:
+            metrics.observe("router.local", (time.perf_counter() - start) * 1000)
+
+    def remember(self, query: str, mode: str):
+        """Caches a routing decision (also used for LLM decisions)."""
+        key = normalize_query(query)
+        self._cache[key] = mode
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
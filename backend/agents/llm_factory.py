@@ -1,17 +1,149 @@
 import os
-from typing import Any, List, Union
+import hashlib
+from functools import lru_cache
+from typing import Any, List, Union, Optional, AsyncIterator, Iterator
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.runnables import RunnableSequence, RunnablePassthrough, Runnable
+from langchain_core.runnables import RunnableSequence, RunnablePassthrough, RunnableLambda, Runnable, RunnableConfig
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.tools import BaseTool
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 
 from backend.core.config import settings
+from backend.core.singleflight import SingleFlight
+from backend.core.rate_limiter import rate_limiter, estimate_tokens, INTERACTIVE
+from backend.agents.provider_router import provider_router
+from backend.agents.prompt_cache import apply_cache_control, record_cache_usage
+from backend.agents.tool_runtime import guard_tools, SessionCallOrder
 from backend.schemas import AgentConfig
 
+# Shared across all factories: identical in-flight prompts to the same model share one call
+llm_flight = SingleFlight("llm")
+
+class GuardedLLM(Runnable):
+    """
+    Wraps a chat model inside a chain.
+    - ainvoke: identical concurrent prompts (same provider/model/temperature) are coalesced.
+    - ainvoke: hedged across equivalent models and failed over when a provider errors (provider_router).
+    - ainvoke/astream: every call holds a slot in the provider/model rate limiter (priority lane aware).
+    - astream: not hedged; fails over to the next candidate until the first chunk is yielded.
+    - invoke/ainvoke/astream: the system prefix is marked cacheable for Anthropic; cached vs uncached
+      input tokens are reported per chain_name.
+    - invoke/stream (sync): go straight to the primary model, bypassing coalescing, the rate limiter
+      and failover (the guard is async). Request handlers use the async paths; the sync ones are
+      for blocking callers such as AIAgent.generate_subgoals.
+    """
+
+    def __init__(self, factory: "LLMFactory", provider: str, model_name: str, temperature: float, priority: str = INTERACTIVE, chain_name: str = "default", tools: Any = None, tool_kwargs: Optional[dict] = None):
+        self.factory = factory
+        self.chain_name = chain_name
+        self.provider = provider
+        self.model_name = model_name
+        self.temperature = temperature
+        self.priority = priority
+        self.tools = tools
+        self.tool_kwargs = tool_kwargs or {}
+        self._models = {}
+        self.llm = self._model(provider, model_name)
+
+    def _model(self, provider: str, model_name: str) -> Any:
+        """Primary or backup model, built lazily with the same temperature and tools."""
+        key = (provider, model_name)
+        if key not in self._models:
+            llm = self.factory._create_llm(provider, model_name, self.temperature)
+            if self.tools is not None:
+                llm = llm.bind_tools(self.tools, **self.tool_kwargs)
+            self._models[key] = llm
+        return self._models[key]
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "GuardedLLM":
+        """Keeps the guard when an agent binds tools to the model."""
+        return GuardedLLM(self.factory, self.provider, self.model_name, self.temperature, self.priority, self.chain_name, tools, kwargs)
+
+    def _estimate(self, input: Any) -> int:
+        text = input.to_string() if hasattr(input, "to_string") else repr(input)
+        return estimate_tokens(text)
+
+    def _key(self, input: Any) -> str:
+        text = input.to_string() if hasattr(input, "to_string") else repr(input)
+        payload = f"{self.provider}|{self.model_name}|{self.temperature}|{text}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        result = self.llm.invoke(apply_cache_control(self.provider, input), config, **kwargs)
+        record_cache_usage(self.chain_name, getattr(result, "usage_metadata", None))
+        return result
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        est_tokens = self._estimate(input)
+
+        async def attempt(provider: str, model_name: str, has_backup: bool):
+            # With a failover target left, a 429 moves on instead of waiting out Retry-After
+            result = await rate_limiter.run(
+                provider,
+                model_name,
+                lambda: self._model(provider, model_name).ainvoke(apply_cache_control(provider, input), config, **kwargs),
+                priority=self.priority,
+                est_tokens=est_tokens,
+                max_retries=0 if has_backup else 3
+            )
+            record_cache_usage(self.chain_name, getattr(result, "usage_metadata", None))
+            return result
+
+        return await llm_flight.do(self._key(input), lambda: provider_router.call(self.provider, self.model_name, attempt, self.priority))
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        yield from self.llm.stream(input, config, **kwargs)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        # Streams are not hedged, but start on the healthiest candidate and fail over
+        # as long as nothing has been yielded yet.
+        candidates = provider_router.candidates(self.provider, self.model_name)
+        for idx, (provider, model_name) in enumerate(candidates):
+            started = False
+            try:
+                async with rate_limiter.slot(provider, model_name, self.priority, self._estimate(input)) as usage:
+                    async for chunk in self._model(provider, model_name).astream(apply_cache_control(provider, input), config, **kwargs):
+                        started = True
+                        usage_metadata = getattr(chunk, "usage_metadata", None)
+                        if usage_metadata:
+                            usage["tokens"] = (usage["tokens"] or 0) + usage_metadata.get("total_tokens", 0)
+                            record_cache_usage(self.chain_name, usage_metadata)
+                        yield chunk
+                provider_router.health(f"{provider}/{model_name}").record(True)
+                return
+            except Exception as e:
+                provider_router.health(f"{provider}/{model_name}").record(False)
+                if started or idx == len(candidates) - 1:
+                    raise
+                print(f"⚠️ Stream from {provider}/{model_name} failed ({e}). Failing over.")
+
+AGENT_USER_TEMPLATE = """
+Conversation So Far:
+{history}
+
+Information Source: {source_label}
+
+Context:
+{context}
+
+Question: 
+{question}
+"""
+
+def _chain_name(config: AgentConfig) -> str:
+    return "agent." + config.name.lower().replace(" ", "_")
+
+@lru_cache(maxsize=64)
+def _agent_prompt(system_prompt: str, with_scratchpad: bool) -> ChatPromptTemplate:
+    """One template per system prompt: the rendered system message is byte-identical across calls."""
+    messages = [("system", system_prompt), ("user", AGENT_USER_TEMPLATE)]
+    if with_scratchpad:
+        messages.append(("placeholder", "{agent_scratchpad}")) # Required for tool outputs
+    return ChatPromptTemplate.from_messages(messages).partial(source_label="Local Knowledge Base", history="(new conversation)")
+
 class LLMFactory:
     def __init__(self):
         self.openai_api_key = settings.OPENAI_API_KEY
@@ -19,15 +151,16 @@ class LLMFactory:
         self.anthropic_api_key = settings.ANTHROPIC_API_KEY
 
     def _create_llm(self, provider: str, model_name: str, temperature: float) -> Any:
+        # SDK retries are disabled: 429 backoff is handled by the shared rate limiter
         try:
             if provider == "openai":
-                return ChatOpenAI(model=model_name, temperature=temperature, api_key=settings.OPENAI_API_KEY)
+                return ChatOpenAI(model=model_name, temperature=temperature, api_key=settings.OPENAI_API_KEY, max_retries=0, stream_usage=True)
             
             elif provider == "anthropic":
-                return ChatAnthropic(model=model_name, temperature=temperature, api_key=settings.ANTHROPIC_API_KEY)
+                return ChatAnthropic(model=model_name, temperature=temperature, api_key=settings.ANTHROPIC_API_KEY, max_retries=0)
             
             elif provider == "google":
-                return ChatGoogleGenerativeAI(model=model_name, temperature=temperature, api_key=settings.GOOGLE_API_KEY)
+                return ChatGoogleGenerativeAI(model=model_name, temperature=temperature, api_key=settings.GOOGLE_API_KEY, max_retries=0)
             
             else:
                 # Fallback to a safe default if provider is unknown
@@ -39,73 +172,47 @@ class LLMFactory:
             print(f"❌ Failed to create LLM for {provider}/{model_name}: {e}")
             return ChatOpenAI(model="gpt-3.5-turbo", api_key=settings.OPENAI_API_KEY)
     
-    def get_agent_chain(self, config: AgentConfig):
+    def create_guarded_llm(self, provider: str, model_name: str, temperature: float, priority: str = INTERACTIVE, chain_name: str = "default") -> GuardedLLM:
+        """LLM step for chains (prompt | llm | parser) with request coalescing and rate limiting."""
+        return GuardedLLM(self, provider, model_name, temperature, priority, chain_name)
+    
+    def get_agent_chain(self, config: AgentConfig, chain_name: Optional[str] = None):
         """
         Dynamically builds a chain based on the Pydantic Config.
         """
         # 1. Instantiate the specific model requested
-        llm = self._create_llm(provider=config.provider, model_name=config.model, temperature=config.temperature)
+        llm = self.create_guarded_llm(provider=config.provider, model_name=config.model, temperature=config.temperature, chain_name=chain_name or _chain_name(config))
         
-        # 2. Prompt with SOURCE_LABEL variable
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", config.system_prompt),
-            ("user", 
-             """
-             Information Source: {source_label}
-             
-             Context:
-             {context}
-             
-             Question: 
-             {question}
-             """)
-        ])
+        # 2. Static system prompt first (cacheable prefix), per-call data in the user message
+        prompt = _agent_prompt(config.system_prompt, with_scratchpad=False)
         
         # 3. Build Chain
-        chain = (
-            {
-                "context": RunnablePassthrough(), 
-                "question": RunnablePassthrough(),
-                "source_label": RunnablePassthrough() # Passed from Service
-            }
-            | prompt 
-            | llm 
-            | StrOutputParser()
-        )
-        
-        return chain
+        return prompt | llm | StrOutputParser()
     
-    def get_agent_runner(self, config: AgentConfig, tools: List[BaseTool]) -> AgentExecutor:
+    def get_agent_runner(self, config: AgentConfig, tools: List[BaseTool], chain_name: Optional[str] = None) -> AgentExecutor:
         """
         Returns a Runnable that supports Tool Calling.
         Replaces 'get_agent_chain' for advanced agents.
         """
-        llm = self._create_llm(config.provider, config.model, config.temperature)
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", config.system_prompt),
-            ("user", 
-             """
-             Information Source: {source_label}
-             
-             Context:
-             {context}
-             
-             Question: 
-             {question}
-             """),
-            ("placeholder", "{agent_scratchpad}"), # Required for tool outputs
-        ])
+        llm = self.create_guarded_llm(config.provider, config.model, config.temperature, chain_name=chain_name or _chain_name(config))
+
+        prompt = _agent_prompt(config.system_prompt, with_scratchpad=True)
+        
+        # Cached, time-budgeted tools (one budget per run); session-bound calls run in the order issued
+        call_order = SessionCallOrder(tools)
+        tools = guard_tools(tools, call_order=call_order)
         
         # Create the Agent (The Brain that decides which tool to call)
-        agent = create_tool_calling_agent(llm, tools, prompt)
+        agent = create_tool_calling_agent(llm, tools, prompt) | RunnableLambda(call_order.plan)
         
         # Create the Executor (The Runtime that actually runs the tools and loops back)
+        # Run it with ainvoke: tool calls from one model turn then execute concurrently
         executor = AgentExecutor(
             agent=agent, 
             tools=tools, 
             verbose=True, # Logs thoughts to console
-            handle_parsing_errors=True # Auto-retry if LLM makes a typo in tool call
+            handle_parsing_errors=True, # Auto-retry if LLM makes a typo in tool call
+            max_iterations=settings.AGENT_MAX_ITERATIONS
         )
         
         return executor
\ No newline at end of file
@@ -1,28 +1,57 @@
 import json
-from typing import Literal
+from typing import Literal, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 
 from backend.core.config import settings
+from backend.core.metrics import metrics
 from backend.agents.presets import AGENT_MODES
+from backend.agents.llm_factory import LLMFactory
+from backend.core.singleflight import SingleFlight
+from backend.agents.fast_router import FastRouter, normalize_query
 
 class AgentOrchestrator:
     def __init__(self):
         # Use a fast, cheap model for routing (e.g., GPT-3.5-Turbo or GPT-4o-mini)
-        self.router_llm = ChatOpenAI(
-            model="gpt-3.5-turbo", 
-            temperature=0, 
-            api_key=settings.OPENAI_API_KEY
-        )
+        # Goes through the shared rate limiter (interactive lane)
+        self.router_llm = LLMFactory().create_guarded_llm("openai", "gpt-3.5-turbo", 0, chain_name="router")
         
         # Dynamically build list of available modes from your presets
-        self.available_modes = list(AGENT_MODES.keys()) # e.g. ['productivity', 'academic', 'casual']
+        # 'research' has no preset: it hands off to the ResearchAgent
+        self.available_modes = list(AGENT_MODES.keys()) + ["research"] # e.g. ['productivity', 'academic', 'casual']
+        
+        # Local tier (cache -> rules -> nearest centroid); the LLM is only asked when it is unsure
+        self.fast_router = FastRouter(self.available_modes)
+        
+        # Identical concurrent queries (e.g. after a notification, or client retries) share one LLM routing call
+        self._llm_flight = SingleFlight("router")
 
     async def route_query(self, query: str) -> str:
         """
         Analyzes the query and returns the best matching AGENT_MODE key.
         """
+        mode = self.fast_router.classify(query)
+        if mode:
+            metrics.incr("router.llm_calls_avoided")
+            return mode
+        
+        return await self._llm_flight.do(normalize_query(query), lambda: self._route_and_remember(query))
+
+    async def _route_and_remember(self, query: str) -> str:
+        metrics.incr("router.llm_calls")
+        with metrics.timer("router.llm"):
+            mode = await self._route_with_llm(query)
+        
+        if mode is None:
+            # Failed or unusable answer: fall back for this call only, never cache it
+            metrics.incr("router.llm_fallbacks")
+            return "productivity"
+        self.fast_router.remember(query, mode)
+        return mode
+
+    async def _route_with_llm(self, query: str) -> Optional[str]:
+        """Slow path: asks the router LLM. None if the call failed or the answer is not a mode."""
         system_prompt = f"""
         You are the Master Router for LifeOS.
         Your job is to select the best specialised AI Agent for a given user query.
@@ -56,8 +85,9 @@ class AgentOrchestrator:
             
             if mode in self.available_modes:
                 return mode
-            return "productivity" # Default fallback
+            print(f"⚠️ Router returned an unknown mode: {mode!r}")
+            return None
             
         except Exception as e:
             print(f"Routing failed: {e}")
-            return "productivity"
\ No newline at end of file
+            return None
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+Provider-side prompt caching.
+
+All chains keep their long static instructions (and format instructions) in the system
+message and put per-call data (question, context, deadline...) in the user message, so the
+system message is a byte-stable prefix.
+- OpenAI / Google cache stable prefixes automatically.
+- Anthropic needs an explicit cache_control breakpoint, added here.
+"""
+
+from typing import Any, List
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from backend.core.metrics import metrics
+
+def to_messages(input: Any) -> List[BaseMessage]:
+    if hasattr(input, "to_messages"):
+        return input.to_messages()
+    return list(input) if isinstance(input, list) else []
+
+def apply_cache_control(provider: str, input: Any) -> Any:
+    """Marks the system prefix as cacheable for Anthropic; other providers get the input unchanged."""
+    if provider != "anthropic":
+        return input
+
+    messages = to_messages(input)
+    if not messages or not isinstance(messages[0], SystemMessage) or not isinstance(messages[0].content, str):
+        return input
+
+    system = SystemMessage(content=[{
+        "type": "text",
+        "text": messages[0].content,
+        "cache_control": {"type": "ephemeral"}
+    }])
+    return [system, *messages[1:]]
+
+def record_cache_usage(chain_name: str, usage_metadata: dict):
+    """Cached vs uncached input tokens per chain (LangChain's standard input_token_details)."""
+    if not usage_metadata:
+        return
+    input_tokens = usage_metadata.get("input_tokens", 0) or 0
+    details = usage_metadata.get("input_token_details") or {}
+    cached = details.get("cache_read", 0) or 0
+
+    metrics.incr(f"prompt_cache.{chain_name}.cached_input_tokens", cached)
+    metrics.incr(f"prompt_cache.{chain_name}.uncached_input_tokens", max(0, input_tokens - cached))
+    if details.get("cache_creation"):
+        metrics.incr(f"prompt_cache.{chain_name}.cache_write_tokens", details["cache_creation"])
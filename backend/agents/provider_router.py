@@ -0,0 +1,183 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend.core.config import settings
+from backend.core.metrics import metrics, LatencyTracker
+from backend.core.rate_limiter import INTERACTIVE, BACKGROUND
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class ProviderHealth:
+    """Rolling latency / error rate and a circuit breaker for one provider/model."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.latency = LatencyTracker(window=200)
+        self.outcomes = deque(maxlen=50) # True = success
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes) if self.outcomes else 0.0
+
+    def allows_request(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= settings.LLM_CIRCUIT_COOLDOWN_SECONDS:
+            self.state = HALF_OPEN # Let a probe through
+        return self.state != OPEN
+
+    def record(self, ok: bool, latency_ms: Optional[float] = None):
+        """latency_ms is only tracked for complete (non-streaming) successful calls."""
+        self.outcomes.append(ok)
+        if ok:
+            if latency_ms is not None:
+                self.latency.record(latency_ms)
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            return
+
+        self.consecutive_failures += 1
+        tripped = (
+            self.state == HALF_OPEN
+            or self.consecutive_failures >= settings.LLM_CIRCUIT_FAILURE_THRESHOLD
+            or (len(self.outcomes) >= 10 and self.error_rate >= settings.LLM_CIRCUIT_ERROR_RATE)
+        )
+        if tripped and self.state != OPEN:
+            print(f"🔌 Circuit OPEN for {self.key} (error rate {self.error_rate:.0%})")
+            metrics.incr(f"llm_router.{self.key}.circuit_opened")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def hedge_delay_s(self) -> float:
+        """p95 of recent successful calls; a fixed default until enough samples exist."""
+        if len(self.latency.samples) < 20:
+            return settings.LLM_HEDGE_DEFAULT_DELAY_MS / 1000
+        return max(settings.LLM_HEDGE_MIN_DELAY_MS, self.latency.percentile(95)) / 1000
+
+    def snapshot(self) -> Dict:
+        return {"state": self.state, "error_rate": round(self.error_rate, 3), **self.latency.snapshot()}
+
+class ProviderRouter:
+    """
+    Latency-aware provider selection for LLM calls.
+    - Equivalence classes (settings.LLM_EQUIVALENCE_CLASSES, disjoint) define which models may stand in
+      for each other; backups are tried cheapest first (settings.LLM_COST_PER_MTOK), then by p95 latency.
+    - Hedging: if the primary has not answered after its p95 latency, the best backup is fired too;
+      the first successful response wins and the loser is cancelled. Background calls are never
+      hedged (nobody is waiting, and a hedge doubles the cost).
+    - Failover: errors move on to the next healthy candidate immediately.
+    - Circuit breakers skip models that keep failing until a cooldown probe succeeds.
+    """
+
+    def __init__(self, equivalence_classes: Optional[List[List[str]]] = None):
+        self._health: Dict[str, ProviderHealth] = {}
+        self._class_of: Dict[str, List[str]] = {}
+        for group in settings.LLM_EQUIVALENCE_CLASSES if equivalence_classes is None else equivalence_classes:
+            for key in group:
+                if key in self._class_of:
+                    raise ValueError(f"LLM_EQUIVALENCE_CLASSES: {key} is in more than one class")
+                self._class_of[key] = group
+
+    def health(self, key: str) -> ProviderHealth:
+        if key not in self._health:
+            self._health[key] = ProviderHealth(key)
+        return self._health[key]
+
+    def candidates(self, provider: str, model: str) -> List[Tuple[str, str]]:
+        """Primary first (if its circuit allows), then healthy equivalents, cheapest first, then by p95 latency."""
+        primary = f"{provider}/{model}"
+        backups = [key for key in self._class_of.get(primary, []) if key != primary]
+
+        healthy_backups = [key for key in backups if self.health(key).allows_request()]
+        healthy_backups.sort(key=lambda key: (
+            settings.LLM_COST_PER_MTOK.get(key, float("inf")),
+            self.health(key).latency.percentile(95) or float("inf")
+        ))
+
+        ordered = ([primary] if self.health(primary).allows_request() else []) + healthy_backups
+        if not ordered:
+            ordered = [primary] # Everything is open: still try the requested model
+        return [tuple(key.split("/", 1)) for key in ordered]
+
+    async def _attempt(self, provider: str, model: str, make_call: Callable[[str, str, bool], Awaitable[Any]], has_backup: bool) -> Any:
+        key = f"{provider}/{model}"
+        start = time.perf_counter()
+        try:
+            result = await make_call(provider, model, has_backup)
+        except asyncio.CancelledError:
+            raise # Lost a hedge race: not a provider failure
+        except Exception:
+            self.health(key).record(False, (time.perf_counter() - start) * 1000)
+            metrics.incr(f"llm_router.{key}.errors")
+            raise
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.health(key).record(True, latency_ms)
+        metrics.observe(f"llm_router.{key}", latency_ms)
+        return result
+
+    async def call(self, provider: str, model: str, make_call: Callable[[str, str, bool], Awaitable[Any]], priority: str = INTERACTIVE) -> Any:
+        """
+        make_call(provider, model, has_backup) performs one attempt.
+        'has_backup' lets the caller skip its own retries when a failover target exists.
+        BACKGROUND calls still fail over on errors, but are never hedged.
+        """
+        hedge = priority != BACKGROUND
+        candidates = self.candidates(provider, model)
+        if candidates[0] != (provider, model):
+            metrics.incr("llm_router.failover_routed")
+
+        pending: Dict[asyncio.Task, Tuple[str, str]] = {}
+        next_idx = 0
+        last_error: Exception = None
+
+        def launch():
+            nonlocal next_idx
+            p, m = candidates[next_idx]
+            next_idx += 1
+            task = asyncio.create_task(self._attempt(p, m, make_call, has_backup=next_idx < len(candidates)))
+            pending[task] = (p, m)
+
+        launch()
+        try:
+            while pending:
+                # Hedge after the p95 of the oldest in-flight attempt, if a backup is left
+                hedge_timeout = None
+                if hedge and next_idx < len(candidates):
+                    first_key = "/".join(next(iter(pending.values())))
+                    hedge_timeout = self.health(first_key).hedge_delay_s()
+
+                done, _ = await asyncio.wait(pending.keys(), timeout=hedge_timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    p, m = candidates[next_idx]
+                    print(f"🏁 Hedging slow {'/'.join(next(iter(pending.values())))} with {p}/{m}")
+                    metrics.incr("llm_router.hedges_fired")
+                    launch()
+                    continue
+
+                for task in done:
+                    winner = pending.pop(task)
+                    if task.exception() is None:
+                        if winner != (provider, model):
+                            metrics.incr("llm_router.backup_wins")
+                        return task.result()
+                    last_error = task.exception()
+
+                # Failed attempt(s): fail over right away if nothing else is running
+                if not pending and next_idx < len(candidates):
+                    metrics.incr("llm_router.failovers")
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error
+
+    def snapshot(self) -> Dict:
+        return {key: health.snapshot() for key, health in self._health.items()}
+
+# Singleton
+provider_router = ProviderRouter()
@@ -1,13 +1,30 @@
+import math
+import time
 import asyncio
-from typing import List, Dict
+import hashlib
+from typing import List, Dict, AsyncIterator
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 
 from backend.schemas import ResearchPlan, AgentConfig
 from backend.agents.llm_factory import LLMFactory
 from backend.agents.tools import AgentTools
+from backend.agents.tool_runtime import run_guarded
+from backend.agents.context_builder import ResearchContextBuilder
 from backend.pkm.rag_service import rag_service
 from backend.core.config import settings
+from backend.core.metrics import metrics
+
+SYNTHESIS_SYSTEM_PROMPT = """
+You are a Deep Research Synthesizer and Comprehensive Report Writer.
+Synthesize a vast amount of gathered information into a coherent, cited, and detailed answer.
+
+Your Goal: Write a definitive, comprehensive answer to the Question based ONLY on the provided Context.
+- Structure the answer with clear headings.
+- You MUST cite the sources provided in the context (e.g., [Source: url]).
+- If the context contradicts itself, note the conflict.
+- Be exhaustive.
+"""
 
 class ResearchAgent:
     def __init__(self):
@@ -29,16 +46,21 @@ class ResearchAgent:
             provider="anthropic", # Claude 3 Opus/Sonnet is excellent for synthesis
             model="claude-3-opus-20240229",
             temperature=0.4,
-            system_prompt="You are a Comprehensive Report Writer. Synthesize a vast amount of gathered information into a coherent, cited, and detailed answer."
+            system_prompt=SYNTHESIS_SYSTEM_PROMPT
         )
+        
+        # Background ingestion: caps concurrent vector-store writes across all research runs
+        self._ingest_semaphore = asyncio.Semaphore(settings.RESEARCH_INGEST_CONCURRENCY)
+        self._background_tasks = set() # Strong refs so pending ingestions are not garbage collected
 
     async def run_deep_research(self, user_query: str, user_id: int) -> str:
         """
         Executes the full Deep Research Workflow:
         1. PLAN: Generate queries.
         2. EXECUTE: Parallel web search.
-        3. INGEST: Save findings to User DB.
-        4. SYNTHESIZE: Generate final answer.
+        3. INGEST: Save findings to User DB (background, batched).
+        4. COMPRESS: Dedup, rerank and budget the context.
+        5. SYNTHESIZE: Generate final answer.
         """
         print(f"🕵️‍♀️ Starting Deep Research for: {user_query}")
 
@@ -53,47 +75,193 @@ class ResearchAgent:
         search_results_list = await asyncio.gather(*tasks)
         
         # Flatten results (List of Lists -> Single List)
-        # Normalize to a list of dicts: [{'content': '...', 'url': '...'}]
         aggregated_findings = []
         for res in search_results_list:
-            if isinstance(res, list):
-                aggregated_findings.extend(res)
-            elif isinstance(res, str):
-                aggregated_findings.append({"content": res, "url": "web_search"})
+            aggregated_findings.extend(self._normalize_results(res))
 
-        # --- STEP 3: JUST-IN-TIME INGESTION ---
-        # Ingest everything found into the Vector DB immediately.
-        print(f" 💾 Ingesting {len(aggregated_findings)} snippets into PKM...")
+        # --- STEP 3: DEDUP + BACKGROUND INGESTION ---
+        # Group by URL and drop repeated snippets (same page returned by several queries).
+        findings_by_url = self._group_findings(aggregated_findings)
         
-        ingestion_tasks = []
-        full_context_text = ""
+        # Ingest into the Vector DB off the critical path: synthesis does not wait for the writes.
+        self._schedule_ingestion(findings_by_url, user_id)
+
+        # --- STEP 4: CONTEXT COMPRESSION ---
+        # Near-duplicate removal + BM25 rerank + token budget, instead of sending everything.
+        builder = ResearchContextBuilder(
+            user_query,
+            concepts=plan.required_concepts,
+            token_budget=settings.RESEARCH_CONTEXT_TOKEN_BUDGET
+        )
+        builder.add(aggregated_findings)
+        full_context_text = builder.build()
+        self._report_context_stats(builder)
+
+        # --- STEP 5: THE SYNTHESIZER ---
+        print("   🧠 Synthesizing Final Report...")
+        with metrics.timer("research.synthesis"):
+            final_answer = await self._synthesize_report(user_query, plan, full_context_text)
         
-        for item in aggregated_findings:
-            content = item.get('content', '')
-            source = item.get('url', 'Deep Research')
-            
+        return final_answer
+
+    async def stream_deep_research(self, user_query: str, user_id: int) -> AsyncIterator[str]:
+        """
+        Streaming / early-start variant of run_deep_research.
+        Searches stream in via as_completed (each with its own deadline, all within a global budget);
+        synthesis starts as soon as the context budget is filled or a quorum of searches finished,
+        and the report is yielded chunk by chunk.
+        """
+        print(f"🕵️‍♀️ Starting Streaming Deep Research for: {user_query}")
+
+        # --- STEP 1: THE PLANNER ---
+        plan = await self._generate_plan(user_query)
+        print(f" 📝 Plan Generated: {len(plan.search_queries)} queries")
+
+        # --- STEP 2: THE EXECUTOR (Streaming) ---
+        builder = ResearchContextBuilder(
+            user_query,
+            concepts=plan.required_concepts,
+            token_budget=settings.RESEARCH_CONTEXT_TOKEN_BUDGET
+        )
+        aggregated_findings = await self._collect_findings(plan.search_queries, builder)
+
+        # --- STEP 3: BACKGROUND INGESTION ---
+        self._schedule_ingestion(self._group_findings(aggregated_findings), user_id)
+
+        # --- STEP 4: THE SYNTHESIZER (Streamed) ---
+        print("   🧠 Streaming Final Report...")
+        context = builder.build()
+        self._report_context_stats(builder)
+        
+        chain = self._build_synthesis_chain()
+        async for chunk in chain.astream(self._synthesis_input(user_query, plan, context)):
+            yield chunk
+
+    async def _collect_findings(self, queries: List[str], builder: ResearchContextBuilder) -> List[Dict]:
+        """
+        Runs searches concurrently and feeds results into the builder as they complete.
+        Stops early on: context budget filled, quorum of searches reached, or the global time budget.
+        Slow searches still running at that point are cancelled.
+        """
+        start = time.monotonic()
+        quorum = max(1, math.ceil(len(queries) * settings.RESEARCH_QUORUM))
+
+        async def bounded_search(query: str):
+            try:
+                return await asyncio.wait_for(self._execute_search(query), settings.RESEARCH_QUERY_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                print(f" ⏱️ Query timed out '{query}'")
+                return []
+
+        tasks = [asyncio.create_task(bounded_search(q)) for q in queries]
+        aggregated_findings = []
+        completed = 0
+
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=settings.RESEARCH_TIME_BUDGET_SECONDS):
+                findings = self._normalize_results(await next_done)
+                aggregated_findings.extend(findings)
+                builder.add(findings)
+                completed += 1
+
+                if builder.is_full:
+                    print(f" ⚡ Context budget filled after {completed}/{len(queries)} searches.")
+                    break
+                if completed >= quorum and completed < len(queries):
+                    print(f" ⚡ Quorum reached ({completed}/{len(queries)}). Starting synthesis.")
+                    break
+
+        except asyncio.TimeoutError:
+            print(f" ⏱️ Search budget exhausted after {completed}/{len(queries)} searches.")
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        print(f" ↳ Collected {len(aggregated_findings)} snippets in {time.monotonic() - start:.1f}s")
+        return aggregated_findings
+
+    def _report_context_stats(self, builder: ResearchContextBuilder):
+        """Logs and records how much the compression stage saved."""
+        stats = builder.stats
+        # Prompt prefill time scales ~linearly with input tokens
+        est_saved_ms = stats["tokens_saved"] / settings.RESEARCH_PREFILL_TOKENS_PER_SECOND * 1000
+        
+        print(
+            f" 🗜️ Context: {stats['input_tokens']} -> {stats['packed_tokens']} tokens "
+            f"({stats['duplicates_removed']} near-duplicates removed, ~{est_saved_ms:.0f}ms prefill saved, "
+            f"{stats['dedup_ms'] + stats['rerank_ms']:.0f}ms spent compressing)"
+        )
+        metrics.incr("research.context_input_tokens", stats["input_tokens"])
+        metrics.incr("research.context_tokens_saved", stats["tokens_saved"])
+        metrics.incr("research.near_duplicates_removed", stats["duplicates_removed"])
+        metrics.incr("research.est_prefill_ms_saved", est_saved_ms)
+        metrics.observe("research.context_compression", stats["dedup_ms"] + stats["rerank_ms"])
+
+    def _normalize_results(self, res) -> List[Dict]:
+        """Normalize to a list of dicts: [{'content': '...', 'url': '...'}]"""
+        if isinstance(res, list):
+            return res
+        elif isinstance(res, str):
+            return [{"content": res, "url": "web_search"}]
+        return []
+
+    def _schedule_ingestion(self, findings_by_url: Dict[str, List[str]], user_id: int):
+        """Starts the bulk ingestion in the background and keeps a reference until it finishes."""
+        print(f" 💾 Scheduling ingestion of {len(findings_by_url)} sources into PKM...")
+        task = asyncio.create_task(self._ingest_findings(findings_by_url, user_id))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _group_findings(self, findings: List[Dict]) -> Dict[str, List[str]]:
+        """Groups snippets by source URL, keeping only the first copy of each distinct content."""
+        grouped: Dict[str, List[str]] = {}
+        seen_hashes = set()
+        
+        for item in findings:
+            content = (item.get('content') or '').strip()
             if not content: continue
             
-            full_context_text += f"Source: {source}\nContent: {content}\n\n"
+            content_hash = hashlib.sha256(" ".join(content.split()).lower().encode('utf-8')).hexdigest()
+            if content_hash in seen_hashes: continue
+            seen_hashes.add(content_hash)
             
-            # Async Ingestion 
-            # Wait to ensure consistency for future queries
-            ingestion_tasks.append(
-                asyncio.to_thread(
-                    rag_service.ingest_text, 
-                    text=content, 
-                    source=f"DeepResearch: {source}", 
-                    user_id=user_id
-                )
-            )
-        
-        await asyncio.gather(*ingestion_tasks)
-
-        # --- STEP 4: THE SYNTHESIZER ---
-        print("   🧠 Synthesizing Final Report...")
-        final_answer = await self._synthesize_report(user_query, plan, full_context_text)
+            grouped.setdefault(item.get('url') or 'Deep Research', []).append(content)
         
-        return final_answer
+        return grouped
+
+    async def _ingest_findings(self, findings_by_url: Dict[str, List[str]], user_id: int):
+        """
+        Writes findings as one document per URL through bulk ingest calls.
+        Batches run concurrently, bounded by the shared semaphore.
+        """
+        documents = [
+            {
+                "text": "\n\n".join(snippets),
+                "summary": snippets[0][:1000],
+                "metadata": {
+                    "source_url": source,
+                    "title": f"DeepResearch: {source}",
+                    "user_id": user_id,
+                    "scope": "private"
+                }
+            }
+            for source, snippets in findings_by_url.items()
+        ]
+        batch_size = settings.RESEARCH_INGEST_BATCH_SIZE
+        
+        async def write_batch(batch: List[Dict]):
+            async with self._ingest_semaphore:
+                await asyncio.to_thread(rag_service.ingest_batch, batch)
+        
+        results = await asyncio.gather(
+            *[write_batch(documents[i:i + batch_size]) for i in range(0, len(documents), batch_size)],
+            return_exceptions=True
+        )
+        
+        for result in results:
+            if isinstance(result, Exception):
+                print(f" ❌ Research ingestion batch failed: {result}")
 
     async def _generate_plan(self, query: str) -> ResearchPlan:
         """Uses LLM to generate search queries."""
@@ -101,15 +269,17 @@ class ResearchAgent:
         
         # Get runner (using strict JSON mode if provider supports it, or parsing)
         # Rely on the prompt to enforce format here
-        llm = self.llm_factory._create_llm(
+        llm = self.llm_factory.create_guarded_llm(
             self.planner_config.provider, 
             self.planner_config.model, 
-            self.planner_config.temperature
+            self.planner_config.temperature,
+            chain_name="research.plan"
         )
         
+        # Format instructions are static: keep them in the cacheable system prefix
         prompt = ChatPromptTemplate.from_messages([
-            ("system", self.planner_config.system_prompt),
-            ("user", "User Question: {question}\n\n{format_instructions}")
+            ("system", self.planner_config.system_prompt + "\n\n{format_instructions}"),
+            ("user", "User Question: {question}")
         ])
         
         chain = prompt | llm | parser
@@ -122,39 +292,25 @@ class ResearchAgent:
     async def _execute_search(self, query: str) -> List[Dict]:
         """Runs a single search query."""
         try:
-            # Use 'arun' if available (async), else wrap sync run
-            if hasattr(self.web_search_tool, 'arun'):
-                return await self.web_search_tool.arun(query)
-            else:
-                return await asyncio.to_thread(self.web_search_tool.run, query)
+            # Shared tool result cache: repeated research queries skip Tavily
+            return await run_guarded(self.web_search_tool, query, budget=None)
         except Exception as e:
             print(f" ❌ Query failed '{query}': {e}")
             return []
 
     async def _synthesize_report(self, query: str, plan: ResearchPlan, context: str) -> str:
         """Generates the final answer."""
-        system_prompt = f"""
-        You are a Deep Research Synthesizer. 
-        User Question: "{query}"
-        
-        Research Strategy Used: {plan.explanation}
-        
-        Your Goal: Write a definitive, comprehensive answer based ONLY on the provided Context.
-        - Structure the answer with clear headings.
-        - You MUST cite the sources provided in the context (e.g., [Source: url]).
-        - If the context contradicts itself, note the conflict.
-        - Be exhaustive.
-        """
-        
-        # Create a temp config for the factory
-        config = self.synthesizer_config.copy()
-        config.system_prompt = system_prompt
-        
-        chain = self.llm_factory.get_agent_chain(config)
-        
-        # We pass context as 'context' variable
-        return await chain.ainvoke({
+        chain = self._build_synthesis_chain()
+        return await chain.ainvoke(self._synthesis_input(query, plan, context))
+
+    def _synthesis_input(self, query: str, plan: ResearchPlan, context: str) -> Dict:
+        # Query and strategy go in the user message; the system prompt stays byte-stable
+        return {
             "context": context,
-            "question": query, 
+            "question": f"{query}\n\nResearch Strategy Used: {plan.explanation}",
             "source_label": "Deep Research Aggregation"
-        })
\ No newline at end of file
+        }
+
+    def _build_synthesis_chain(self):
+        """Synthesizer chain shared by the blocking and streaming modes."""
+        return self.llm_factory.get_agent_chain(self.synthesizer_config, chain_name="research.synthesis")
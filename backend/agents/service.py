@@ -1,20 +1,72 @@
 import re
 import ast
+import time
+import asyncio
 import hashlib
 import json
 from typing import List, Dict
 from datetime import date
-from langchain_core.prompts import PromptTemplate
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.documents import Document
 from langchain_community.tools import SerperDevTool
 from functools import lru_cache
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.agents.llm_factory import LLMFactory
 from backend.agents.tools import AgentTools
+from backend.agents.tool_runtime import run_guarded
 from backend.pkm.rag_service import RAGService
 from backend.agents.presets import AGENT_MODES
 from backend.agents.orchestrator import AgentOrchestrator
 from backend.agents.research_agent import ResearchAgent
+from backend.services.user_service import get_user_agent_config
+from backend.services.conversation_service import conversation_memory, EMPTY_HISTORY, DEFAULT_CONVERSATION
+from backend.agents.fallback_predictor import FallbackPredictor
+from backend.core.config import settings
+from backend.core.metrics import metrics
+
+SUBGOAL_SYSTEM_PROMPT = """
+You are an expert Project Manager and Productivity Strategist.
+
+Task:
+1. Break the user's GOAL into 3-6 sequential Milestones (Sub-goals).
+2. Estimate the number of "Work Sessions" (days) required for each milestone.
+3. Ensure the plan fits within the deadline (if provided).
+
+Return ONLY a raw JSON list of objects. Do not write markdown.
+Format:
+[
+    {{"title": "Milestone 1 Name", "estimated_sessions": 5, "description": "Brief outcome description"}},
+    {{"title": "Milestone 2 Name", "estimated_sessions": 3, "description": "..."}}
+]
+"""
+
+REPLAN_SYSTEM_PROMPT = """
+You are a supportive Productivity Coach.
+The user FAILED to complete the listed tasks last week.
+
+Diagnosis: These tasks were likely too vague or difficult.
+
+Task:
+1. Break EACH failed task down into 2-3 atomic, easy "Micro-Tasks".
+2. Assign a difficulty rating (1=Trivial, 5=Hard).
+
+Return ONLY a raw JSON list of objects.
+Format:
+[
+    {{"description": "Draft just the first paragraph", "difficulty": 1, "parent_task": "Write Essay"}},
+    {{"description": "Find 3 sources", "difficulty": 2, "parent_task": "Research"}}
+]
+"""
+
+def _discard(*tasks):
+    """Cancels speculative tasks that are no longer needed; a failure they already had is retrieved, not logged as lost."""
+    for task in tasks:
+        if task is None:
+            continue
+        task.cancel()
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
 
 class AIAgent:
     def __init__(self):
@@ -22,8 +74,13 @@ class AIAgent:
         self.orchestrator = AgentOrchestrator()
         self.rag = RAGService()
         self.web_search_tool = AgentTools.get_web_search_tool()
-        self.code_tool = AgentTools.get_code_interpreter_tool()
         self.research_agent = ResearchAgent()
+        self.fallback_predictor = FallbackPredictor(
+            threshold=settings.SPECULATIVE_SEARCH_THRESHOLD,
+            budget_per_hour=settings.SPECULATIVE_SEARCH_BUDGET_PER_HOUR,
+            max_users=settings.SPECULATIVE_PREDICTOR_MAX_USERS,
+            max_terms=settings.SPECULATIVE_PREDICTOR_MAX_TERMS
+        )
     
     def _parse_llm_json(self, content: str) -> List[Dict]:
         """
@@ -43,10 +100,16 @@ class AIAgent:
             lines = [line.strip() for line in content.split('\n') if line.strip()]
             return [{"title": line, "estimated_days": 7} for line in lines]
         
-    def generate_subgoals(self, goal_text: str, deadline: date, days_per_week: int) -> List[Dict]:
-        """
-        Breaks Goal -> SubGoals (Milestones).
-        """
+    def _subgoal_chain(self):
+        # Static instructions in the system prompt (cacheable prefix), goal and deadline in the user message
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", SUBGOAL_SYSTEM_PROMPT),
+            ("user", 'GOAL: "{goal}"\nCONTEXT: {time_context}\nCONSTRAINTS: The user works on this {days_per_week} days per week.')
+        ])
+        llm = self.llm_factory.create_guarded_llm("openai", "gpt-4o", 0.5, chain_name="goals.subgoals")
+        return prompt | llm | StrOutputParser()
+
+    def _subgoal_input(self, goal_text: str, deadline: date, days_per_week: int) -> Dict:
         # Calculate context for the AI
         today = date.today()
         time_context = ""
@@ -55,73 +118,45 @@ class AIAgent:
             time_context = f"DEADLINE: {deadline} ({days_remaining} days remaining)."
         else:
             time_context = "NO HARD DEADLINE. Plan for a reasonable pace."
+        return {"goal": goal_text, "time_context": time_context, "days_per_week": days_per_week}
 
-        system_prompt = f"""
-        You are an expert Project Manager and Productivity Strategist.
-        
-        GOAL: "{goal_text}"
-        CONTEXT: {time_context}
-        CONSTRAINTS: The user works on this {days_per_week} days per week.
+    def _replan_chain(self):
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", REPLAN_SYSTEM_PROMPT),
+            ("user", "FAILED TASKS: {failed_tasks}")
+        ])
         
-        Task:
-        1. Break this goal into 3-6 sequential Milestones (Sub-goals).
-        2. Estimate the number of "Work Sessions" (days) required for each milestone.
-        3. Ensure the plan fits within the deadline (if provided).
+        # We need a chain that goes Prompt -> LLM -> String
+        llm = self.llm_factory.create_guarded_llm("openai", "gpt-4o", 0.5, chain_name="goals.replan")
+        return prompt | llm | StrOutputParser()
         
-        Return ONLY a raw JSON list of objects. Do not write markdown.
-        Format:
-        [
-            {{"title": "Milestone 1 Name", "estimated_sessions": 5, "description": "Brief outcome description"}},
-            {{"title": "Milestone 2 Name", "estimated_sessions": 3, "description": "..."}}
-        ]
+    def generate_subgoals(self, goal_text: str, deadline: date, days_per_week: int) -> List[Dict]:
         """
-        
-        # Create chain using the factory
-        chain = self.llm_factory.create_generation_chain(system_prompt)
-        
-        # Invoke (We pass an empty input dict because all info is in the system prompt formatted above)
-        # Or cleaner: Pass variables into invoke if you use PromptTemplate params.
-        # Here we simple inject variables into string for simplicity.
-        response = chain.invoke({"input": "Generate Plan"}) 
-        
+        Breaks Goal -> SubGoals (Milestones).
+        Blocking: only for sync callers. Request handlers use agenerate_subgoals.
+        """
+        response = self._subgoal_chain().invoke(self._subgoal_input(goal_text, deadline, days_per_week))
+        return self._parse_llm_json(response)
+
+    async def agenerate_subgoals(self, goal_text: str, deadline: date, days_per_week: int) -> List[Dict]:
+        """Async version of generate_subgoals: does not block the event loop during the LLM call."""
+        with metrics.timer("goals.decompose"):
+            response = await self._subgoal_chain().ainvoke(self._subgoal_input(goal_text, deadline, days_per_week))
         return self._parse_llm_json(response)
     
     def replan_week(self, failed_tasks: List[str]) -> List[Dict]:
         """
         Breaks failed tasks into Micro-Tasks.
+        Blocking: only for sync callers. Request handlers use areplan_week.
         """
-        task_list_str = ", ".join(failed_tasks)
-        
-        system_prompt = """
-        You are a supportive Productivity Coach.
-        The user FAILED to complete the following tasks last week:
-        
-        FAILED TASKS: {failed_tasks}
-        
-        Diagnosis: These tasks were likely too vague or difficult.
-        
-        Task:
-        1. Break EACH failed task down into 2-3 atomic, easy "Micro-Tasks".
-        2. Assign a difficulty rating (1=Trivial, 5=Hard).
-        
-        Return ONLY a raw JSON list of objects.
-        Format:
-        [
-            {{"description": "Draft just the first paragraph", "difficulty": 1, "parent_task": "Write Essay"}},
-            {{"description": "Find 3 sources", "difficulty": 2, "parent_task": "Research"}}
-        ]
-        """
-        
-        # Use PromptTemplate explicitly here to inject variable safely
-        prompt = PromptTemplate.from_template(system_prompt)
-        
-        # We need a chain that goes Prompt -> LLM -> String
-        llm = self.llm_factory._create_llm("gpt-4o", temperature=0.5)
-        chain = prompt | llm
-        
-        response = chain.invoke({"failed_tasks": task_list_str})
-        
-        return self._parse_llm_json(response.content)
+        response = self._replan_chain().invoke({"failed_tasks": ", ".join(failed_tasks)})
+        return self._parse_llm_json(response)
+
+    async def areplan_week(self, failed_tasks: List[str]) -> List[Dict]:
+        """Async version of replan_week, safe to run concurrently for several subgoals."""
+        with metrics.timer("goals.replan"):
+            response = await self._replan_chain().ainvoke({"failed_tasks": ", ".join(failed_tasks)})
+        return self._parse_llm_json(response)
     
     def _is_context_relevant(self, rag_results: list, threshold: float = 0.5) -> bool:
         """
@@ -141,53 +176,133 @@ class AIAgent:
         
         return top_score < threshold
     
+    async def _web_search(self, query: str):
+        """Runs the web search tool through the shared tool result cache."""
+        return await run_guarded(self.web_search_tool, query, budget=None)
+    
+    def _report_dag_savings(self, timings: Dict[str, float], stage_start: float, trace: dict):
+        """Sequential cost (sum of stages) vs. actual wall time of the concurrent stage."""
+        wall_ms = (time.perf_counter() - stage_start) * 1000
+        saved_ms = max(0.0, sum(timings.values()) - wall_ms)
+        
+        trace["timings_ms"] = {name: round(ms, 1) for name, ms in timings.items()}
+        trace["parallel_saved_ms"] = round(saved_ms, 1)
+        
+        print(f" ⏱️ Prep stage: {wall_ms:.0f}ms wall, ~{saved_ms:.0f}ms saved by running {list(timings)} concurrently")
+        metrics.observe("chat.prep_stage", wall_ms)
+        metrics.incr("chat.prep_ms_saved", saved_ms)
+    
     async def query_with_context(
         self, 
         query: str, 
         user_id: int, 
         mode: str = "auto", # "auto" triggers router
         overrides: dict = None,
-        db: AsyncSession = None
+        db: AsyncSession = None,
+        trace: dict = None, # Optional: filled with the resolved mode and stage timings
+        conversation_id: str = None # Conversation Memory: prior turns of this conversation are added to the prompt
     ) -> str:
-        # --- Load Configuration (Using the routed mode) ---
-        selected_mode = mode
-        if mode == "auto":
-            print(f"🤖 Routing query: '{query}'...")
-            selected_mode = await self.orchestrator.route_query(query)
-            print(f" ↳ Routed to: {selected_mode.upper()} Agent")     
-
-        if selected_mode == "research":
-            # Hand off completely to the Research Agent
-            return await self.research_agent.run_deep_research(query, user_id)
+        trace = trace if trace is not None else {}
+        
+        # --- Stage 1: Independent work runs concurrently (small DAG) ---
+        # Routing, retrieval and preference loading do not depend on each other.
+        # Retrieval is speculative: it is only needed if the router does NOT pick 'research'
+        # (and is not started at all when 'research' was requested explicitly).
+        timings = {}
+        stage_start = time.perf_counter()
+        
+        async def timed(name: str, coro):
+            start = time.perf_counter()
+            result = await coro
+            timings[name] = (time.perf_counter() - start) * 1000
+            return result
+        
+        async def load_user_state():
+            # Same session: preferences and conversation memory are read one after the other
+            prefs = await get_user_agent_config(db, user_id)
+            history = await conversation_memory.load_context(db, user_id, conversation_id)
+            return prefs, history
+        
+        prefs_task = asyncio.create_task(timed("prefs", load_user_state())) if db is not None else None
+        route_task = asyncio.create_task(timed("route", self.orchestrator.route_query(query))) if mode == "auto" else None
+        rag_task = asyncio.create_task(timed("rag", self.rag.asearch(query, user_id=user_id, k=4))) if mode != "research" else None
+        
+        # Hedged retrieval: if a weak RAG result is likely, start the web fallback now instead of after RAG
+        web_task = None
+        if mode != "research" and self.fallback_predictor.should_speculate(user_id, query):
+            print("🔮 Fallback likely. Starting speculative Web Search...")
+            metrics.incr("chat.speculative_web_started")
+            web_task = asyncio.create_task(self._web_search(query))
+        
+        try:
+            # --- Stage 2: Resolve preferences and mode ---
+            user_prefs, history = await prefs_task if prefs_task else ({}, EMPTY_HISTORY)
+            merged_overrides = {**user_prefs, **(overrides or {})}
+            
+            selected_mode = mode
+            if mode == "auto" and merged_overrides.get("default_mode"):
+                # User pinned a default mode: the router result is not needed
+                selected_mode = merged_overrides["default_mode"]
+                _discard(route_task)
+            elif mode == "auto":
+                print(f"🤖 Routing query: '{query}'...")
+                selected_mode = await route_task
+                print(f" ↳ Routed to: {selected_mode.upper()} Agent")
+            
+            trace["mode"] = selected_mode
+            
+            if selected_mode == "research":
+                # Speculative retrieval is not used by the Research Agent
+                _discard(rag_task, web_task)
+                self._report_dag_savings(timings, stage_start, trace)
+                # Hand off completely to the Research Agent
+                return await self.research_agent.run_deep_research(query, user_id)
+            
+            # --- Retrieve Documents (already in flight) ---
+            rag_results = await rag_task
+            self._report_dag_savings(timings, stage_start, trace)
+        
+        except BaseException:
+            _discard(prefs_task, route_task, rag_task, web_task)
+            raise
         
         base_config = AGENT_MODES.get(selected_mode, AGENT_MODES["productivity"])
         final_config = base_config.copy(deep=True)
         
         # --- Apply User Overrides ---         
+        overrides = merged_overrides
         if overrides:
             if overrides.get("provider"): final_config.provider = overrides["provider"]
             if overrides.get("model"): final_config.model = overrides["model"]
             if overrides.get("tone"): final_config.system_prompt += f" Adopt a {overrides['tone']} tone."
             if overrides.get("refinement_level"): final_config.refinement_level = overrides["refinement_level"]
         
-        # --- Retrieve Documents ---
-        # Using to_thread for blocking chroma call
-        rag_results = await asyncio.to_thread(self.rag.search, query, user_id=user_id, k=4)
-        
         source_label = "Local Knowledge Base"
         context_text = ""
         
         # Relevance check & fallback
-        if self._is_context_relevant(rag_results):
+        rag_is_strong = self._is_context_relevant(rag_results)
+        self.fallback_predictor.record_outcome(user_id, query, rag_is_strong)
+        
+        if rag_is_strong:
             context_text = "\n\n".join([doc['content'] for doc in rag_results])
+            if web_task:
+                # Speculation was not needed
+                _discard(web_task)
+                metrics.incr("chat.speculative_web_wasted")
         else:
-            print(f"⚠️ Low relevance. Triggering Web Search...")
             try:
-                # Use arun (Async) if available
-                if hasattr(self.web_search_tool, 'arun'):
-                    web_results = await self.web_search_tool.arun(query)
+                if web_task:
+                    print(f"⚠️ Low relevance. Using speculative Web Search...")
+                    metrics.incr("chat.speculative_web_used")
+                    wait_start = time.perf_counter()
+                    web_results = await web_task
+                    # Whatever the web search needed beyond this point was hidden behind RAG
+                    metrics.observe("chat.speculative_web_residual_wait", (time.perf_counter() - wait_start) * 1000)
                 else:
-                    web_results = await asyncio.to_thread(self.web_search_tool.run, query)
+                    print(f"⚠️ Low relevance. Triggering Web Search...")
+                    metrics.incr("chat.web_fallback_unpredicted")
+                    web_results = await self._web_search(query)
                 
                 # Combine whatever weak local context we have + Web Results
                 local_text = "\n".join([doc['content'] for doc in rag_results])
@@ -204,14 +319,19 @@ class AIAgent:
         if selected_mode in ["academic", "coder", "analyst"]:
             print("⚙️ Using Advanced Tool Runner")
             
-            # Select tools (Web Search + Code Sandbox)
-            active_tools = [self.web_search_tool, self.code_tool]
+            # Select tools (Web Search + Code Sandbox, one persistent interpreter per conversation)
+            code_tool = AgentTools.get_code_interpreter_tool(
+                session_id=f"{user_id}:{conversation_id or DEFAULT_CONVERSATION}"
+            )
+            active_tools = [self.web_search_tool, code_tool]
             
             runner = self.llm_factory.get_agent_runner(final_config, active_tools)
             
             result = await runner.ainvoke({
                 "context": context_text,
                 "question": query,
+                "source_label": source_label,
+                "history": history,
                 "input": query # AgentExecutor might use 'input' internally, so providing both is safer
             })
             return result["output"]
@@ -223,7 +343,9 @@ class AIAgent:
             
             response = await chain.ainvoke({
                 "context": context_text,
-                "question": query
+                "question": query,
+                "source_label": source_label,
+                "history": history
             })
             return response
     
\ No newline at end of file
@@ -0,0 +1,216 @@
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from langchain_core.tools import BaseTool, Tool, StructuredTool
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+
+# Tool outputs that must never be cached (environment failures and killed runs, not results)
+UNCACHEABLE_MARKERS = ("Error: Sandbox", "Sandbox Error")
+
+class ToolResultCache:
+    """
+    Content-keyed cache for deterministic tool results, shared across conversations.
+    - web_search: normalised query, short TTL (results go stale).
+    TTLs per tool come from settings.TOOL_CACHE_TTL_SECONDS; tools not listed there are never cached.
+    Bounded LRU so long-running workers do not grow without limit.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+
+    @staticmethod
+    def policy(tool_name: str) -> Optional[int]:
+        """TTL in seconds, or None if results of this tool are not cacheable."""
+        return settings.TOOL_CACHE_TTL_SECONDS.get(tool_name)
+
+    @staticmethod
+    def make_key(tool_name: str, tool_input: Any) -> str:
+        if isinstance(tool_input, dict):
+            payload = "|".join(f"{k}={tool_input[k]}" for k in sorted(tool_input))
+        else:
+            payload = str(tool_input)
+        if tool_name == "web_search":
+            payload = " ".join(payload.lower().split())
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, tool_name: str, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get((tool_name, key))
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[(tool_name, key)]
+            return False, None
+        self._entries.move_to_end((tool_name, key))
+        return True, value
+
+    def put(self, tool_name: str, key: str, value: Any, ttl: int):
+        if isinstance(value, str) and any(marker in value for marker in UNCACHEABLE_MARKERS):
+            return
+        self._entries[(tool_name, key)] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end((tool_name, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class ToolBudget:
+    """
+    Caps the wall-time spent in tools during one agent run.
+    Overlapping (parallel) calls are counted once: time accrues only while at least one tool runs.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.spent = 0.0
+        self.active = 0
+        self.active_since = 0.0
+
+    def remaining(self) -> float:
+        running = time.monotonic() - self.active_since if self.active else 0.0
+        return self.seconds - self.spent - running
+
+    def start(self):
+        if self.active == 0:
+            self.active_since = time.monotonic()
+        self.active += 1
+
+    def stop(self):
+        self.active -= 1
+        if self.active == 0:
+            self.spent += time.monotonic() - self.active_since
+
+class SessionCallOrder:
+    """
+    Session-bound tools (the stateful sandbox) see each other's effects, but AgentExecutor runs the
+    tool calls of one model turn concurrently, and they may reach the tool in any order.
+    plan() (piped after the agent) records those calls in the order the model issued them;
+    turn() holds each call until every earlier one has finished. One instance per agent run.
+    Both sides key a call on its schema-validated input (what the tool actually receives), and a
+    wait never outlasts the run's tool budget, so a planned call that never arrives cannot stall the rest.
+    """
+
+    def __init__(self, tools: List[BaseTool]):
+        self.schemas = {tool.name: tool.args_schema for tool in tools if getattr(tool, "session_id", None)}
+        self.tool_names = set(self.schemas)
+        self.expected: Deque[Tuple[str, str]] = deque()
+        self.changed = asyncio.Condition()
+
+    def _key(self, tool_name: str, tool_input: Any) -> Optional[Tuple[str, str]]:
+        """Call key; None if the input fails validation (the tool rejects it before any turn())."""
+        schema = self.schemas.get(tool_name)
+        if schema is not None and isinstance(tool_input, dict):
+            try:
+                parsed = getattr(schema, "model_validate", schema.parse_obj)(tool_input)
+            except Exception:
+                return None
+            # Same rule as the tool's own input parsing: schema fields the caller passed, unknown keys dropped
+            fields = getattr(schema, "model_fields", None) or schema.__fields__
+            tool_input = {k: getattr(parsed, k) for k in fields if k in tool_input}
+        return tool_name, ToolResultCache.make_key(tool_name, tool_input)
+
+    def plan(self, output: Any) -> Any:
+        """Pass-through for the agent's output (a list of AgentActions, or an AgentFinish)."""
+        for action in output if isinstance(output, list) else []:
+            if getattr(action, "tool", None) in self.tool_names:
+                call = self._key(action.tool, action.tool_input)
+                if call:
+                    self.expected.append(call)
+        return output
+
+    @asynccontextmanager
+    async def turn(self, tool_name: str, tool_input: Any, timeout: Optional[float] = None):
+        call = self._key(tool_name, tool_input)
+        async with self.changed:
+            try:
+                await asyncio.wait_for(
+                    self.changed.wait_for(lambda: call not in self.expected or self.expected[0] == call),
+                    timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                # An earlier planned call never arrived: drop it (and anything else ahead of this one)
+                metrics.incr(f"tools.{tool_name}.order_timeouts")
+                while self.expected and self.expected[0] != call and call in self.expected:
+                    self.expected.popleft()
+                self.changed.notify_all()
+        try:
+            yield
+        finally:
+            async with self.changed:
+                if call in self.expected:
+                    self.expected.remove(call)
+                self.changed.notify_all()
+
+async def run_guarded(tool: BaseTool, tool_input: Any, budget: Optional[ToolBudget], call_order: Optional[SessionCallOrder] = None) -> Any:
+    """One tool call through the shared result cache, the run's time budget and latency metrics."""
+    if call_order and tool.name in call_order.tool_names:
+        async with call_order.turn(tool.name, tool_input, timeout=budget.remaining() if budget else None):
+            return await _run_guarded(tool, tool_input, budget)
+    return await _run_guarded(tool, tool_input, budget)
+
+async def _run_guarded(tool: BaseTool, tool_input: Any, budget: Optional[ToolBudget]) -> Any:
+    # Session-bound tools (stateful sandbox) depend on earlier calls: never cached
+    ttl = None if getattr(tool, "session_id", None) else tool_cache.policy(tool.name)
+    key = tool_cache.make_key(tool.name, tool_input) if ttl else None
+
+    if key:
+        hit, cached = tool_cache.get(tool.name, key)
+        if hit:
+            metrics.incr(f"tools.{tool.name}.cache_hits")
+            return cached
+        metrics.incr(f"tools.{tool.name}.cache_misses")
+
+    remaining = budget.remaining() if budget else None
+    if remaining is not None and remaining <= 0:
+        metrics.incr(f"tools.{tool.name}.budget_skipped")
+        return "Tool time budget exhausted. Answer with the information gathered so far."
+
+    if budget: budget.start()
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(tool.ainvoke(tool_input), timeout=remaining)
+    except asyncio.TimeoutError:
+        metrics.incr(f"tools.{tool.name}.timeouts")
+        return f"Tool '{tool.name}' timed out (tool time budget exhausted)."
+    finally:
+        if budget: budget.stop()
+        metrics.observe(f"tools.{tool.name}", (time.perf_counter() - start) * 1000)
+
+    if key:
+        tool_cache.put(tool.name, key, result, ttl)
+    return result
+
+def guard_tools(tools: List[BaseTool], budget_seconds: Optional[float] = None, call_order: Optional[SessionCallOrder] = None) -> List[BaseTool]:
+    """
+    Wraps the tools of one agent run (cache + shared time budget + latency metrics).
+    Name, description and schema are the inner tool's, so the model sees no difference.
+    Independent tool calls from one model turn already run concurrently: AgentExecutor
+    gathers them when driven through ainvoke. Session-bound calls keep call_order's order.
+    """
+    budget = ToolBudget(budget_seconds or settings.AGENT_TOOL_TIME_BUDGET_SECONDS)
+    return [_guard(tool, budget, call_order) for tool in tools]
+
+def _guard(tool: BaseTool, budget: ToolBudget, call_order: Optional[SessionCallOrder]) -> BaseTool:
+    if tool.args_schema is None:
+        # Single-input tool (web_search): called with one string
+        async def call_single(tool_input: str):
+            return await run_guarded(tool, tool_input, budget, call_order)
+        return Tool(name=tool.name, description=tool.description, func=tool.invoke, coroutine=call_single)
+
+    async def call_structured(**kwargs):
+        return await run_guarded(tool, kwargs, budget, call_order)
+    return StructuredTool(
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        func=lambda **kwargs: tool.invoke(kwargs),
+        coroutine=call_structured
+    )
+
+# Singleton
+tool_cache = ToolResultCache(max_entries=settings.TOOL_CACHE_MAX_ENTRIES)
@@ -3,6 +3,10 @@ from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.tools import Tool
 
 from backend.agents.tools.code_execution import PythonSandboxTool
+from backend.core.singleflight import SingleFlight
+
+# Shared by every web_search tool instance (chat fallback, research, agent runner)
+web_search_flight = SingleFlight("web_search")
 
 class AgentTools:
     @staticmethod
@@ -13,12 +17,19 @@ class AgentTools:
         # Use Tavily for RAG fallbacks
         search = TavilySearchResults(max_results=10)
         
+        async def coalesced_search(query: str):
+            # Identical in-flight queries share one Tavily call
+            key = " ".join(query.lower().split())
+            return await web_search_flight.do(key, lambda: search.ainvoke(query))
+        
         return Tool(
             name="web_search",
             description="Search the web for current events or missing information.",
-            func=search.invoke
+            func=search.invoke,
+            coroutine=coalesced_search
         )
         
     @staticmethod
-    def get_code_interpreter_tool():
-        return PythonSandboxTool()
\ No newline at end of file
+    def get_code_interpreter_tool(session_id: str = None):
+        """Python sandbox tool; with a session_id, state persists across calls (one session per conversation)."""
+        return PythonSandboxTool(session_id=session_id)
\ No newline at end of file
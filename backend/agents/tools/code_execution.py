@@ -1,5 +1,5 @@
 from langchain.tools import BaseTool
-from typing import Type
+from typing import Optional, Type
 from pydantic import BaseModel, Field
 from backend.services.sandbox_service import sandbox
 
@@ -12,8 +12,11 @@ class PythonSandboxTool(BaseTool):
     Useful for mathematics, data analysis, or complex logic. 
     Input should be valid Python code. 
     The environment is sandboxed: no internet, limited libraries (standard lib only unless configured).
+    Variables, imports and loaded data persist between calls in the same conversation:
+    do not reload or recompute what an earlier call already defined.
     """
     args_schema: Type[BaseModel] = CodeInput
+    session_id: Optional[str] = None # Persistent interpreter per conversation; None = fresh interpreter per call
 
     def _run(self, code: str) -> str:
         # Need to run the async sandbox method in a sync context for LangChain _run or use _arun for async
@@ -21,5 +24,5 @@ class PythonSandboxTool(BaseTool):
 
     async def _arun(self, code: str) -> str:
         print(f"🐍 Executing Code in Sandbox...")
-        result = await sandbox.execute_python(code)
+        result = await sandbox.execute_python(code, session_id=self.session_id)
         return f"Output:\n{result}"
\ No newline at end of file
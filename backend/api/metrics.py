@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from backend.db.models import User
+from backend.auth.users import current_active_user
+from backend.core.metrics import metrics
+from backend.core.rate_limiter import rate_limiter
+from backend.agents.provider_router import provider_router
+from backend.services.ocr_service import ocr_service
+
+router = APIRouter()
+
+@router.get("/")
+async def get_metrics(
+    user: User = Depends(current_active_user)
+):
+    """Performance counters and latency percentiles (admin only)."""
+    if not user.is_superuser:
+        raise HTTPException(status_code=403)
+    return {**metrics.snapshot(), "rate_limits": rate_limiter.snapshot(), "providers": provider_router.snapshot(), "images": ocr_service.snapshot()}
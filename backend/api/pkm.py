@@ -2,15 +2,19 @@ import os
 import shutil
 import aiofiles
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader, UnstructuredEPubLoader
 
 from backend.auth.users import current_active_user
-from backend.services.user_service import get_user_agent_config
+from backend.db.session import get_async_session
 from backend.db.models import User, UserProfile
 from backend.schemas import ChatRequest
 from backend.agents.service import AIAgent
+from backend.core.metrics import metrics
+from backend.services.conversation_service import conversation_memory
 
 router = APIRouter()
 agent = AIAgent()
@@ -65,34 +69,49 @@ async def chat_with_pkm(
     Main Chat Endpoint.
     Handles RAG, Web Search Fallback, and Multi-Model Routing.
     """
-    # 1. Fetch User Profile for Preferences
-    user_prefs = await get_user_agent_config(db, user.id)
-    
-    # 2. Merge Request Overrides
-    # Allow user to switch to a different LLM model for this one message
-    overrides = user_prefs.copy()
+    # 1. Request Overrides
+    # Allow user to switch to a different LLM model for this one message.
+    # Stored preferences are loaded by the agent, concurrently with routing and retrieval.
+    overrides = {}
     if req.model_provider:
         overrides["provider"] = req.model_provider
     if req.model_name:
         overrides["model"] = req.model_name
 
-    # 3. Determine Mode
-    # Priority: Request Mode > User Default Mode > "auto"
-    selected_mode = req.mode 
-    if selected_mode == "auto" and overrides.get("default_mode"):
-        selected_mode = overrides.get("default_mode")
-    
-    # 3. Call Agent with BOTH user_id and the specific preferences
-    # The agent will use 'selected_mode' to pick the personality (System Prompt), and overrides to pick the Brain (Provider/Model).
+    # 2. Call Agent with BOTH user_id and the specific preferences
+    # Mode priority: Request Mode > User Default Mode > "auto" (resolved inside the agent).
+    # The agent will use the mode to pick the personality (System Prompt), and overrides to pick the Brain (Provider/Model).
+    trace = {}
     try:
-        answer = await agent.query_with_context(
-            query=req.query, 
-            user_id=user.id, 
-            mode=selected_mode,
-            overrides=overrides,
-            db=db
-        )
-        return {"answer": answer, "mode_used": selected_mode}
+        with metrics.timer("chat.total"):
+            answer = await agent.query_with_context(
+                query=req.query, 
+                user_id=user.id, 
+                mode=req.mode,
+                overrides=overrides,
+                db=db,
+                trace=trace,
+                conversation_id=req.conversation_id
+            )
+        
+        # Append-only conversation log; older turns are summarized in the background
+        await conversation_memory.append_exchange(db, user.id, req.conversation_id, req.query, answer)
+        return {"answer": answer, "mode_used": trace.get("mode", req.mode)}
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Agent Error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Agent Error: {str(e)}")
+
+@router.post("/research/stream")
+async def stream_research(
+    req: ChatRequest,
+    user: User = Depends(current_active_user)
+):
+    """
+    Deep Research with a streamed report.
+    Synthesis starts once the context budget or a quorum of searches is reached,
+    and the answer is sent to the client as it is generated.
+    """
+    return StreamingResponse(
+        agent.research_agent.stream_deep_research(req.query, user.id),
+        media_type="text/plain"
+    )
@@ -1,34 +1,34 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from sqlalchemy.orm.attributes import flag_modified
 from datetime import datetime
 
 from backend.db.session import get_async_session
-from backend.db.models import User, UserProfile
+from backend.db.models import User
 from backend.auth.users import current_active_user
+from backend.services.gamification_engine import GamificationEngine
+from backend.services.user_service import profile_cache, profile_snapshot
 from backend.schemas import UserPreferencesUpdate, FeedbackCreate, UserProfileResponse
 
 router = APIRouter()
 
-async def get_or_create_profile(db: AsyncSession, user_id: int) -> UserProfile:
-    result = await db.execute(select(UserProfile).where(UserProfile.user_id == user_id))
-    profile = result.scalars().first()
-    if not profile:
-        profile = UserProfile(user_id=user_id, agent_preferences={})
-        db.add(profile)
-        await db.commit()
-        await db.refresh(profile)
-    return profile
+# Race-safe (INSERT ... ON CONFLICT DO NOTHING) when two first requests arrive together
+get_or_create_profile = GamificationEngine.get_or_create_profile
 
 @router.get("/", response_model=UserProfileResponse)
 async def get_preferences(
     user: User = Depends(current_active_user),
     db: AsyncSession = Depends(get_async_session)
 ):
-    """Fetch current user settings."""
+    """Fetch current user settings (cached; written through by PATCH)."""
+    cached = await profile_cache.get(user.id)
+    if cached is not None:
+        return cached
+
     profile = await get_or_create_profile(db, user.id)
-    return profile
+    snapshot = profile_snapshot(profile)
+    await profile_cache.set(user.id, snapshot)
+    return snapshot
 
 @router.patch("/", response_model=UserProfileResponse)
 async def update_preferences(
@@ -53,6 +53,9 @@ async def update_preferences(
     
     await db.commit()
     await db.refresh(profile)
+
+    # Write-through: the chat path sees the new preferences on its next request
+    await profile_cache.set(user.id, profile_snapshot(profile))
     return profile
 
 @router.post("/feedback")
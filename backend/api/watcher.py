@@ -1,4 +1,4 @@
-import asyncio
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,10 +7,8 @@ from sqlalchemy import select
 from backend.db.session import get_async_session
 from backend.db.models import User, KnowledgeSource, SourceScope
 from backend.auth.users import current_active_user
-from backend.services.watcher_service import run_watcher_cycle
-from backend.services.crawler_service import crawler
-from backend.pkm.rag_service import rag_service
-from backend.services.atomic_service import atomic_service
+from backend.services.watcher_service import run_watcher_cycle, ingest_domain_source
+from backend.services.shared_crawl_service import shared_crawl_service
 
 router = APIRouter()
 
@@ -25,8 +23,8 @@ async def crawl_and_ingest_source(source_id: int):
     Self-contained task that runs in the background.
     Opens its own DB session to avoid 'Session Closed' errors.
     Background Task: 
-    1. Crawl URL
-    2. Generate Atomic Note (AI Analysis)
+    1. Crawl URL (or reuse the shared crawl of the same canonical URL)
+    2. Generate Atomic Note (AI Analysis) if the content changed
     3. Ingest Note + Raw Content into Vector DB
     """
     print(f"🚀 [Background] Processing Source ID {source_id}")
@@ -44,49 +42,24 @@ async def crawl_and_ingest_source(source_id: int):
         try:
             # 2. Execute Crawl (Calls Firecrawl)
             # Decide: Single URL or Domain Spider based on user input (stored in source)
-            # For this example, we assume single page for simplicity, or use source.url
-            data = await crawler.crawl_url(source.url)
-            
-            if data and data.get('content'):
-                raw_markdown = data['content']
-                print(f" ✅ Content fetched ({len(raw_markdown)} chars). Analyzing...")
-
-                # 3. Generate Atomic Note (AI Analysis)
-                # This step uses the LLM to structure the messy web page
-                note_obj = await atomic_service.generate_note(raw_markdown, source.url)
-                
-                # Convert to your specific Markdown format string
-                formatted_note_content = atomic_service.format_as_markdown(note_obj)
-                
-                print(f" 🧠 Atomic Note Generated: '{note_obj.title}'")
-                
-                # 3. Ingest to RAG
-                target_user_id = source.user_id if source.scope == SourceScope.PRIVATE else 0
-                
-                # Run ingestion in thread (blocking network I/O to Weaviate)
-                await asyncio.to_thread(
-                    rag_service.ingest_document,
-                    text=raw_markdown,             # The Raw Chunks
-                    summary=formatted_note_content, # The Atomic Note
-                    metadata={
-                        "source_url": source.url,
-                        "title": note_obj.title,
-                        "user_id": target_user_id,
-                        "scope": source.scope.value,
-                        # Store extracted tags for filtering later if needed
-                        "keywords": note_obj.keywords 
-                    },
-                    store_raw=True # Always store raw for web sources so we can cite details
-                )
-                
-                # 4. Update Source Status
-                source.last_crawled_at = datetime.utcnow()
-                source.title = note_obj.title # Update DB title to match the AI generated one
-                source.error_count = 0
+            if (source.crawl_depth or 1) > 1:
+                # Domain Spider: pages stream into ingestion as they are crawled
+                title = await ingest_domain_source(source)
                 
+                if title:
+                    source.last_crawled_at = datetime.utcnow()
+                    source.title = title
+                    source.error_count = 0
+                else:
+                    source.error_count += 1
             else:
-                print("   ⚠️ Crawl returned empty content.")
-                source.error_count += 1
+                # Single Page: crawled once per canonical URL, shared by every subscriber.
+                # The Atomic Note and embeddings are only generated when the content changed.
+                if not await shared_crawl_service.sync_source(db, source):
+                    print("   ⚠️ Crawl returned empty content.")
+                    source.error_count += 1
+                else:
+                    print(f" 🧠 Atomic Note Ready: '{source.title}'")
                 
         except Exception as e:
             print(f"   ❌ Crawl Failed: {e}")
@@ -113,11 +86,15 @@ async def add_watch_source(
 
     scope = SourceScope.GLOBAL if req.is_global else SourceScope.PRIVATE
 
-    # Check for duplicate
+    # Resolve the shared crawl record (lexical normalization only: the URL is not fetched here)
+    resource = await shared_crawl_service.get_or_create_resource(db, req.url)
+
+    # Check for duplicate (same canonical page, same owner)
+    owner_filter = KnowledgeSource.user_id.is_(None) if req.is_global else KnowledgeSource.user_id == user.id
     existing = await db.execute(
         select(KnowledgeSource).where(
-            KnowledgeSource.url == req.url,
-            KnowledgeSource.user_id == (None if req.is_global else user.id)
+            KnowledgeSource.resource_id == resource.id,
+            owner_filter
         )
     )
     if existing.scalars().first():
@@ -129,6 +106,8 @@ async def add_watch_source(
         url=req.url,
         scope=scope,
         update_frequency_hours=req.frequency_hours,
+        crawl_depth=req.crawl_depth,
+        resource_id=resource.id,
         last_crawled_at=None # Will trigger immediate crawl by watcher
     )
     
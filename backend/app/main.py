@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
@@ -12,19 +13,44 @@ from backend.auth.backend import auth_backend
 from backend.auth.oauth import google_oauth_client, microsoft_oauth_client, apple_oauth_client
 from backend.auth.schemas import UserRead, UserCreate, UserUpdate
 from backend.services.sync_service import sync_all_users
-from backend.api import pkm, gamification
+from backend.api import pkm, gamification, metrics
 from backend.services.watcher_service import run_watcher_cycle
+from backend.services.gamification_engine import run_weekly_reset_job
+from backend.core.metrics import monitor_event_loop_lag
+from backend.services.sandbox_service import sandbox
+from backend.services.vision_service import vision_service
+
+scheduler = AsyncIOScheduler()
+
+def start_scheduler():
+    # Cloud Sync (Google Drive/OneDrive/iCloud)
+    scheduler.add_job(sync_all_users, 'interval', hours=1)
+    
+    # Web Watcher (Crawling)
+    scheduler.add_job(run_watcher_cycle, 'interval', hours=1)
+
+    # Gamification: weekly token reset + failing exhausted weeks (batch, set-based)
+    scheduler.add_job(run_weekly_reset_job, 'interval', minutes=settings.WEEKLY_RESET_INTERVAL_MINUTES)
+    scheduler.start()
 
 # Lifecycle: Ensure DB tables exist on startup
+# (with a lifespan, FastAPI ignores @app.on_event handlers: all startup/shutdown work lives here)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # In production, use Alembic for migrations instead of this
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    
+    # Blocking calls on the loop show up as lag on /metrics
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    start_scheduler()
     yield
+    scheduler.shutdown(wait=False) # Running jobs are cancelled with the loop
+    lag_monitor.cancel()
+    await sandbox.shutdown() # Remove pooled sandbox containers
+    vision_service.shutdown() # Stop image pre-processing workers
 
 app = FastAPI(title="LifeOS Brain", lifespan=lifespan)
-scheduler = AsyncIOScheduler()
 
 # --- CORS Configuration ---
 origins = [
@@ -103,16 +129,8 @@ app.include_router(
 app.include_router(pkm.router, prefix="/pkm", tags=["PKM"])
 app.include_router(preferences.router, prefix="/preferences", tags=["Preferences"])
 app.include_router(gamification.router, prefix="/agent", tags=["Gamification"])
+app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
 
 @app.get("/")
 def read_root():
     return {"status": "LifeOS Brain is running"}
-
-@app.on_event("startup")
-async def start_scheduler():
-    # Cloud Sync (Google Drive/OneDrive/iCloud)
-    scheduler.add_job(sync_all_users, 'interval', hours=1)
-    
-    # Web Watcher (Crawling)
-    scheduler.add_job(run_watcher_cycle, 'interval', hours=1)
-    scheduler.start()
\ No newline at end of file
@@ -0,0 +1,84 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+
+try:
+    import redis.asyncio as aioredis # Optional: shared backend (settings.CACHE_REDIS_URL)
+except ImportError:
+    aioredis = None
+
+class TTLCache:
+    """
+    Short-TTL cache for small per-user records read on every request (identity, preferences).
+    - Default: in-process, bounded LRU with expiry.
+    - With CACHE_REDIS_URL (e.g. a Redis on the same host): shared by all workers, so a write or
+      invalidation in one worker is seen by the others immediately; the in-process layer is skipped.
+    Writers keep it coherent: set() after a write (write-through), invalidate() when a write
+    happens elsewhere. Without the shared backend, other workers may serve a value for up to the TTL.
+    Values must be JSON-serialisable; None is never cached (it means "miss").
+    Cache errors are counted and treated as misses: the database stays the source of truth.
+    """
+
+    def __init__(self, namespace: str, ttl_seconds: int, max_entries: int = 10000):
+        self.namespace = namespace
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._local: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._shared = None
+        if settings.CACHE_REDIS_URL:
+            if aioredis is None:
+                print(f"⚠️ CACHE_REDIS_URL is set but 'redis' is not installed: {namespace} cache stays in-process.")
+            else:
+                self._shared = aioredis.from_url(settings.CACHE_REDIS_URL)
+
+    def _key(self, key: Hashable) -> str:
+        return f"lifeos:{self.namespace}:{key}"
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        value = None
+        if self._shared:
+            try:
+                raw = await self._shared.get(self._key(key))
+                value = json.loads(raw) if raw is not None else None
+            except Exception:
+                metrics.incr(f"cache.{self.namespace}.errors")
+        else:
+            entry = self._local.get(key)
+            if entry and entry[0] > time.monotonic():
+                value = entry[1]
+                self._local.move_to_end(key)
+            elif entry:
+                del self._local[key]
+
+        metrics.incr(f"cache.{self.namespace}.{'hits' if value is not None else 'misses'}")
+        return value
+
+    async def set(self, key: Hashable, value: Any):
+        if value is None:
+            return
+        if self._shared:
+            try:
+                await self._shared.set(self._key(key), json.dumps(value), ex=self.ttl)
+            except Exception:
+                metrics.incr(f"cache.{self.namespace}.errors")
+            return
+        self._local[key] = (time.monotonic() + self.ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def invalidate(self, *keys: Hashable):
+        if not keys:
+            return
+        if self._shared:
+            try:
+                await self._shared.delete(*(self._key(key) for key in keys))
+            except Exception:
+                metrics.incr(f"cache.{self.namespace}.errors")
+            return
+        for key in keys:
+            self._local.pop(key, None)
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Dict, Optional
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "LifeOS"
@@ -39,6 +39,137 @@ class Settings(BaseSettings):
     APPLE_KEY_ID: str       # The Key ID of your .p8 file
     APPLE_PRIVATE_KEY: str  # The content of your AuthKey_XXXX.p8 file
 
+    # Crawler (Firecrawl domain crawls)
+    CRAWL_QUEUE_SIZE: int = 8               # Max pages buffered between crawler and ingestion
+    CRAWL_POLL_INTERVAL_SECONDS: float = 5.0
+    CRAWL_IDLE_TIMEOUT_SECONDS: float = 300.0 # Give up if no new page arrives for this long
+
+    # Deep Research
+    RESEARCH_INGEST_CONCURRENCY: int = 2    # Max concurrent vector-store batch writes
+    RESEARCH_INGEST_BATCH_SIZE: int = 20    # Documents per bulk ingest call
+    RESEARCH_QUERY_TIMEOUT_SECONDS: float = 15.0  # Per-search deadline (streaming mode)
+    RESEARCH_TIME_BUDGET_SECONDS: float = 40.0    # Total search budget before synthesis starts
+    RESEARCH_QUORUM: float = 0.6                  # Share of searches that must finish before synthesis
+    RESEARCH_CONTEXT_TOKEN_BUDGET: int = 12000    # Max context tokens sent to the synthesizer
+    RESEARCH_PREFILL_TOKENS_PER_SECOND: float = 4000.0 # Used to estimate latency saved by compression
+
+    # Chat: Hedged Retrieval
+    SPECULATIVE_SEARCH_THRESHOLD: float = 0.6      # Predictor score above which web search starts alongside RAG
+    SPECULATIVE_SEARCH_BUDGET_PER_HOUR: int = 20   # Max speculative web searches per user per hour
+    SPECULATIVE_PREDICTOR_MAX_USERS: int = 10000   # Users whose query history is kept (least recently active dropped)
+    SPECULATIVE_PREDICTOR_MAX_TERMS: int = 2000    # Known terms kept per user (most frequent survive)
+
+    # Chat: Conversation Memory
+    CHAT_MEMORY_WINDOW_TOKENS: int = 2000    # Recent turns kept verbatim in the prompt
+    CHAT_MEMORY_SUMMARY_TOKENS: int = 400    # Target size of the rolling summary of older turns
+    CHAT_MEMORY_MAX_TURNS: int = 40          # Upper bound on turns read per request
+    CHAT_MEMORY_FOLD_TOKENS: int = 4000      # Max turn tokens folded into the summary per LLM call
+
+    # Agent Tools
+    AGENT_MAX_ITERATIONS: int = 8                 # Model turns per AgentExecutor run
+    AGENT_TOOL_TIME_BUDGET_SECONDS: float = 60.0  # Total tool wall-time per run (parallel calls counted once)
+    TOOL_CACHE_TTL_SECONDS: Dict[str, int] = {
+        "web_search": 900,                # Search results go stale
+        # No python_interpreter: runs are stateful per session, so the same code can print different output
+    }
+    TOOL_CACHE_MAX_ENTRIES: int = 2000
+
+    # Code Sandbox
+    SANDBOX_BACKEND: str = "auto"               # "docker" | "process" | "auto" (docker if a daemon is reachable)
+    SANDBOX_CPU_SECONDS: int = 10               # CPU-time limit per run
+    SANDBOX_WALL_TIMEOUT_SECONDS: int = 20      # Wall-clock limit per run (the interpreter is killed)
+    SANDBOX_MAX_OUTPUT_CHARS: int = 20000       # Longer output is truncated
+    SANDBOX_EXECUTOR_THREADS: int = 16          # Dedicated threads for blocking Docker calls (not the default executor)
+
+    # Code Sandbox: process backend (no Docker)
+    SANDBOX_PROCESS_POOL_SIZE: int = 2          # Preforked interpreters kept ready
+    SANDBOX_PROCESS_PRELOAD: List[str] = ["numpy", "pandas"]
+    SANDBOX_PROCESS_MEMORY_MB: int = 1024       # RLIMIT_AS (includes the preloaded modules)
+    SANDBOX_PROCESS_FILE_MB: int = 10           # RLIMIT_FSIZE
+    SANDBOX_PROCESS_START_TIMEOUT_SECONDS: int = 30
+    SANDBOX_PROCESS_REQUIRE_NET_ISOLATION: bool = True # Refuse to run if no network namespace can be created
+    SANDBOX_PROCESS_REQUIRE_FS_ISOLATION: bool = True  # Refuse to run if the worker cannot be jailed (chroot)
+    SANDBOX_ALLOW_PROCESS_FALLBACK: bool = False # 'auto' without Docker: use the process backend (opt-in)
+
+    # Code Sandbox: Docker container pool
+    SANDBOX_MEM_LIMIT: str = "128m"
+    SANDBOX_POOL_MIN: int = 2                   # Warm idle containers kept ready
+    SANDBOX_POOL_MAX: int = 8                   # Max containers alive at once
+    SANDBOX_MAX_QUEUED: int = 16                # Executions allowed to wait for a container
+    SANDBOX_MAX_RUNS_PER_CONTAINER: int = 50    # Recycle after this many runs
+    SANDBOX_HEALTH_CHECK_SECONDS: int = 30
+    SANDBOX_MAX_CODE_CHARS: int = 100000        # Code is passed as an exec argument (ARG_MAX)
+
+    # Code Sandbox: stateful sessions (one interpreter per conversation, variables persist)
+    SANDBOX_MAX_SESSIONS: int = 8               # LRU cap on live sessions (idle ones are evicted first)
+    SANDBOX_SESSION_IDLE_SECONDS: int = 600     # Sessions unused for this long are closed
+    SANDBOX_SESSION_MEMORY_MB: int = 1024       # RLIMIT_AS / container memory per session
+    SANDBOX_SESSION_CPU_SECONDS: int = 120      # Total CPU time over a session's lifetime
+
+    # Vision (image descriptions for RAG)
+    VISION_PREPROCESS_WORKERS: int = 2          # Processes for decode/resize/re-encode
+    VISION_MAX_LONG_SIDE: int = 2048            # gpt-4o high detail fits images into 2048x2048...
+    VISION_MAX_SHORT_SIDE: int = 768            # ...then scales the short side to 768: more pixels are wasted upload
+    VISION_JPEG_QUALITY: int = 85
+    VISION_BATCH_MAX_SIDE: int = 512            # Images this small (one low-detail tile) may share a request
+    VISION_BATCH_MAX_IMAGES: int = 4
+    VISION_BATCH_WINDOW_MS: int = 300           # How long a small image waits for batch partners
+    VISION_DEDUP_MAX_DISTANCE: int = 4          # Max differing bits (of 64) for a near-duplicate
+    VISION_DEDUP_MAX_ENTRIES: int = 500         # Remembered hashes per user
+    VISION_DEDUP_MAX_SCOPES: int = 100          # Users whose hashes are kept (least recently active dropped)
+
+    # Local OCR (Tesseract) fast path for screenshots and scans
+    OCR_LANGUAGES: str = "eng"                  # Tesseract '-l' value, e.g. "eng+deu"
+    OCR_CONCURRENCY: int = 2                    # Parallel tesseract processes
+    OCR_TIMEOUT_SECONDS: int = 30
+    OCR_MIN_CONFIDENCE: float = 80.0            # Mean word confidence (0-100) to accept OCR over vision
+    OCR_MIN_CHARS: int = 20                     # Less text than this -> probably not a text image
+
+    # Cloud Sync
+    SYNC_FILE_CONCURRENCY: int = 4              # Files downloaded/parsed in parallel per cloud sync
+
+    # Caching: user identity + profile/preferences (per-request lookups)
+    CACHE_REDIS_URL: Optional[str] = None       # Shared backend for all workers, e.g. "redis://localhost:6379/0"
+    USER_CACHE_TTL_SECONDS: int = 30
+    PROFILE_CACHE_TTL_SECONDS: int = 30
+
+    # Gamification: batch weekly reset job
+    WEEKLY_RESET_INTERVAL_MINUTES: int = 15     # How often the job looks for due profiles
+    WEEKLY_RESET_CHUNK_SIZE: int = 5000         # Profiles per transaction
+
+    # Goals: AI Decomposition / Replanning
+    GOAL_REPLAN_CONCURRENCY: int = 4 # Max concurrent replanning LLM calls per restart
+
+    # LLM Rate Limiting (per provider/model, shared by interactive and background traffic)
+    LLM_RATE_LIMITS: Dict[str, Dict[str, int]] = {
+        "openai": {"rpm": 500, "tpm": 200000, "concurrency": 16},
+        "anthropic": {"rpm": 50, "tpm": 40000, "concurrency": 8},
+        "google": {"rpm": 60, "tpm": 120000, "concurrency": 8},
+        "default": {"rpm": 60, "tpm": 60000, "concurrency": 4},
+    }
+    LLM_BACKGROUND_SHARE: float = 0.5 # Max share of a model's concurrency usable by background jobs
+
+    # LLM Hedging & Failover ("provider/model" keys; models in one class may answer for each other)
+    # Classes must be disjoint (checked at startup): a model belongs to exactly one class.
+    LLM_EQUIVALENCE_CLASSES: List[List[str]] = [
+        ["openai/gpt-4o", "anthropic/claude-3-5-sonnet", "google/gemini-1.5-pro"],
+        ["openai/gpt-4o-mini", "google/gemini-1.5-flash", "openai/gpt-3.5-turbo"],
+    ]
+    # Blended USD per 1M tokens, used to order backups (cheapest first); unknown models sort last
+    LLM_COST_PER_MTOK: Dict[str, float] = {
+        "openai/gpt-4o": 5.0,
+        "anthropic/claude-3-5-sonnet": 6.0,
+        "google/gemini-1.5-pro": 3.5,
+        "openai/gpt-4o-mini": 0.3,
+        "google/gemini-1.5-flash": 0.15,
+        "openai/gpt-3.5-turbo": 1.0,
+    }
+    LLM_HEDGE_MIN_DELAY_MS: float = 500       # Never hedge earlier than this
+    LLM_HEDGE_DEFAULT_DELAY_MS: float = 8000  # Hedge delay until enough latency samples exist
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5    # Consecutive failures that open the circuit
+    LLM_CIRCUIT_ERROR_RATE: float = 0.5       # Error rate (last 50 calls) that opens the circuit
+    LLM_CIRCUIT_COOLDOWN_SECONDS: int = 30    # Open circuit is probed again after this
+
     # Paths
     PERSIST_DIRECTORY: str = "./backend/db/chroma_storage"
     
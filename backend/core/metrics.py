@@ -0,0 +1,80 @@
+import time
+import asyncio
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+class LatencyTracker:
+    """Rolling window of latency samples (ms) with percentile lookups."""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, ms: float):
+        self.samples.append(ms)
+        self.count += 1
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2)
+        }
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms for the performance work
+    (tokens saved, calls avoided, p50/p99 per stage). Exposed via GET /metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.latencies = defaultdict(LatencyTracker)
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, ms: float):
+        with self._lock:
+            self.latencies[name].record(ms)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "latencies": {name: tracker.snapshot() for name, tracker in self.latencies.items()}
+            }
+
+# Singleton
+metrics = MetricsRegistry()
+
+async def monitor_event_loop_lag(interval: float = 0.25):
+    """
+    Records how late the event loop wakes up a sleeping task ('event_loop.lag').
+    Anything blocking the loop (sync LLM calls, heavy parsing) shows up here and in
+    the latency of every concurrent request.
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.observe("event_loop.lag", max(0.0, (time.perf_counter() - start - interval) * 1000))
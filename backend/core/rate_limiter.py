@@ -0,0 +1,221 @@
+import time
+import random
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+
+INTERACTIVE = "interactive" # User is waiting (chat, routing, research)
+BACKGROUND = "background"   # Sync / crawl pipelines (atomic notes, vision)
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """Detects 429s across the OpenAI, Anthropic and Google SDKs."""
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    name = type(e).__name__
+    return "RateLimit" in name or "ResourceExhausted" in name
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    """Reads the Retry-After header of a 429, if the SDK exposes the response."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt size (~4 chars per token); corrected with real usage after the call."""
+    return max(1, len(text) // 4)
+
+class ModelLimiter:
+    """
+    Limits for one provider/model:
+    - Sliding 60s windows for requests (RPM) and tokens (TPM).
+    - AIMD concurrency: +1/limit per success, halved on a 429.
+    - Retry-After: blocks the whole model until the server says it is ok.
+    - Priority lanes: background traffic may only use part of the concurrency and
+      always yields to waiting interactive requests.
+    """
+
+    def __init__(self, key: str, rpm: int, tpm: int, max_concurrency: int, background_share: float):
+        self.key = key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.background_share = background_share
+
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.interactive_waiting = 0
+        self.blocked_until = 0.0
+
+        self.request_log = deque()  # timestamps
+        self.token_log = deque()    # (timestamp, tokens)
+        self.tokens_in_window = 0
+        self._cond = asyncio.Condition()
+
+    def _trim(self, now: float):
+        while self.request_log and now - self.request_log[0] > 60:
+            self.request_log.popleft()
+        while self.token_log and now - self.token_log[0][0] > 60:
+            self.tokens_in_window -= self.token_log.popleft()[1]
+
+    def _wait_time(self, priority: str, est_tokens: int, now: float) -> float:
+        """0 if the request may start now, otherwise a hint for how long to wait."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        limit = self.concurrency_limit
+        if priority == BACKGROUND:
+            if self.interactive_waiting:
+                return 0.05
+            limit = max(1.0, limit * self.background_share)
+        if self.in_flight >= int(limit):
+            return 0.05 # Woken up earlier by release()
+
+        if len(self.request_log) >= self.rpm:
+            return 60 - (now - self.request_log[0])
+        if self.token_log and self.tokens_in_window + est_tokens > self.tpm:
+            return 60 - (now - self.token_log[0][0])
+        return 0.0
+
+    async def acquire(self, priority: str, est_tokens: int) -> Tuple[float, Tuple[float, int]]:
+        start = time.monotonic()
+        async with self._cond:
+            if priority == INTERACTIVE:
+                self.interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._trim(now)
+                    wait = self._wait_time(priority, est_tokens, now)
+                    if wait <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                if priority == INTERACTIVE:
+                    self.interactive_waiting -= 1
+
+            self.in_flight += 1
+            self.request_log.append(now)
+            entry = (now, est_tokens)
+            self.token_log.append(entry)
+            self.tokens_in_window += est_tokens
+
+        waited_ms = (time.monotonic() - start) * 1000
+        metrics.observe(f"ratelimit.{self.key}.{priority}_wait", waited_ms)
+        return waited_ms, entry
+
+    async def release(self, entry: Tuple[float, int], actual_tokens: Optional[int], rate_limited: bool, retry_after: Optional[float]):
+        async with self._cond:
+            self.in_flight -= 1
+
+            # Replace the estimate with real usage
+            if actual_tokens is not None:
+                self.tokens_in_window += actual_tokens - entry[1]
+                try:
+                    idx = self.token_log.index(entry)
+                    self.token_log[idx] = (entry[0], actual_tokens)
+                except ValueError:
+                    pass # Already out of the window
+
+            if rate_limited:
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+                backoff = retry_after if retry_after is not None else 1.0
+                self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+            else:
+                self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        self._trim(now)
+        return {
+            "requests_last_min": len(self.request_log),
+            "tokens_last_min": self.tokens_in_window,
+            "in_flight": self.in_flight,
+            "concurrency_limit": round(self.concurrency_limit, 2),
+            "blocked_for_s": round(max(0.0, self.blocked_until - now), 2)
+        }
+
+class RateLimiter:
+    """Central registry: one ModelLimiter per provider/model, shared by every LLM caller."""
+
+    def __init__(self):
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def get(self, provider: str, model: str) -> ModelLimiter:
+        key = f"{provider}/{model}"
+        if key not in self._limiters:
+            limits = settings.LLM_RATE_LIMITS.get(provider, settings.LLM_RATE_LIMITS["default"])
+            self._limiters[key] = ModelLimiter(
+                key,
+                rpm=limits["rpm"],
+                tpm=limits["tpm"],
+                max_concurrency=limits["concurrency"],
+                background_share=settings.LLM_BACKGROUND_SHARE
+            )
+        return self._limiters[key]
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str, priority: str = INTERACTIVE, est_tokens: int = 1000):
+        """
+        Holds one request slot for the duration of the block (used for streaming).
+        The caller may set 'usage["tokens"]' to report real token usage.
+        """
+        limiter = self.get(provider, model)
+        _, entry = await limiter.acquire(priority, est_tokens)
+        usage = {"tokens": None}
+        rate_limited, retry_after = False, None
+        try:
+            yield usage
+        except Exception as e:
+            if is_rate_limit_error(e):
+                rate_limited, retry_after = True, retry_after_seconds(e)
+                metrics.incr(f"ratelimit.{limiter.key}.429s")
+            raise
+        finally:
+            metrics.incr(f"ratelimit.{limiter.key}.requests")
+            metrics.incr(f"ratelimit.{limiter.key}.tokens", usage["tokens"] or entry[1])
+            await limiter.release(entry, usage["tokens"], rate_limited, retry_after)
+
+    async def run(
+        self,
+        provider: str,
+        model: str,
+        fn: Callable[[], Awaitable[Any]],
+        priority: str = INTERACTIVE,
+        est_tokens: int = 1000,
+        max_retries: int = 3
+    ) -> Any:
+        """Runs one LLM call through the limiter, retrying 429s with Retry-After-aware backoff."""
+        for attempt in range(max_retries + 1):
+            try:
+                async with self.slot(provider, model, priority, est_tokens) as usage:
+                    result = await fn()
+                    usage_metadata = getattr(result, "usage_metadata", None)
+                    if usage_metadata:
+                        usage["tokens"] = usage_metadata.get("total_tokens")
+                    return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == max_retries:
+                    raise
+                delay = retry_after_seconds(e) or min(30.0, 2 ** attempt)
+                delay += random.uniform(0, delay * 0.1) # Jitter: avoid synchronized retries
+                print(f"⏳ 429 from {provider}/{model}. Retrying in {delay:.1f}s ({priority})")
+                await asyncio.sleep(delay)
+
+    def snapshot(self) -> Dict:
+        return {key: limiter.snapshot() for key, limiter in self._limiters.items()}
+
+# Singleton
+rate_limiter = RateLimiter()
@@ -1,6 +1,6 @@
 import enum
 from fastapi_users.db import SQLAlchemyBaseUserTable, SQLAlchemyUserDatabase
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text, DateTime, JSON, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text, DateTime, JSON, Enum, Index
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import AsyncGenerator
@@ -8,6 +8,8 @@ from fastapi import Depends
 from datetime import datetime
 
 from backend.db.session import get_async_session
+from backend.core.cache import TTLCache
+from backend.core.config import settings
 from backend.db.session import Base
 
 Base = declarative_base()
@@ -59,6 +61,45 @@ class UserProfile(Base):
 
     user = relationship("User", back_populates="profile")
 
+    __table_args__ = (
+        Index("ix_user_profiles_last_reset_date", "last_reset_date"), # Weekly reset job: due profiles
+    )
+
+class ConversationTurn(Base):
+    """
+    Append-only chat log (one row per message).
+    Read newest-first through the (user_id, conversation_id, id) index; never rewritten.
+    """
+    __tablename__ = "conversation_turns"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    conversation_id = Column(String(64), nullable=False, default="default")
+    role = Column(String(16), nullable=False) # "user" | "assistant"
+    content = Column(Text, nullable=False)
+    token_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_conversation_turns_user_conv_id", "user_id", "conversation_id", "id"),
+    )
+
+class ConversationSummary(Base):
+    """
+    Rolling summary of the turns that fell out of the prompt window.
+    'summarized_through_id' is the last ConversationTurn folded into 'summary'.
+    """
+    __tablename__ = "conversation_summaries"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    conversation_id = Column(String(64), nullable=False, default="default")
+    summary = Column(Text, default="")
+    summarized_through_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_conversation_summaries_user_conv", "user_id", "conversation_id", unique=True),
+    )
+
 class GoalStatus(str, enum.Enum):
     ACTIVE = "active"
     COMPLETED = "completed"
@@ -77,6 +118,10 @@ class Goal(Base):
     # Hierarchy: Goal -> SubGoals
     subgoals = relationship("SubGoal", back_populates="goal", cascade="all, delete-orphan")
     user = relationship("User", back_populates="goals")
+
+    __table_args__ = (
+        Index("ix_goals_user_id_status", "user_id", "status"), # Active goals per user (failing a week)
+    )
     
 class SubGoal(Base):
     """ Represents a Milestone or a Weekly Focus. """
@@ -111,6 +156,33 @@ class SourceScope(str, enum.Enum):
     PRIVATE = "private" # Visible only to the owner
     GLOBAL = "global"   # Visible to all users (Shared Database)
 
+class CrawledResource(Base):
+    """
+    One shared crawl record per canonical URL.
+    Many KnowledgeSource subscriptions (across users) point here, so a popular page is crawled,
+    summarised and embedded once instead of once per watcher.
+    """
+    __tablename__ = "crawled_resources"
+
+    id = Column(Integer, primary_key=True, index=True)
+    canonical_url = Column(String, unique=True, index=True, nullable=False)
+
+    # Cached Crawl Output
+    title = Column(String, nullable=True)
+    content = Column(Text, nullable=True)
+    content_hash = Column(String(64), nullable=True) # sha256 fingerprint of the crawled markdown
+    last_crawled_at = Column(DateTime, nullable=True)
+
+    # Cached Atomic Note (so subscribers never re-run the LLM for identical content)
+    note_markdown = Column(Text, nullable=True)
+    note_keywords = Column(JSON, default=[])
+
+    # Status
+    error_count = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+
+    subscriptions = relationship("KnowledgeSource", back_populates="resource")
+
 class KnowledgeSource(Base):
     __tablename__ = "knowledge_sources"
     
@@ -125,14 +197,59 @@ class KnowledgeSource(Base):
     # Watcher Config
     is_active = Column(Boolean, default=True)
     update_frequency_hours = Column(Integer, default=24) # How often to re-crawl
+    crawl_depth = Column(Integer, default=1) # 1 = Single Page, >1 = Domain crawl page limit
     last_crawled_at = Column(DateTime, nullable=True)
     
+    # Shared Crawl (Canonical URL)
+    resource_id = Column(Integer, ForeignKey("crawled_resources.id"), nullable=True, index=True)
+    ingested_hash = Column(String(64), nullable=True) # content_hash last materialised for this subscriber
+    
     # Status
     error_count = Column(Integer, default=0)
     last_error = Column(String, nullable=True)
 
     user = relationship("User", back_populates="sources")
+    resource = relationship("CrawledResource", back_populates="subscriptions")
     
+# Cached user fields (no password hash, no relationships)
+CACHED_USER_FIELDS = ("id", "email", "is_active", "is_superuser", "is_verified")
+user_cache = TTLCache("user", settings.USER_CACHE_TTL_SECONDS)
+
+class CachedUserDatabase(SQLAlchemyUserDatabase):
+    """
+    Serves get(id) - run on every authenticated request - from user_cache instead of
+    SELECT user + JOIN oauth_accounts. Cached users are detached snapshots of CACHED_USER_FIELDS:
+    writes merge them back into the session first and invalidate the entry.
+    """
+
+    async def get(self, id):
+        cached = await user_cache.get(id)
+        if cached is not None:
+            return User(**cached)
+        user = await super().get(id)
+        if user:
+            await user_cache.set(id, {field: getattr(user, field) for field in CACHED_USER_FIELDS})
+        return user
+
+    async def _attach(self, user: User) -> User:
+        return user if user in self.session else await self.session.merge(user)
+
+    async def update(self, user, update_dict):
+        await user_cache.invalidate(user.id)
+        return await super().update(await self._attach(user), update_dict)
+
+    async def delete(self, user):
+        await user_cache.invalidate(user.id)
+        await super().delete(await self._attach(user))
+
+    async def add_oauth_account(self, user, create_dict):
+        await user_cache.invalidate(user.id)
+        return await super().add_oauth_account(await self._attach(user), create_dict)
+
+    async def update_oauth_account(self, user, oauth_account, update_dict):
+        await user_cache.invalidate(user.id)
+        return await super().update_oauth_account(await self._attach(user), oauth_account, update_dict)
+
 # Helper for FastAPI Users to access the DB
 async def get_user_db(session: AsyncSession = Depends(get_async_session)): # Depends on your DB session maker
-    yield SQLAlchemyUserDatabase(session, User, OAuthAccount)
\ No newline at end of file
+    yield CachedUserDatabase(session, User, OAuthAccount)
\ No newline at end of file
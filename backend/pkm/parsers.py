@@ -4,27 +4,59 @@ from pypdf import PdfReader
 from docx import Document as DocxDocument
 from fastapi import UploadFile
 
+from backend.core.config import settings
+from backend.core.metrics import metrics
 from backend.services.vision_service import vision_service
+from backend.services.ocr_service import ocr_service
 
-async def parse_file_bytes(content: bytes, filename: str) -> Optional[str]:
+async def image_to_text(content: bytes, filename: str, user_id: Optional[int] = None) -> str:
+    """
+    Tiered image pipeline:
+    1. Classify cheaply (pre-processing already computes it): text-dominant screenshot/scan or not.
+    2. Text-dominant -> local OCR; accepted if confident and non-trivial.
+    3. Photos, diagrams and low-confidence OCR -> vision model.
+    """
+    image = await vision_service.prepare(content, filename)
+
+    if image["text_like"] and ocr_service.available:
+        # Full resolution (the vision copy is too small for Tesseract), upright when EXIF says it was rotated
+        text, confidence = await ocr_service.transcribe(image["ocr_data"] or content)
+        if confidence >= settings.OCR_MIN_CONFIDENCE and len(text) >= settings.OCR_MIN_CHARS:
+            metrics.incr("images.ocr_local")
+            return text
+        metrics.incr("images.ocr_escalated")
+
+    metrics.incr("images.vision")
+    return await vision_service.analyze_image(
+        content, filename, dedup_scope=f"user:{user_id}" if user_id is not None else None, prepared=image
+    )
+
+async def parse_file_bytes(content: bytes, filename: str, user_id: Optional[int] = None) -> Optional[str]:
     """
     Core Logic: Extracts text from raw bytes based on extension, including using AI vision for images. 
     Used by both API Uploads and Cloud Sync.
+    With a user_id, near-duplicate images of that user reuse an earlier description.
     """
     file_ext = filename.split('.')[-1].lower()
     text = ""
     
     try:
         if file_ext in ["jpg", "jpeg", "png", "webp"]:
-            text = await vision_service.analyze_image(content, filename)
+            text = await image_to_text(content, filename, user_id)
             
         elif file_ext == "pdf":
             pdf_file = io.BytesIO(content)
             reader = PdfReader(pdf_file)
-            for page in reader.pages:
+            for number, page in enumerate(reader.pages, start=1):
                 extracted = page.extract_text()
-                if extracted:
+                if extracted and extracted.strip():
                     text += extracted + "\n"
+                    continue
+                # Image-only (scanned) page: same tiered path as image files
+                for image in page.images:
+                    extracted = await image_to_text(image.data, f"{filename} (page {number}: {image.name})", user_id)
+                    if extracted:
+                        text += extracted + "\n"
                     
         elif file_ext in ["docx", "doc"]:
             docx_file = io.BytesIO(content)
@@ -55,4 +87,4 @@ async def extract_text_from_upload(file: UploadFile) -> Optional[str]:
     """
     content = await file.read()
     await file.seek(0) # Reset cursor for safety
-    return parse_file_bytes(content, file.filename)
\ No newline at end of file
+    return await parse_file_bytes(content, file.filename)
\ No newline at end of file
@@ -1,7 +1,8 @@
 import os
+import asyncio
 import weaviate
 import hashlib
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -11,6 +12,11 @@ from langchain_core.documents import Document
 from langchain_weaviate.vectorstores import WeaviateVectorStore
 
 from backend.core.config import settings
+from backend.core.singleflight import SingleFlight
+
+# Owner ID for shared crawl copies. Never matched by search (only user_id / 0 are),
+# it only exists so subscribers can clone its precomputed vectors.
+SHARED_CACHE_USER_ID = -1
 
 class RAGService:
     def __init__(self):
@@ -31,6 +37,7 @@ class RAGService:
         )
         
         self.index_name = "KnowledgeObject"
+        self._search_flight = SingleFlight("rag_search")
         self._ensure_schema()
     
     def _ensure_schema(self):
@@ -80,7 +87,7 @@ class RAGService:
         Saves the Atomic Note and optionally the Raw Chunks.
         """
         # Generate a stable ID for linking
-        doc_id = hashlib.md5((metadata['source_url'] + str(metadata['user_id'])).encode()).hexdigest()
+        doc_id = self.make_doc_id(metadata['source_url'], metadata['user_id'])
         
         # 1. Ingest Atomic Note
         self.client.data_object.create(
@@ -115,6 +122,140 @@ class RAGService:
                         class_name="RawChunk"
                     )
             print(f"   💾 Saved {len(chunks)} Raw Chunks.")
+        
+        return doc_id
+    
+    def ingest_batch(self, documents: List[Dict[str, Any]], batch_size: int = 100) -> int:
+        """
+        Bulk ingestion for many small documents (e.g. research findings).
+        Each item: {"text": ..., "summary": ..., "metadata": {...}}.
+        Notes and chunks of every document go through a single Weaviate batch instead of
+        one create() call per note. Returns the number of objects written.
+        """
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        written = 0
+        
+        with self.client.batch as batch:
+            batch.batch_size = batch_size
+            for doc in documents:
+                metadata = doc['metadata']
+                doc_id = self.make_doc_id(metadata['source_url'], metadata['user_id'])
+                chunks = text_splitter.split_text(doc['text']) if doc.get('text') else []
+                
+                batch.add_data_object(
+                    data_object={
+                        "content": doc['summary'],
+                        "source_url": metadata['source_url'],
+                        "title": metadata.get('title', 'Untitled'),
+                        "user_id": metadata['user_id'],
+                        "scope": metadata['scope'],
+                        "doc_id": doc_id,
+                        "has_raw": bool(chunks)
+                    },
+                    class_name="AtomicNote"
+                )
+                
+                for idx, chunk in enumerate(chunks):
+                    batch.add_data_object(
+                        data_object={
+                            "content": chunk,
+                            "doc_id": doc_id,
+                            "user_id": metadata['user_id'],
+                            "chunk_index": idx
+                        },
+                        class_name="RawChunk"
+                    )
+                written += 1 + len(chunks)
+        
+        print(f"   💾 Batch-saved {len(documents)} documents ({written} objects).")
+        return written
+    
+    @staticmethod
+    def make_doc_id(source_url: str, user_id: int) -> str:
+        """Stable ID linking an Atomic Note to its Raw Chunks."""
+        return hashlib.md5((source_url + str(user_id)).encode()).hexdigest()
+    
+    def delete_document(self, doc_id: str):
+        """Removes a note and its raw chunks (used before re-ingesting changed content)."""
+        for class_name in ("AtomicNote", "RawChunk"):
+            self.client.batch.delete_objects(
+                class_name=class_name,
+                where={"path": ["doc_id"], "operator": "Equal", "valueText": doc_id}
+            )
+    
+    def clone_document(self, source_doc_id: str, metadata: Dict[str, Any]) -> Optional[str]:
+        """
+        Copies an already-embedded document to another owner, reusing the stored vectors.
+        Nothing is re-embedded, so each extra subscriber of a shared crawl costs no vectorizer calls.
+        Returns the new doc_id, or None if the source document does not exist.
+        """
+        doc_filter = {"path": ["doc_id"], "operator": "Equal", "valueText": source_doc_id}
+        
+        note_response = (
+            self.client.query
+            .get("AtomicNote", ["content", "title", "has_raw"])
+            .with_where(doc_filter)
+            .with_additional(["vector"])
+            .with_limit(1)
+            .do()
+        )
+        notes = note_response.get('data', {}).get('Get', {}).get('AtomicNote', [])
+        if not notes:
+            return None
+        note = notes[0]
+        
+        chunk_response = (
+            self.client.query
+            .get("RawChunk", ["content", "chunk_index"])
+            .with_where(doc_filter)
+            .with_additional(["vector"])
+            .with_limit(10000)
+            .do()
+        )
+        chunks = chunk_response.get('data', {}).get('Get', {}).get('RawChunk', [])
+        
+        # Replace any previous copy for this owner
+        doc_id = self.make_doc_id(metadata['source_url'], metadata['user_id'])
+        self.delete_document(doc_id)
+        
+        self.client.data_object.create(
+            data_object={
+                "content": note['content'],
+                "source_url": metadata['source_url'],
+                "title": metadata.get('title') or note['title'],
+                "user_id": metadata['user_id'],
+                "scope": metadata['scope'],
+                "doc_id": doc_id,
+                "has_raw": note.get('has_raw', bool(chunks))
+            },
+            class_name="AtomicNote",
+            vector=note['_additional']['vector']
+        )
+        
+        with self.client.batch as batch:
+            batch.batch_size = 100
+            for chunk in chunks:
+                batch.add_data_object(
+                    data_object={
+                        "content": chunk['content'],
+                        "doc_id": doc_id,
+                        "user_id": metadata['user_id'],
+                        "chunk_index": chunk['chunk_index']
+                    },
+                    class_name="RawChunk",
+                    vector=chunk['_additional']['vector']
+                )
+        print(f"   ♻️ Cloned shared document ({len(chunks)} chunks) for user {metadata['user_id']}")
+        
+        return doc_id
+    
+    async def asearch(self, query: str, user_id: int, k: int = 4) -> List[Dict]:
+        """
+        Async search (runs the blocking Weaviate client in a thread).
+        Identical concurrent searches for the same user share one round-trip.
+        """
+        key = (" ".join(query.lower().split()), user_id, k)
+        return await self._search_flight.do(key, lambda: asyncio.to_thread(self.search, query, user_id, k))
     
     def search(self, query: str, user_id: int, k: int = 4) -> List[Dict]:
         """
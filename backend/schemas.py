@@ -1,4 +1,5 @@
-from pydantic import BaseModel, Field
+import hashlib
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, Literal, List, Dict, Any
 from datetime import date, datetime
 
@@ -74,9 +75,23 @@ class ChatRequest(BaseModel):
     model_provider: Optional[Literal["openai", "google", "anthropic"]] = None
     model_name: Optional[str] = None 
     
+    # Conversation Memory: turns with the same id share context ("default" if omitted)
+    conversation_id: Optional[str] = None
+
     # Optional: For debugging or specific constraints
     include_sources: bool = True
 
+    @field_validator("conversation_id")
+    @classmethod
+    def fit_conversation_id(cls, value: Optional[str]) -> Optional[str]:
+        """Client-supplied ids must fit the String(64) column: longer ones are hashed (stable per id)."""
+        value = (value or "").strip()
+        if not value:
+            return None
+        if len(value) > 64:
+            return hashlib.sha256(value.encode("utf-8")).hexdigest()
+        return value
+
 class AgentConfig(BaseModel):
     """Defines the configuration for a specific Agent personality."""
     name: str
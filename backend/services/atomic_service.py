@@ -2,11 +2,12 @@ import json
 import tiktoken
 from typing import List, Optional
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 
 from backend.core.config import settings
+from backend.core.rate_limiter import BACKGROUND
+from backend.agents.llm_factory import LLMFactory
 
 class AtomicNoteSchema(BaseModel):
     title: str = Field(description="A concise title for the note.")
@@ -18,15 +19,46 @@ class AtomicNoteSchema(BaseModel):
     action_idea: Optional[str] = Field(default=None, description="Concrete next steps or projects implied by the text.")
     reference: str = Field(description="The source URL.")
 
+ATOMIC_NOTE_SYSTEM_PROMPT = """
+You are an expert Knowledge Manager. 
+Analyze the provided document and distill it into an "Atomic Note".
+
+GOALS:
+- Identify the Broad Disciplines (e.g. Economics, Physics).
+- Extract specific Keywords (Tags).
+- Synthesize the "Essence" (Abstract).
+- Detail the "Core Idea" (The Knowledge).
+- Extract "Action Items" if applicable.
+
+STRUCTURE REQUIREMENTS:
+1. Title: Clear and descriptive.
+2. Disciplines: Relevant academic or professional disciplines 
+3. Tags: Relevant keywords (#) and actions (@).
+4. Essence: A high-level abstract.
+5. Core Idea: The detailed insight.
+6. Action Idea: If the content implies a task or project, extract it.
+7. Reference: The source URL provided.
+
+Refuse to hallucinate. If the document is empty or noise, return "N/A" fields.
+"""
+
 class AtomicService:
     def __init__(self):
         # Use a smart model for semantic analysis
-        self.llm = ChatOpenAI(
-            model="gpt-4o", 
+        # Background lane: bulk syncs must not starve interactive chat of OpenAI capacity
+        self.llm = LLMFactory().create_guarded_llm(
+            "openai",
+            "gpt-4o",
             temperature=0.1, # Low temp for strict JSON adherence
-            api_key=settings.OPENAI_API_KEY
+            priority=BACKGROUND,
+            chain_name="atomic_note"
         )
         self.parser = PydanticOutputParser(pydantic_object=AtomicNoteSchema)
+        # Instructions + format instructions are a static prefix; only the document varies per call
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", ATOMIC_NOTE_SYSTEM_PROMPT + "\n{format_instructions}"),
+            ("user", "Source URL: {source_url}\n\nCONTENT:\n{content}")
+        ]).partial(format_instructions=self.parser.get_format_instructions())
         self.tokenizer = tiktoken.encoding_for_model("gpt-4o")
         
     def _truncate_content(self, text: str, max_tokens: int = 120000) -> str:
@@ -44,42 +76,12 @@ class AtomicService:
         # We leave ~8k tokens for the response and system prompt
         safe_content = self._truncate_content(raw_content, max_tokens=110000)
         
-        # System Prompt
-        system_prompt = """
-        You are an expert Knowledge Manager. 
-        Analyze the provided document and distill it into an "Atomic Note".
-        
-        GOALS:
-        - Identify the Broad Disciplines (e.g. Economics, Physics).
-        - Extract specific Keywords (Tags).
-        - Synthesize the "Essence" (Abstract).
-        - Detail the "Core Idea" (The Knowledge).
-        - Extract "Action Items" if applicable.
-        
-        STRUCTURE REQUIREMENTS:
-        1. Title: Clear and descriptive.
-        2. Disciplines: Relevant academic or professional disciplines 
-        3. Tags: Relevant keywords (#) and actions (@).
-        4. Essence: A high-level abstract.
-        5. Core Idea: The detailed insight.
-        6. Action Idea: If the content implies a task or project, extract it.
-        7. Reference: The source URL provided.
-        
-        Refuse to hallucinate. If the document is empty or noise, return "N/A" fields.
-        """
-
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            ("user", "Source URL: {source_url}\n\nCONTENT:\n{content}\n\n{format_instructions}")
-        ])
-
-        chain = prompt | self.llm | self.parser
+        chain = self.prompt | self.llm | self.parser
         
         try:
             return await chain.ainvoke({
                 "content": safe_content,
-                "source_url": source_url,
-                "format_instructions": self.parser.get_format_instructions()
+                "source_url": source_url
             })
         except Exception as e:
             # Fallback for parsing errors (Auto-fix logic could go here)
@@ -0,0 +1,206 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from sqlalchemy import select, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+from backend.core.rate_limiter import estimate_tokens, BACKGROUND
+from backend.db.session import async_session_maker
+from backend.db.models import ConversationTurn, ConversationSummary
+from backend.agents.llm_factory import LLMFactory
+
+DEFAULT_CONVERSATION = "default"
+EMPTY_HISTORY = "(new conversation)"
+
+SUMMARY_SYSTEM_PROMPT = """
+You maintain the running memory of a conversation between a user and their LifeOS assistant.
+Merge the NEW TURNS into the EXISTING SUMMARY.
+- Keep facts about the user, their goals, decisions made, open questions and commitments.
+- Drop greetings, filler and details that were fully resolved.
+- Write compact third-person notes, no headings.
+- Stay under {max_words} words.
+"""
+
+class ConversationMemory:
+    """
+    Per-user conversation context with a constant prompt size.
+    - Every message is one appended ConversationTurn row (single INSERT per exchange).
+    - The prompt gets: the rolling summary + the most recent turns within CHAT_MEMORY_WINDOW_TOKENS.
+    - Turns pushed out of the window are folded into the summary in the background,
+      one bounded chunk per LLM call, one summarizer at a time per conversation.
+    """
+
+    def __init__(self):
+        self.llm = LLMFactory().create_guarded_llm(
+            "openai", "gpt-4o-mini", 0.0, priority=BACKGROUND, chain_name="chat.memory_summary"
+        )
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", SUMMARY_SYSTEM_PROMPT),
+            ("user", "EXISTING SUMMARY:\n{summary}\n\nNEW TURNS:\n{turns}")
+        ]).partial(max_words=str(int(settings.CHAT_MEMORY_SUMMARY_TOKENS * 0.75)))
+        self._running: Dict[Tuple[int, str], asyncio.Task] = {} # One summarizer per conversation
+
+    async def _load(self, db: AsyncSession, user_id: int, conversation_id: str, limit: int, oldest: bool = False) -> Tuple[Optional[ConversationSummary], List[ConversationTurn]]:
+        """Summary row + 'limit' unsummarized turns, the newest ones (or the oldest ones), returned oldest first."""
+        summary = (await db.execute(
+            select(ConversationSummary).where(
+                ConversationSummary.user_id == user_id,
+                ConversationSummary.conversation_id == conversation_id
+            )
+        )).scalars().first()
+        through_id = summary.summarized_through_id if summary else 0
+
+        query = (
+            select(ConversationTurn)
+            .where(
+                ConversationTurn.user_id == user_id,
+                ConversationTurn.conversation_id == conversation_id,
+                ConversationTurn.id > through_id
+            )
+            .order_by(ConversationTurn.id.asc() if oldest else ConversationTurn.id.desc())
+            .limit(limit)
+        )
+        turns = (await db.execute(query)).scalars().all()
+        return summary, list(turns) if oldest else list(reversed(turns))
+
+    async def _pending(self, db: AsyncSession, user_id: int, conversation_id: str) -> Tuple[int, int]:
+        """Token total and count of the unsummarized turns (one indexed query)."""
+        through_id = select(ConversationSummary.summarized_through_id).where(
+            ConversationSummary.user_id == user_id,
+            ConversationSummary.conversation_id == conversation_id
+        ).scalar_subquery()
+        tokens, count = (await db.execute(
+            select(func.coalesce(func.sum(ConversationTurn.token_count), 0), func.count(ConversationTurn.id)).where(
+                ConversationTurn.user_id == user_id,
+                ConversationTurn.conversation_id == conversation_id,
+                ConversationTurn.id > func.coalesce(through_id, 0)
+            )
+        )).one()
+        return tokens, count
+
+    def _window(self, turns: List[ConversationTurn]) -> List[ConversationTurn]:
+        """Most recent turns that fit the token window (always at least the last one)."""
+        window, used = [], 0
+        for turn in reversed(turns):
+            if window and used + turn.token_count > settings.CHAT_MEMORY_WINDOW_TOKENS:
+                break
+            window.append(turn)
+            used += turn.token_count
+        return list(reversed(window))
+
+    @staticmethod
+    def _format_turns(turns: List[ConversationTurn], max_chars: Optional[int] = None) -> str:
+        return "\n".join(f"{turn.role.upper()}: {turn.content[:max_chars]}" for turn in turns)
+
+    async def load_context(self, db: AsyncSession, user_id: int, conversation_id: Optional[str] = None) -> str:
+        """Conversation history for the prompt. Bounded by summary size + window size."""
+        conversation_id = conversation_id or DEFAULT_CONVERSATION
+        summary, turns = await self._load(db, user_id, conversation_id, limit=settings.CHAT_MEMORY_MAX_TURNS)
+        window = self._window(turns)
+
+        parts = []
+        if summary and summary.summary:
+            parts.append(f"Earlier in this conversation (summary):\n{summary.summary}")
+        if window:
+            parts.append(f"Recent messages:\n{self._format_turns(window)}")
+
+        history = "\n\n".join(parts)
+        metrics.observe("chat.memory_tokens", estimate_tokens(history) if history else 0)
+        return history or EMPTY_HISTORY
+
+    async def append_exchange(self, db: AsyncSession, user_id: int, conversation_id: Optional[str], query: str, answer: str):
+        """Appends the user and assistant messages (one INSERT), then schedules summarization if the window overflowed."""
+        conversation_id = conversation_id or DEFAULT_CONVERSATION
+        try:
+            now = datetime.utcnow()
+            await db.execute(insert(ConversationTurn), [
+                {"user_id": user_id, "conversation_id": conversation_id, "role": "user",
+                 "content": query, "token_count": estimate_tokens(query), "created_at": now},
+                {"user_id": user_id, "conversation_id": conversation_id, "role": "assistant",
+                 "content": answer, "token_count": estimate_tokens(answer), "created_at": now},
+            ])
+            await db.commit()
+
+            # Cheap check: token total of the unsummarized turns
+            pending_tokens, _ = await self._pending(db, user_id, conversation_id)
+            if pending_tokens > settings.CHAT_MEMORY_WINDOW_TOKENS:
+                self._schedule_summary(user_id, conversation_id)
+        except Exception as e:
+            # Memory is best-effort: never fail an answer that was already generated
+            print(f"❌ Failed to store conversation turns ({user_id}/{conversation_id}): {e}")
+
+    def _schedule_summary(self, user_id: int, conversation_id: str):
+        key = (user_id, conversation_id)
+        if key in self._running and not self._running[key].done():
+            return # Already folding; the next exchange re-checks
+        task = asyncio.create_task(self._summarize(user_id, conversation_id))
+        self._running[key] = task
+        task.add_done_callback(lambda _: self._running.pop(key, None))
+
+    async def _summarize(self, user_id: int, conversation_id: str):
+        """
+        Folds the turns that no longer fit the window into the rolling summary (own DB session).
+        Oldest first, in chunks of at most CHAT_MEMORY_FOLD_TOKENS per LLM call, each committed
+        before the next, so a long backlog never becomes one huge prompt or one huge read.
+        """
+        try:
+            async with async_session_maker() as db:
+                folded = 0
+                while True:
+                    pending_tokens, pending_count = await self._pending(db, user_id, conversation_id)
+                    summary, turns = await self._load(db, user_id, conversation_id, limit=settings.CHAT_MEMORY_MAX_TURNS, oldest=True)
+
+                    # A turn is outside the window while the turns from it onwards exceed the window
+                    # (the newest turn always stays, like in _window)
+                    chunk, used = [], 0
+                    for turn in turns:
+                        if pending_tokens <= settings.CHAT_MEMORY_WINDOW_TOKENS or pending_count <= 1:
+                            break
+                        if chunk and used + turn.token_count > settings.CHAT_MEMORY_FOLD_TOKENS:
+                            break
+                        chunk.append(turn)
+                        used += turn.token_count
+                        pending_tokens -= turn.token_count
+                        pending_count -= 1
+                    if not chunk:
+                        break
+
+                    with metrics.timer("chat.memory_summarize"):
+                        new_summary = await (self.prompt | self.llm | StrOutputParser()).ainvoke({
+                            "summary": summary.summary if summary and summary.summary else "(empty)",
+                            # A single oversized turn is cut to the chunk budget (~4 chars per token)
+                            "turns": self._format_turns(chunk, max_chars=settings.CHAT_MEMORY_FOLD_TOKENS * 4)
+                        })
+
+                    stmt = pg_insert(ConversationSummary).values(
+                        user_id=user_id,
+                        conversation_id=conversation_id,
+                        summary=new_summary.strip(),
+                        summarized_through_id=chunk[-1].id,
+                        updated_at=datetime.utcnow()
+                    )
+                    await db.execute(stmt.on_conflict_do_update(
+                        index_elements=["user_id", "conversation_id"],
+                        set_={
+                            "summary": stmt.excluded.summary,
+                            "summarized_through_id": stmt.excluded.summarized_through_id,
+                            "updated_at": stmt.excluded.updated_at
+                        }
+                    ))
+                    await db.commit()
+                    metrics.incr("chat.memory_turns_summarized", len(chunk))
+                    folded += len(chunk)
+
+                if folded:
+                    print(f"🧠 Folded {folded} turns into the summary of conversation {user_id}/{conversation_id}")
+        except Exception as e:
+            print(f"❌ Conversation summarization failed ({user_id}/{conversation_id}): {e}")
+
+# Singleton
+conversation_memory = ConversationMemory()
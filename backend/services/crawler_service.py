@@ -1,10 +1,20 @@
 import os
+import time
+import asyncio
+import httpx
 from firecrawl import FirecrawlApp
-from typing import Optional, Dict
+from typing import Optional, Dict, AsyncIterator
+
+from backend.core.config import settings
+
+# Sentinel pushed by the poller when the crawl job has no more pages
+_CRAWL_DONE = object()
 
 class CrawlerService:
     def __init__(self):
         api_key = os.getenv("FIRECRAWL_API_KEY")
+        self.api_key = api_key
+        self.api_url = "https://api.firecrawl.dev"
         self.app = FirecrawlApp(api_key=api_key)
 
     async def crawl_url(self, url: str) -> Optional[Dict]:
@@ -13,14 +23,14 @@ class CrawlerService:
             raise ValueError("Firecrawl API Key not configured.")
 
         print(f"🕷️ Crawling: {url}...")
-        
+
         try:
             # Scrape specific URL (fast)
             scrape_result = self.app.scrape_url(url, params={
                 'formats': ['markdown'],
                 'onlyMainContent': True
             })
-            
+
             return {
                 "title": scrape_result.get('metadata', {}).get('title', 'Untitled'),
                 "content": scrape_result.get('markdown', ''),
@@ -30,42 +40,115 @@ class CrawlerService:
             print(f"❌ Crawl Failed for {url}: {e}")
             return None
 
-    async def crawl_domain(self, domain_url: str, limit: int = 10) -> list[Dict]:
-        """Crawls an entire domain (e.g., a documentation site)."""
-        if not self.app: return []
+    async def crawl_domain(self, domain_url: str, limit: int = 10, queue_size: Optional[int] = None) -> AsyncIterator[Dict]:
+        """
+        Crawls an entire domain (e.g., a documentation site).
+        Async generator: yields pages as soon as Firecrawl has scraped them, so ingestion
+        can start on page 1 while the rest of the site is still being crawled.
+        Memory is bounded by 'queue_size' (pages buffered), not by the size of the site.
+        """
+        if not self.app: return
 
         print(f"🕸️ Submitting Crawl Job: {domain_url}...")
-        
-        # 1. Submit Async Job
-        crawl_job = self.app.async_crawl_url(domain_url, params={
-            'limit': limit, 
+
+        # 1. Submit Async Job (SDK call is blocking HTTP, keep it off the event loop)
+        crawl_job = await asyncio.to_thread(self.app.async_crawl_url, domain_url, params={
+            'limit': limit,
             'scrapeOptions': {'formats': ['markdown']}
         })
-        
+
         job_id = crawl_job['id']
         print(f" ↳ Job ID: {job_id}")
 
-        # 2. Polling Loop
-        max_retries = 20 # Wait up to ~100 seconds
-        for _ in range(max_retries):
-            status_response = self.app.check_crawl_status(job_id)
-            status = status_response['status']
-            
-            print(f" ↳ Status: {status}...")
-            
-            if status == 'completed':
-                print("   ✅ Crawl Finished.")
-                return status_response['data'] # The list of pages
-            
-            elif status == 'failed':
-                print("   ❌ Crawl Job Failed.")
-                return []
-            
-            # Wait 5 seconds before checking again
-            await asyncio.sleep(5)
-
-        print(" ⚠️ Crawl Timed Out.")
-        return []
+        # 2. Poll in the background, hand pages over through a bounded queue.
+        # When the consumer is slow, queue.put() blocks and the poller stops fetching.
+        queue = asyncio.Queue(maxsize=queue_size or settings.CRAWL_QUEUE_SIZE)
+        poller = asyncio.create_task(self._poll_crawl_job(job_id, queue))
+
+        try:
+            while True:
+                page = await queue.get()
+                if page is _CRAWL_DONE:
+                    break
+                yield page
+        finally:
+            # Consumer stopped early (break / error) -> stop polling
+            poller.cancel()
+            try:
+                await poller
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def _poll_crawl_job(self, job_id: str, queue: asyncio.Queue):
+        """Background poller. Always signals the consumer when it stops (unless cancelled by it)."""
+        try:
+            await self._fetch_crawl_pages(job_id, queue)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f" ❌ Crawl polling failed for job {job_id}: {e}")
+
+        await queue.put(_CRAWL_DONE)
+
+    async def _fetch_crawl_pages(self, job_id: str, queue: asyncio.Queue):
+        """
+        Walks the paginated crawl status endpoint.
+        'skip' is the number of pages already handed over, so each poll only downloads new pages.
+        """
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        consumed = 0
+        last_progress = time.monotonic()
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            while True:
+                url = f"{self.api_url}/v1/crawl/{job_id}"
+                params = {"skip": consumed}
+                status = None
+
+                # Follow 'next' links until the current batch of finished pages is drained
+                while url:
+                    resp = await client.get(url, headers=headers, params=params)
+                    resp.raise_for_status()
+                    status_response = resp.json()
+                    status = status_response.get('status')
+
+                    pages = status_response.get('data') or []
+                    for page in pages:
+                        await queue.put(self._normalize_page(page))
+
+                    if pages:
+                        consumed += len(pages)
+                        last_progress = time.monotonic()
+
+                    # 'next' already carries the right skip offset
+                    url = status_response.get('next')
+                    params = None
+
+                print(f" ↳ Status: {status} ({consumed} pages streamed)...")
+
+                if status == 'completed':
+                    print("   ✅ Crawl Finished.")
+                    return
+
+                elif status == 'failed':
+                    print("   ❌ Crawl Job Failed.")
+                    return
+
+                # Only time out when the job stops making progress, not on total site size
+                if time.monotonic() - last_progress > settings.CRAWL_IDLE_TIMEOUT_SECONDS:
+                    print(" ⚠️ Crawl Timed Out (no new pages).")
+                    return
+
+                await asyncio.sleep(settings.CRAWL_POLL_INTERVAL_SECONDS)
+
+    def _normalize_page(self, page: Dict) -> Dict:
+        """Maps a Firecrawl page to the same shape as crawl_url()."""
+        metadata = page.get('metadata', {}) or {}
+        return {
+            "title": metadata.get('title', 'Untitled'),
+            "content": page.get('markdown', ''),
+            "source_url": metadata.get('sourceURL') or metadata.get('url', '')
+        }
 
 # Singleton
-crawler = CrawlerService()
\ No newline at end of file
+crawler = CrawlerService()
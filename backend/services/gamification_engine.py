@@ -1,153 +1,286 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+import asyncio
+from sqlalchemy import select, update, insert, delete, case, and_, or_
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timedelta
 
 from backend.db.models import UserProfile, Goal, SubGoal, GoalTask, GoalStatus
+from backend.db.session import async_session_maker
+from backend.core.config import settings
+from backend.core.metrics import metrics
+from backend.services.user_service import profile_cache
+
+WEEKLY_TOKENS = 3 # Tokens granted at every weekly reset
 
 class GamificationEngine:
+
+    @staticmethod
+    def _new_profile_insert(user_id: int):
+        """INSERT of a fresh profile that is a no-op if one already exists (safe under concurrent requests)."""
+        return pg_insert(UserProfile).values(
+            user_id=user_id,
+            weekly_tokens=WEEKLY_TOKENS,
+            tokens_used=0,
+            last_reset_date=datetime.utcnow(),
+            agent_preferences={},
+            interaction_history=[]
+        ).on_conflict_do_nothing(index_elements=["user_id"])
     
     @staticmethod
     async def get_or_create_profile(db: AsyncSession, user_id: int) -> UserProfile:
         result = await db.execute(select(UserProfile).where(UserProfile.user_id == user_id))
         profile = result.scalars().first()
         if not profile:
-            profile = UserProfile(user_id=user_id)
-            db.add(profile)
+            await db.execute(GamificationEngine._new_profile_insert(user_id))
             await db.commit()
-            await db.refresh(profile)
+            result = await db.execute(select(UserProfile).where(UserProfile.user_id == user_id))
+            profile = result.scalars().one()
         return profile
 
+    @staticmethod
+    def _week_expired(now: datetime):
+        return UserProfile.last_reset_date <= now - timedelta(days=7)
+
+    @staticmethod
+    async def _end_weeks(db: AsyncSession, due: list, now: datetime) -> int:
+        """
+        The weekly reset rule, shared by the batch job and the lazy per-user reset.
+        'due' are locked (id, user_id, weekly_tokens) rows whose week ended:
+        users who ended it with no tokens left get their ACTIVE goals FAILED (F-3.7), then every
+        profile gets a fresh week. Returns the number of goals failed.
+        """
+        failed = 0
+        exhausted = [row.user_id for row in due if row.weekly_tokens <= 0]
+        if exhausted:
+            failed = (await db.execute(
+                update(Goal)
+                .where(Goal.user_id.in_(exhausted), Goal.status == GoalStatus.ACTIVE)
+                .values(status=GoalStatus.FAILED)
+            )).rowcount
+            metrics.incr("gamification.goals_failed", failed)
+
+        await db.execute(
+            update(UserProfile)
+            .where(UserProfile.id.in_([row.id for row in due]))
+            .values(weekly_tokens=WEEKLY_TOKENS, tokens_used=0, last_reset_date=now)
+        )
+        return failed
+
+    @staticmethod
+    async def end_expired_week(db: AsyncSession, user_id: int) -> bool:
+        """
+        Lazy weekly reset for one user (same rule as the batch job). Does not commit.
+        Returns True if the user's week had ended and was reset.
+        """
+        now = datetime.utcnow()
+        row = (await db.execute(
+            select(UserProfile.id, UserProfile.user_id, UserProfile.weekly_tokens)
+            .where(UserProfile.user_id == user_id, GamificationEngine._week_expired(now))
+            .with_for_update()
+        )).first()
+        if row is None:
+            return False
+        await GamificationEngine._end_weeks(db, [row], now)
+        return True
+
     @staticmethod
     async def process_weekly_reset(db: AsyncSession, user_id: int):
         """
-        Checks if 7 days have passed. If so, resets tokens to 3.
+        Checks if 7 days have passed. If so, fails an exhausted week and resets tokens to 3.
         """
-        profile = await GamificationEngine.get_or_create_profile(db, user_id)
-        
-        if not profile.last_reset_date:
-            profile.last_reset_date = datetime.utcnow()
+        if await GamificationEngine.end_expired_week(db, user_id):
             await db.commit()
-            return
+            await profile_cache.invalidate(user_id)
 
-        days_diff = (datetime.utcnow() - profile.last_reset_date).days
-        
-        if days_diff >= 7:
-            profile.weekly_tokens = 3
-            profile.tokens_used = 0
-            profile.last_reset_date = datetime.utcnow()
-            db.add(profile)
-            await db.commit()
+    @staticmethod
+    def _use_token_statement(user_id: int):
+        """
+        Weekly reset + deduction in one conditional UPDATE ... RETURNING.
+        The WHERE clause is re-checked on the locked row, so concurrent clicks can never overspend:
+        exactly one of two racing requests gets the last token.
+        Only weeks that ended with tokens left are reset inline (nothing to fail); a week that
+        ended with none matches no row and goes through end_expired_week, like the batch job.
+        """
+        now = datetime.utcnow()
+        expired = or_(UserProfile.last_reset_date.is_(None), GamificationEngine._week_expired(now))
+        # Missing date: initialise only
+        reset = and_(UserProfile.last_reset_date.isnot(None), expired, UserProfile.weekly_tokens > 0)
+        return (
+            update(UserProfile)
+            .where(UserProfile.user_id == user_id, or_(reset, UserProfile.weekly_tokens > 0))
+            .values(
+                # SET expressions all see the row as it was before this statement
+                weekly_tokens=case((reset, WEEKLY_TOKENS - 1), else_=UserProfile.weekly_tokens - 1),
+                tokens_used=case((reset, 1), else_=UserProfile.tokens_used + 1),
+                last_reset_date=case((expired, now), else_=UserProfile.last_reset_date)
+            )
+            .returning(UserProfile.weekly_tokens)
+        )
 
     @staticmethod
     async def use_token(db: AsyncSession, user_id: int) -> dict:
         """
         Handles token deduction and failure logic.
+        Hot path: one UPDATE + commit. Otherwise an exhausted week that ended is reset (end_expired_week)
+        or a missing profile is created (INSERT ... ON CONFLICT), and the UPDATE retried once.
         """
-        # 1. Check for Weekly Reset first
-        await GamificationEngine.process_weekly_reset(db, user_id)
-        
-        profile = await GamificationEngine.get_or_create_profile(db, user_id)
-        
-        if profile.weekly_tokens > 0:
-            profile.weekly_tokens -= 1
-            profile.tokens_used += 1
-            db.add(profile)
+        row = (await db.execute(GamificationEngine._use_token_statement(user_id))).first()
+
+        if row is None:
+            # No row matched: the week ended with no tokens left, no profile yet, or no tokens left this week
+            if await GamificationEngine.end_expired_week(db, user_id):
+                row = (await db.execute(GamificationEngine._use_token_statement(user_id))).first()
+            else:
+                created = await db.execute(GamificationEngine._new_profile_insert(user_id).returning(UserProfile.id))
+                if created.first() is not None:
+                    row = (await db.execute(GamificationEngine._use_token_statement(user_id))).first()
+
+        if row is not None:
             await db.commit()
-            return {"success": True, "remaining": profile.weekly_tokens, "message": "Token used"}
+            await profile_cache.invalidate(user_id) # Cached weekly_tokens changed
+            return {"success": True, "remaining": row.weekly_tokens, "message": "Token used"}
         
         else:
-            # F-3.7: Token Limit Exceeded -> RESTART PLAN
-            await GamificationEngine.fail_current_week(db, user_id)
-            return {
-                "success": False, 
-                "remaining": 0, 
-                "message": "Out of tokens! Current week's plan has failed. You must restart."
-            }
+            # Nothing is written here: a week that ends with no tokens left is failed when it is reset
+            return {"success": False, "remaining": 0, "message": "No tokens left!"}
 
     @staticmethod
     async def fail_current_week(db: AsyncSession, user_id: int):
         """
-        Marks all active goals as FAILED when tokens run out.
+        Marks all active goals as FAILED when tokens run out (one UPDATE).
         """
-        # Find all active goals for this user
-        result = await db.execute(
-            select(Goal).where(
-                Goal.user_id == user_id, 
-                Goal.status == GoalStatus.ACTIVE
-            )
+        await db.execute(
+            update(Goal)
+            .where(Goal.user_id == user_id, Goal.status == GoalStatus.ACTIVE)
+            .values(status=GoalStatus.FAILED)
         )
-        active_goals = result.scalars().all()
-        
-        for goal in active_goals:
-            goal.status = GoalStatus.FAILED
-            db.add(goal)
-            
         await db.commit()
 
+    @staticmethod
+    async def reset_due_chunk(db: AsyncSession, chunk_size: int) -> int:
+        """
+        One chunk of the weekly batch (one transaction, set-based statements):
+        1. Lock up to chunk_size profiles whose week ended (skipping rows a request is updating right now).
+        2. _end_weeks: users who ended the week with no tokens left get ACTIVE goals -> FAILED (F-3.7),
+           every locked profile gets its tokens reset.
+        Returns the number of profiles reset (0 = nothing left to do).
+        """
+        now = datetime.utcnow()
+        due = (await db.execute(
+            select(UserProfile.id, UserProfile.user_id, UserProfile.weekly_tokens)
+            .where(GamificationEngine._week_expired(now))
+            .order_by(UserProfile.last_reset_date)
+            .limit(chunk_size)
+            .with_for_update(skip_locked=True)
+        )).all()
+        if not due:
+            return 0
+
+        await GamificationEngine._end_weeks(db, due, now)
+        await db.commit()
+        await profile_cache.invalidate(*(row.user_id for row in due))
+        metrics.incr("gamification.weekly_resets", len(due))
+        return len(due)
+
     @staticmethod
     async def restart_week(db: AsyncSession, user_id: int, agent_service):
         """
         1. Identifies FAILED tasks in the current active SubGoal.
         2. Archives the failed attempts.
-        3. Calls AI to break them down into easier steps.
+        3. Calls AI to break them down into easier steps (concurrently, bounded by GOAL_REPLAN_CONCURRENCY).
         4. Resets Status to ACTIVE.
+        Constant number of statements however many subgoals: 2 reads (subgoals + their incomplete tasks),
+        1 bulk DELETE, 1 bulk INSERT, 1 UPDATE of the goals.
         """
-        # 1. Get the Failed Goal & SubGoal
+        # 1. Get the Failed Goals' SubGoals with their incomplete tasks (selectinload: one extra query in total)
         # (Simplified query for demo: getting active goal's current subgoal)
         # In production, track "current_weekly_subgoal_id" in UserProfile
-        
+        # We keep 'is_completed=True' tasks alone: only what they FAILED is loaded
         result = await db.execute(
             select(SubGoal)
             .join(Goal)
             .where(Goal.user_id == user_id, Goal.status == GoalStatus.FAILED)
+            .options(selectinload(SubGoal.tasks.and_(GoalTask.is_completed == False)))
         )
         failed_subgoals = result.scalars().all()
         
         if not failed_subgoals:
             return {"message": "No failed goals to restart."}
 
-        for subgoal in failed_subgoals:
-            # 2. Identify Progress
-            # We keep 'is_completed=True' tasks alone!
-            
-            result_tasks = await db.execute(
-                select(GoalTask).where(
-                    GoalTask.subgoal_id == subgoal.id,
-                    GoalTask.is_completed == False # Only get what they FAILED
-                )
-            )
-            failed_tasks = result_tasks.scalars().all()
-            
-            if not failed_tasks:
-                continue # They finished everything? Then why is goal failed? (Edge case)
+        # 2. Identify Progress
+        # They finished everything? Then why is goal failed? (Edge case: nothing to replan)
+        to_replan = [(subgoal, subgoal.tasks) for subgoal in failed_subgoals if subgoal.tasks]
 
-            failed_descriptions = [t.description for t in failed_tasks]
-            
-            # 3. AI Replanning (The "Smart" part)
-            new_micro_tasks = agent_service.replan_week(failed_descriptions)
+        # 3. AI Replanning (The "Smart" part)
+        # One LLM call per subgoal, run concurrently but bounded. DB work stays sequential on the session.
+        semaphore = asyncio.Semaphore(settings.GOAL_REPLAN_CONCURRENCY)
+
+        async def replan(failed_tasks):
+            async with semaphore:
+                return await agent_service.areplan_week([t.description for t in failed_tasks])
+
+        plans = await asyncio.gather(*(replan(tasks) for _, tasks in to_replan), return_exceptions=True)
+
+        stale_task_ids, new_task_rows, restarted_goal_ids = [], [], set()
+        for (subgoal, failed_tasks), new_micro_tasks in zip(to_replan, plans):
+            if isinstance(new_micro_tasks, Exception):
+                print(f"❌ Replanning failed for subgoal {subgoal.id}: {new_micro_tasks}")
+                continue # Keep the old tasks; the goal stays FAILED
             
             # 4. Database Updates
             # Option A: Delete old failed tasks (cleaner UI)
-            for old_task in failed_tasks:
-                await db.delete(old_task)
+            stale_task_ids.extend(task.id for task in failed_tasks)
             
             # Option B: Mark them as "Abandoned" if want to preserve history (better for analytics)
             # for old_task in failed_tasks:
             #    old_task.is_completed = False 
             #    old_task.description = f"[Failed] {old_task.description}"
             
-            # 5. Insert New Micro-Tasks
             for micro_task in new_micro_tasks:
-                new_task_db = GoalTask(
-                    subgoal_id=subgoal.id,
-                    description=micro_task, # The easier version
-                    is_completed=False,
-                    was_failed_previously=True # Flag this so UI can show "Retry" badge
-                )
-                db.add(new_task_db)
+                new_task_rows.append({
+                    "subgoal_id": subgoal.id,
+                    "description": micro_task.get("description") or micro_task.get("title"), # The easier version
+                    "difficulty": micro_task.get("difficulty", 1),
+                    "is_completed": False,
+                    "was_failed_previously": True # Flag this so UI can show "Retry" badge
+                })
             
-            # 6. Reset Goal Status
-            subgoal.goal.status = GoalStatus.ACTIVE
+            restarted_goal_ids.add(subgoal.goal_id)
+
+        # 5. One bulk DELETE of the failed tasks, one bulk INSERT of the new micro-tasks
+        if stale_task_ids:
+            await db.execute(
+                delete(GoalTask).where(GoalTask.id.in_(stale_task_ids)).execution_options(synchronize_session=False)
+            )
+        if new_task_rows:
+            await db.execute(insert(GoalTask), new_task_rows)
+
+        # 6. Reset Goal Status (by id: no lazy load of subgoal.goal, which fails under async)
+        if restarted_goal_ids:
+            await db.execute(
+                update(Goal).where(Goal.id.in_(restarted_goal_ids)).values(status=GoalStatus.ACTIVE)
+            )
             
         await db.commit()
-        return {"status": "replan_complete", "message": "Plan adapted. Tasks broken down."}
\ No newline at end of file
+        return {"status": "replan_complete", "message": "Plan adapted. Tasks broken down."}
+
+async def run_weekly_reset_job():
+    """
+    Scheduled job: resets every due profile in chunks of WEEKLY_RESET_CHUNK_SIZE, so requests
+    rarely hit the lazy reset in use_token (same rule: GamificationEngine._end_weeks). Safe to run on several workers at once.
+    """
+    total = 0
+    try:
+        with metrics.timer("gamification.weekly_reset_job"):
+            async with async_session_maker() as db:
+                while True:
+                    done = await GamificationEngine.reset_due_chunk(db, settings.WEEKLY_RESET_CHUNK_SIZE)
+                    total += done
+                    if done < settings.WEEKLY_RESET_CHUNK_SIZE:
+                        break
+    except Exception as e:
+        print(f"❌ Weekly reset job failed after {total} profiles: {e}")
+        return
+    if total:
+        print(f"🔁 Weekly reset: {total} profiles reset")
@@ -0,0 +1,87 @@
+"""
+CPU-bound image preparation for VisionService.
+Plain top-level functions so they can run in a ProcessPoolExecutor (picklable, no app state).
+"""
+import io
+from PIL import Image, ImageOps, ImageStat
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+EXIF_ORIENTATION = 0x0112
+
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: near-identical images (re-saved, resized, recompressed) differ in a few bits."""
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def looks_like_text(img: Image.Image) -> bool:
+    """
+    Cheap screenshot/scan detector: text pages are mostly paper + ink (a bimodal, extreme
+    brightness histogram) with little colour. Photos and most diagrams fail one of the two.
+    """
+    gray = img.convert("L").resize((256, 256))
+    hist = gray.histogram()
+    extremes = (sum(hist[:64]) + sum(hist[192:])) / (256 * 256)
+    saturation = ImageStat.Stat(img.convert("RGB").resize((64, 64)).convert("HSV")).mean[1]
+    return extremes >= 0.85 and saturation <= 40
+
+def prepare_image(image_bytes: bytes, max_long_side: int, max_short_side: int, jpeg_quality: int) -> dict:
+    """
+    Downsizes to the model's useful resolution, applies EXIF rotation and re-encodes:
+    PNG for screenshots/diagrams and transparency (crisp text), JPEG for photos.
+    The original bytes are kept when they are already small enough and need no changes.
+    ocr_data: for text-like images that needed rotating, an upright full-resolution PNG for OCR
+    (the vision-sized copy is too small for Tesseract); None means OCR the original bytes.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as source:
+        source_format = source.format
+        rotated = source.getexif().get(EXIF_ORIENTATION, 1) != 1
+        upright = img = ImageOps.exif_transpose(source)
+
+        width, height = img.size
+        scale = min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+        if scale < 1.0:
+            img = img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        out = io.BytesIO()
+        if has_alpha or source_format in ("PNG", "GIF"):
+            if img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+                img = img.convert("RGBA" if has_alpha else "RGB")
+            img.save(out, format="PNG", optimize=True)
+            mime = "image/png"
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=jpeg_quality, optimize=True)
+            mime = "image/jpeg"
+        data = out.getvalue()
+
+        unchanged = scale >= 1.0 and not rotated
+        if unchanged and source_format in MIME_TYPES and len(image_bytes) <= len(data):
+            data, mime = image_bytes, MIME_TYPES[source_format]
+
+        text_like = looks_like_text(img)
+        ocr_data = None
+        if text_like and rotated:
+            ocr_out = io.BytesIO()
+            upright.save(ocr_out, format="PNG")
+            ocr_data = ocr_out.getvalue()
+
+        return {
+            "data": data,
+            "mime": mime,
+            "width": img.size[0],
+            "height": img.size[1],
+            "phash": dhash(img),
+            "text_like": text_like,
+            "ocr_data": ocr_data,
+            "source_bytes": len(image_bytes)
+        }
@@ -0,0 +1,83 @@
+import os
+import shutil
+import asyncio
+from typing import Dict, Tuple
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+
+class OCRService:
+    """
+    Local OCR (Tesseract CLI, run as a subprocess) for text-dominant images:
+    screenshots of text and scanned pages are transcribed in milliseconds, for free.
+    Returns the text plus the mean word confidence, so callers can escalate to the vision model.
+    Disabled when the 'tesseract' binary is not installed.
+    """
+
+    def __init__(self):
+        self.binary = shutil.which("tesseract")
+        self._semaphore = asyncio.Semaphore(settings.OCR_CONCURRENCY) # OCR is CPU-bound
+        if not self.binary:
+            print("⚠️ Tesseract not found: all images go to the vision model.")
+
+    @property
+    def available(self) -> bool:
+        return self.binary is not None
+
+    @staticmethod
+    def _parse_tsv(tsv: str) -> Tuple[str, float]:
+        """Rebuilds lines from Tesseract's word-level TSV; confidence is the length-weighted mean over words."""
+        lines: Dict[Tuple[str, str, str, str], list] = {}
+        weighted, chars = 0.0, 0
+        for row in tsv.splitlines()[1:]:
+            cols = row.split("\t")
+            if len(cols) < 12 or cols[0] != "5": # Level 5 = word
+                continue
+            word, conf = cols[11].strip(), float(cols[10])
+            if not word or conf < 0:
+                continue
+            lines.setdefault((cols[1], cols[2], cols[3], cols[4]), []).append(word)
+            weighted += conf * len(word)
+            chars += len(word)
+        text = "\n".join(" ".join(words) for words in lines.values())
+        return text, (weighted / chars if chars else 0.0)
+
+    async def transcribe(self, image_bytes: bytes) -> Tuple[str, float]:
+        """(text, confidence 0-100). Empty text and 0 confidence if OCR is unavailable or fails."""
+        if not self.available:
+            return "", 0.0
+
+        async with self._semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                self.binary, "stdin", "stdout", "-l", settings.OCR_LANGUAGES, "--psm", "3", "tsv",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                env={**os.environ, "OMP_THREAD_LIMIT": "1"} # One core per image; concurrency comes from the semaphore
+            )
+            try:
+                with metrics.timer("ocr.transcribe"):
+                    stdout, _ = await asyncio.wait_for(proc.communicate(image_bytes), timeout=settings.OCR_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                metrics.incr("ocr.timeouts")
+                return "", 0.0
+
+        if proc.returncode != 0:
+            return "", 0.0
+        return self._parse_tsv(stdout.decode("utf-8", errors="replace"))
+
+    def snapshot(self) -> Dict:
+        local = metrics.counters.get("images.ocr_local", 0)
+        vision = metrics.counters.get("images.vision", 0)
+        total = local + vision
+        return {
+            "ocr_available": self.available,
+            "handled_locally": local,
+            "sent_to_vision": vision,
+            "local_share": round(local / total, 3) if total else None
+        }
+
+# Singleton
+ocr_service = OCRService()
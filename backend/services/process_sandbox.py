@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import asyncio
+import tempfile
+from typing import Optional
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+with open(WORKER_SCRIPT, encoding="utf-8") as f:
+    WORKER_SOURCE = f.read() # For 'python -c' inside session containers
+
+def worker_config(once: bool = True, isolate: bool = True) -> str:
+    """
+    Limits for a single-use worker, or for a stateful session worker (once=False).
+    isolate=False when something else (a container) already isolates the worker.
+    """
+    config = {
+        "cpu_seconds": settings.SANDBOX_CPU_SECONDS,
+        "memory_bytes": settings.SANDBOX_PROCESS_MEMORY_MB * 1024 * 1024,
+        "file_bytes": settings.SANDBOX_PROCESS_FILE_MB * 1024 * 1024,
+        "max_output": settings.SANDBOX_MAX_OUTPUT_CHARS,
+        "preload": settings.SANDBOX_PROCESS_PRELOAD,
+        "once": once,
+        "isolate": isolate
+    }
+    if not once:
+        config["memory_bytes"] = settings.SANDBOX_SESSION_MEMORY_MB * 1024 * 1024
+        config["session_cpu_seconds"] = settings.SANDBOX_SESSION_CPU_SECONDS
+    return json.dumps(config)
+
+def format_output(result: dict) -> str:
+    output = result["output"]
+    if result.get("truncated"):
+        output += f"\n... [output truncated at {settings.SANDBOX_MAX_OUTPUT_CHARS} characters]"
+    return output
+
+class SandboxWorker:
+    """One preforked interpreter (heavy modules already imported, limits already applied)."""
+
+    def __init__(self, proc: asyncio.subprocess.Process, workdir: str):
+        self.proc = proc
+        self.workdir = workdir
+
+    async def send(self, payload: dict):
+        self.proc.stdin.write((json.dumps(payload) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+
+    async def receive(self) -> Optional[dict]:
+        line = await self.proc.stdout.readline()
+        return json.loads(line) if line else None
+
+    async def kill(self):
+        # start_new_session: the worker leads its own process group, so nothing it started survives
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        await self.proc.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+class ProcessSandbox:
+    """
+    Docker-free sandbox backend: each snippet runs in a forked interpreter with
+    - rlimits: CPU seconds, address space, file size, open files, no core dumps, no new processes;
+    - no network: a new network namespace (only loopback);
+    - no host files: a mount namespace + chroot into a tmpfs with read-only system libraries and
+      the Python installation, running as an unprivileged uid (see sandbox_worker.isolate);
+    - a wall-clock timeout (the process is killed) and truncated output;
+    - a private temp working directory and a minimal environment.
+    Workers that could not be isolated are refused (SANDBOX_PROCESS_REQUIRE_*_ISOLATION).
+    A prefork pool keeps SANDBOX_PROCESS_POOL_SIZE interpreters ready with
+    SANDBOX_PROCESS_PRELOAD (numpy/pandas) already imported, so a run skips interpreter start + imports.
+    Pool workers are single-use: state never leaks between snippets.
+    Stateful session workers (spawn(once=False), see sandbox_sessions) keep their globals instead.
+    """
+
+    def __init__(self):
+        self.ready: Optional[asyncio.Queue] = None # Created lazily inside the running loop
+        self.spawning = 0
+        self.command = [sys.executable, "-I", "-u", WORKER_SCRIPT]
+
+    async def spawn(self, once: bool = True) -> SandboxWorker:
+        """Starts a worker; refused unless it reports the isolation the settings require."""
+        workdir = tempfile.mkdtemp(prefix="lifeos-sandbox-")
+        env = {
+            "PATH": "/usr/bin:/bin",
+            "HOME": workdir,
+            "TMPDIR": workdir,
+            "OPENBLAS_NUM_THREADS": "1", # Threads would eat into RLIMIT_AS and the CPU budget
+            "OMP_NUM_THREADS": "1",
+            "MKL_NUM_THREADS": "1"
+        }
+        proc = await asyncio.create_subprocess_exec(
+            *self.command, worker_config(once),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd=workdir,
+            env=env,
+            limit=settings.SANDBOX_MAX_OUTPUT_CHARS * 8 + 4096, # JSON-escaped output fits in one line
+            start_new_session=True
+        )
+        worker = SandboxWorker(proc, workdir)
+        try:
+            hello = await asyncio.wait_for(worker.receive(), timeout=settings.SANDBOX_PROCESS_START_TIMEOUT_SECONDS)
+        except Exception:
+            hello = None
+
+        if not hello or not hello.get("ready"):
+            await worker.kill()
+            raise RuntimeError("Process sandbox unavailable: worker did not start")
+        if settings.SANDBOX_PROCESS_REQUIRE_NET_ISOLATION and not hello.get("isolated"):
+            await worker.kill()
+            raise RuntimeError("Process sandbox unavailable: network isolation failed (namespaces disabled?)")
+        if settings.SANDBOX_PROCESS_REQUIRE_FS_ISOLATION and not hello.get("fs_isolated"):
+            await worker.kill()
+            raise RuntimeError("Process sandbox unavailable: filesystem isolation failed (namespaces disabled?)")
+        return worker
+
+    def _ensure_started(self):
+        if self.ready is None:
+            self.ready = asyncio.Queue()
+            asyncio.create_task(self._replenish())
+
+    async def _replenish(self):
+        while self.ready.qsize() + self.spawning < settings.SANDBOX_PROCESS_POOL_SIZE:
+            self.spawning += 1
+            try:
+                self.ready.put_nowait(await self.spawn())
+            except Exception as e:
+                print(f"❌ Process sandbox: could not prefork worker: {e}")
+                return
+            finally:
+                self.spawning -= 1
+
+    async def run(self, worker: SandboxWorker, code: str) -> str:
+        """Sends one snippet to a worker and waits for the result (killing it on timeout)."""
+        try:
+            await worker.send({"code": code})
+            result = await asyncio.wait_for(worker.receive(), timeout=settings.SANDBOX_WALL_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            metrics.incr("sandbox.timeouts")
+            await worker.kill()
+            return f"Sandbox Error: execution exceeded the {settings.SANDBOX_WALL_TIMEOUT_SECONDS}s time limit."
+        except (BrokenPipeError, ConnectionResetError):
+            # The interpreter was gone before the code reached it (killed, evicted or crashed)
+            await worker.kill()
+            return "Sandbox Error: the interpreter had exited; the sandbox session was reset."
+
+        if result is None:
+            # Worker died: CPU limit (SIGXCPU/SIGKILL), memory limit or a crash
+            await worker.proc.wait()
+            if worker.proc.returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+                metrics.incr("sandbox.cpu_limit_kills")
+                return f"Sandbox Error: execution exceeded the {settings.SANDBOX_CPU_SECONDS}s CPU limit."
+            return f"Sandbox Error: interpreter exited unexpectedly (code {worker.proc.returncode})."
+
+        return format_output(result)
+
+    async def execute(self, code: str) -> str:
+        self._ensure_started()
+        start = time.perf_counter()
+
+        warm = not self.ready.empty()
+        try:
+            worker = self.ready.get_nowait() if warm else await self.spawn()
+        except Exception as e:
+            return f"Sandbox Error: {e}"
+        asyncio.create_task(self._replenish())
+
+        try:
+            return await self.run(worker, code)
+        finally:
+            await worker.kill() # Single-use
+            metrics.observe(f"sandbox.process_run_{'warm' if warm else 'cold'}", (time.perf_counter() - start) * 1000)
+
+    async def shutdown(self):
+        while self.ready and not self.ready.empty():
+            await self.ready.get_nowait().kill()
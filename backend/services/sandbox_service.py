@@ -1,91 +1,323 @@
 import docker
-import tarfile
-import io
+import time
 import asyncio
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+from backend.services.process_sandbox import ProcessSandbox
+from backend.services.sandbox_sessions import SandboxSessions, ProcessSession, DockerSession
+
+SANDBOX_IMAGE = "python:3.9-slim"
+
+# Blocking Docker calls get their own bounded threads, so a slow or stuck sandbox
+# can never starve the default executor used by asyncio.to_thread (RAG, ingestion).
+sandbox_executor = ThreadPoolExecutor(max_workers=settings.SANDBOX_EXECUTOR_THREADS, thread_name_prefix="sandbox")
+
+# Prepended to every run: CPU-time limit (SIGXCPU, then SIGKILL) that user code cannot raise
+CPU_LIMIT_PREAMBLE = (
+    "import resource\n"
+    "resource.setrlimit(resource.RLIMIT_CPU, ({cpu}, {cpu} + 1))\n"
+    "del resource\n"
+)
+
+class SandboxBusyError(Exception):
+    """Raised when the execution queue is full."""
+
+class ContainerPool:
+    """
+    Pre-warmed, locked-down containers for code execution.
+    - Containers idle on 'sleep infinity'; code runs via exec, so a warm run skips container startup.
+    - After each run a container goes back to the pool only if it is still clean:
+      running, no leftover processes, no filesystem changes, and fewer than SANDBOX_MAX_RUNS_PER_CONTAINER runs.
+      Otherwise it is destroyed and replaced in the background.
+    - SANDBOX_POOL_MIN idle containers are kept warm; at most SANDBOX_POOL_MAX exist at once.
+    - At most SANDBOX_MAX_QUEUED executions may wait for a container; more are rejected.
+    """
+
+    def __init__(self, client: docker.DockerClient):
+        self.client = client
+        self.idle: asyncio.Queue = None # Created lazily inside the running loop
+        self.total = 0
+        self.waiting = 0
+        self.runs: Dict[str, int] = {}
+        self._started = False
+        self._health_task: Optional[asyncio.Task] = None
+
+    # --- Blocking Docker calls (run in sandbox_executor) ---
+
+    def _create(self, mem_limit: Optional[str] = None, role: str = "pool"):
+        return self.client.containers.run(
+            SANDBOX_IMAGE,
+            command="sleep infinity",
+            detach=True,
+            network_disabled=True, # Network disabled for security (prevent downloading malware)
+            mem_limit=mem_limit or settings.SANDBOX_MEM_LIMIT,
+            pids_limit=64,         # No fork bombs
+            cap_drop=["ALL"],
+            security_opt=["no-new-privileges"],
+            user="nobody",
+            working_dir="/tmp",
+            labels={"lifeos.sandbox": role}
+        )
+
+    def _is_clean(self, container) -> bool:
+        """Health + reset check: only the idle 'sleep' process left and an unchanged filesystem."""
+        try:
+            container.reload()
+            if container.status != "running":
+                return False
+            processes = container.top().get("Processes") or []
+            if len(processes) > 1:
+                return False
+            return not container.diff()
+        except Exception:
+            return False
+
+    def _destroy(self, container):
+        try:
+            container.remove(force=True)
+        except Exception:
+            pass
+
+    # --- Pool management ---
+
+    async def _run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(sandbox_executor, fn, *args)
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        self._started = True
+        self.idle = asyncio.Queue()
+        asyncio.create_task(self._replenish())
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _spawn(self, mem_limit: Optional[str] = None, role: str = "pool"):
+        self.total += 1
+        try:
+            container = await self._run_blocking(self._create, mem_limit, role)
+        except Exception as e:
+            self.total -= 1
+            raise e
+        self.runs[container.id] = 0
+        return container
+
+    async def _replenish(self):
+        """Tops the idle pool up to SANDBOX_POOL_MIN (or the number of queued executions, if higher)."""
+        while self.idle.qsize() < max(settings.SANDBOX_POOL_MIN, self.waiting) and self.total < settings.SANDBOX_POOL_MAX:
+            try:
+                self.idle.put_nowait(await self._spawn())
+            except Exception as e:
+                print(f"❌ Sandbox pool: could not start container: {e}")
+                return
+
+    async def _retire(self, container):
+        self.runs.pop(container.id, None)
+        self.total -= 1
+        await self._run_blocking(self._destroy, container)
+        metrics.incr("sandbox.containers_recycled")
+
+    async def _health_loop(self):
+        """Periodically replaces idle containers that died or were tampered with."""
+        while True:
+            await asyncio.sleep(settings.SANDBOX_HEALTH_CHECK_SECONDS)
+            for _ in range(self.idle.qsize()):
+                container = self.idle.get_nowait()
+                if await self._run_blocking(self._is_clean, container):
+                    self.idle.put_nowait(container)
+                else:
+                    await self._retire(container)
+            await self._replenish()
+
+    async def acquire(self) -> Tuple[object, bool]:
+        """Returns (container, warm)."""
+        self._ensure_started()
+
+        if not self.idle.empty():
+            return self.idle.get_nowait(), True
+        if self.total < settings.SANDBOX_POOL_MAX:
+            return await self._spawn(), False # Cold start
+
+        if self.waiting >= settings.SANDBOX_MAX_QUEUED:
+            metrics.incr("sandbox.rejected")
+            raise SandboxBusyError("Sandbox is busy. Try again shortly.")
+        self.waiting += 1
+        try:
+            return await self.idle.get(), True
+        finally:
+            self.waiting -= 1
+
+    async def release(self, container):
+        self.runs[container.id] = self.runs.get(container.id, 0) + 1
+        reusable = (
+            self.runs[container.id] < settings.SANDBOX_MAX_RUNS_PER_CONTAINER
+            and await self._run_blocking(self._is_clean, container)
+        )
+        if reusable:
+            self.idle.put_nowait(container)
+        else:
+            await self._retire(container)
+            asyncio.create_task(self._replenish())
+
+    async def spawn_dedicated(self, mem_limit: str):
+        """A container outside the idle pool (stateful session); still counts against SANDBOX_POOL_MAX."""
+        self._ensure_started()
+        if self.total >= settings.SANDBOX_POOL_MAX:
+            metrics.incr("sandbox.rejected")
+            raise SandboxBusyError("Sandbox is busy. Try again shortly.")
+        return await self._spawn(mem_limit, role="session")
+
+    async def retire_dedicated(self, container):
+        await self._retire(container)
+        asyncio.create_task(self._replenish())
+
+    async def shutdown(self):
+        """Removes idle containers (called on app shutdown)."""
+        if self._health_task:
+            self._health_task.cancel()
+        while self.idle and not self.idle.empty():
+            await self._retire(self.idle.get_nowait())
 
 class SandboxService:
+    """
+    Runs agent code in one of two backends, selected per deployment (settings.SANDBOX_BACKEND):
+    - docker: pooled, locked-down containers (ContainerPool);
+    - process: preforked, rlimited interpreters without Docker (ProcessSandbox).
+    'auto' uses Docker when a daemon is reachable; it falls back to the process backend only
+    with SANDBOX_ALLOW_PROCESS_FALLBACK, otherwise the sandbox is disabled.
+    Calls with a session_id run in that session's persistent interpreter (SandboxSessions).
+    """
+
     def __init__(self):
-        try:
-            self.client = docker.from_env()
-            # Ensure the image exists (Pulling python:3.9-slim)
-            # In production, build a custom image with pandas/numpy pre-installed.
-            print("🐳 Initializing Sandbox: Checking for python:3.9-slim image...")
+        self.client = None
+        self.pool = None
+        self.process = None
+        backend = settings.SANDBOX_BACKEND
+
+        if backend in ("docker", "auto"):
             try:
-                self.client.images.get("python:3.9-slim")
-            except docker.errors.ImageNotFound:
-                print("   ↳ Pulling image (this may take a minute)...")
-                self.client.images.pull("python:3.9-slim")
-        except Exception as e:
-            print(f"❌ Docker not available. Sandbox disabled. Error: {e}")
-            self.client = None
+                self.client = docker.from_env()
+                # Ensure the image exists (Pulling python:3.9-slim)
+                # In production, build a custom image with pandas/numpy pre-installed.
+                print("🐳 Initializing Sandbox: Checking for python:3.9-slim image...")
+                try:
+                    self.client.images.get(SANDBOX_IMAGE)
+                except docker.errors.ImageNotFound:
+                    print("   ↳ Pulling image (this may take a minute)...")
+                    self.client.images.pull(SANDBOX_IMAGE)
+                self.pool = ContainerPool(self.client)
+            except Exception as e:
+                print(f"❌ Docker not available. Error: {e}")
+                self.client = None
+
+        fallback = backend == "auto" and not self.client and settings.SANDBOX_ALLOW_PROCESS_FALLBACK
+        if backend == "process" or fallback:
+            print("🧪 Initializing Sandbox: process backend (rlimits + network/mount namespaces + chroot)")
+            self.process = ProcessSandbox()
+        elif not self.client:
+            print("❌ Sandbox disabled (set SANDBOX_BACKEND=process or SANDBOX_ALLOW_PROCESS_FALLBACK to run without Docker).")
+
+        self.sessions = SandboxSessions(self._start_session)
+
+    async def _start_session(self):
+        if self.process:
+            return await ProcessSession.start(self.process)
+        return await DockerSession.start(self.pool)
 
-    async def execute_python(self, code: str) -> str:
-        """Runs Python code in an isolated container."""
-        if not self.client:
+    async def execute_python(self, code: str, session_id: Optional[str] = None) -> str:
+        """Runs Python code in the configured isolated backend (in a persistent session if session_id is given)."""
+        if not self.process and not self.client:
             return "Error: Sandbox environment is not available."
+        if session_id:
+            return await self.sessions.run(session_id, code)
+        if self.process:
+            return await self.process.execute(code)
+
+        if len(code) > settings.SANDBOX_MAX_CODE_CHARS:
+            return f"Sandbox Error: code is longer than {settings.SANDBOX_MAX_CODE_CHARS} characters."
 
-        # Wrap code to print last expression if not printed (REPL-like behavior)
         # Simple wrapper to catch errors
-        wrapped_code = f"""
-                        try:
-                        {self._indent_code(code)}
-                        except Exception as e:
-                            print(f"Runtime Error: {{e}}")
-                        """
-        
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._run_in_container, wrapped_code)
+        wrapped_code = CPU_LIMIT_PREAMBLE.format(cpu=settings.SANDBOX_CPU_SECONDS)
+        wrapped_code += f"try:\n{self._indent_code(code)}\nexcept Exception as e:\n    print(f\"Runtime Error: {{e}}\")\n"
+
+        start = time.perf_counter()
+        try:
+            container, warm = await self.pool.acquire()
+        except SandboxBusyError as e:
+            return f"Sandbox Error: {e}"
+        except Exception as e:
+            return f"Sandbox Error: could not start container: {e}"
+
+        try:
+            # Backstop only: the wall-clock limit is enforced inside the container.
+            # A run still going after this is killed when release() finds the container unclean.
+            return await asyncio.wait_for(
+                self.pool._run_blocking(self._run_in_container, container, wrapped_code),
+                timeout=settings.SANDBOX_WALL_TIMEOUT_SECONDS + 10
+            )
+        except asyncio.TimeoutError:
+            metrics.incr("sandbox.timeouts")
+            return f"Sandbox Error: execution exceeded the {settings.SANDBOX_WALL_TIMEOUT_SECONDS}s time limit."
+        finally:
+            await self.pool.release(container)
+            # Cold = container started for this run, warm = taken from the pool
+            metrics.observe(f"sandbox.run_{'warm' if warm else 'cold'}", (time.perf_counter() - start) * 1000)
+
+    async def shutdown(self):
+        await self.sessions.close_all()
+        if self.pool:
+            await self.pool.shutdown()
+        if self.process:
+            await self.process.shutdown()
+        sandbox_executor.shutdown(wait=False, cancel_futures=True)
 
     def _indent_code(self, code: str) -> str:
         """Indents code block for the wrapper function."""
         return "\n".join(["    " + line for line in code.split("\n")])
 
-    def _run_in_container(self, code: str) -> str:
-        container = None
+    def _run_in_container(self, container, code: str) -> str:
+        """
+        Streams the combined stdout/stderr of one run, keeping at most SANDBOX_MAX_OUTPUT_CHARS bytes.
+        Wall time is enforced inside the container ('timeout -s KILL'), CPU time by RLIMIT_CPU (CPU_LIMIT_PREAMBLE).
+        """
+        api = self.client.api
+        limit = settings.SANDBOX_MAX_OUTPUT_CHARS
+        start = time.monotonic()
         try:
-            # 1. Create Container
-            container = self.client.containers.run(
-                "python:3.9-slim",
-                command="python -c 'import sys; exec(sys.stdin.read())'",
-                detach=True,
-                stdin_open=True,
-                network_disabled=True, # Network disabled for security (prevent downloading malware)
-                mem_limit="128m" # Memory limit 128MB
-            )
+            # Code is passed as an argument: nothing is written to the container filesystem,
+            # so any diff after the run comes from the user code and triggers a recycle.
+            exec_id = api.exec_create(
+                container.id,
+                ["timeout", "-s", "KILL", str(settings.SANDBOX_WALL_TIMEOUT_SECONDS), "python", "-c", code],
+                user="nobody",
+                workdir="/tmp"
+            )["Id"]
 
-            # 2. Inject Code via Stdin
-            # Interact with the socket directly or use the simple .exec_run API
-            # For simplicity with 'python -c', passing via exec_run is cleaner, but stdin is more robust for multi-line.
-            # Simpler approach: Write file then run.
-            
-            # Prepare file stream
-            encoded_code = code.encode('utf-8')
-            tar_stream = io.BytesIO()
-            with tarfile.open(fileobj=tar_stream, mode='w') as tar:
-                tar_info = tarfile.TarInfo(name='script.py')
-                tar_info.size = len(encoded_code)
-                tar.addfile(tar_info, io.BytesIO(encoded_code))
-            tar_stream.seek(0)
-
-            # Copy file to container
-            container.put_archive("/", tar_stream)
-
-            # 3. Execute
-            exit_code, output = container.exec_run("python /script.py")
-            
-            return output.decode('utf-8').strip()
+            output, truncated = bytearray(), False
+            for chunk in api.exec_start(exec_id, stream=True):
+                room = limit - len(output)
+                if room > 0:
+                    output += chunk[:room]
+                if len(chunk) > room:
+                    truncated = True # Keep draining: a blocked pipe would stall the run until the wall limit
+            exit_code = api.exec_inspect(exec_id).get("ExitCode")
 
         except Exception as e:
             return f"Sandbox Error: {str(e)}"
-        
-        finally:
-            # 4. Cleanup
-            if container:
-                try:
-                    container.remove(force=True)
-                except:
-                    pass
+
+        text = output.decode("utf-8", errors="replace").strip()
+        if truncated:
+            metrics.incr("sandbox.output_truncated")
+            text += f"\n... [output truncated at {limit} bytes]"
+        if exit_code == 137 and time.monotonic() - start >= settings.SANDBOX_WALL_TIMEOUT_SECONDS:
+            metrics.incr("sandbox.timeouts")
+            text += f"\nSandbox Error: execution exceeded the {settings.SANDBOX_WALL_TIMEOUT_SECONDS}s time limit."
+        elif exit_code in (137, 152): # SIGKILL / SIGXCPU from RLIMIT_CPU
+            metrics.incr("sandbox.cpu_limit_kills")
+            text += f"\nSandbox Error: execution exceeded the {settings.SANDBOX_CPU_SECONDS}s CPU limit."
+        return text.strip()
 
 # Singleton
-sandbox = SandboxService()
\ No newline at end of file
+sandbox = SandboxService()
@@ -0,0 +1,231 @@
+import json
+import time
+import socket
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from docker.utils.socket import next_frame_header, read_exactly, STDOUT
+
+from backend.core.config import settings
+from backend.core.metrics import metrics
+from backend.services.process_sandbox import ProcessSandbox, WORKER_SOURCE, worker_config, format_output
+
+SESSION_RESET_NOTE = "\n[Sandbox session was reset: variables from earlier runs are gone.]"
+
+class ProcessSession:
+    """A long-lived process-backend interpreter ("once": false) whose globals survive between runs."""
+
+    def __init__(self, sandbox: ProcessSandbox, worker):
+        self.sandbox = sandbox
+        self.worker = worker
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def start(cls, sandbox: ProcessSandbox) -> "ProcessSession":
+        return cls(sandbox, await sandbox.spawn(once=False))
+
+    @property
+    def alive(self) -> bool:
+        return self.worker.proc.returncode is None
+
+    async def run(self, code: str) -> str:
+        return await self.sandbox.run(self.worker, code)
+
+    async def close(self):
+        await self.worker.kill()
+
+class DockerSession:
+    """
+    The same worker, running inside a dedicated container (counted against SANDBOX_POOL_MAX).
+    Talks the JSON-lines protocol over the exec's attached stdin/stdout socket.
+    """
+
+    def __init__(self, pool, container, sock):
+        self.pool = pool
+        self.container = container
+        self.sock = sock
+        self.buffer = b""
+        self.closed = False
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def start(cls, pool) -> "DockerSession":
+        container = await pool.spawn_dedicated(f"{settings.SANDBOX_SESSION_MEMORY_MB}m")
+        try:
+            sock = await pool._run_blocking(cls._attach, pool.client, container)
+            session = cls(pool, container, sock)
+            hello = await pool._run_blocking(session._read_message, settings.SANDBOX_PROCESS_START_TIMEOUT_SECONDS)
+        except Exception:
+            await pool.retire_dedicated(container)
+            raise
+        if not hello or not hello.get("ready"):
+            await session.close()
+            raise RuntimeError("session interpreter did not start")
+        return session
+
+    # --- Blocking socket I/O (run in the executor) ---
+
+    @staticmethod
+    def _attach(client, container):
+        exec_id = client.api.exec_create(
+            container.id,
+            ["python", "-I", "-u", "-c", WORKER_SOURCE, worker_config(once=False, isolate=False)],
+            stdin=True,
+            user="nobody",
+            workdir="/tmp"
+        )
+        return client.api.exec_start(exec_id, socket=True)
+
+    def _read_message(self, timeout: float) -> Optional[dict]:
+        """Next protocol line from the multiplexed exec stream; None if the interpreter exited."""
+        getattr(self.sock, "_sock", self.sock).settimeout(timeout)
+        while b"\n" not in self.buffer:
+            stream, size = next_frame_header(self.sock)
+            if size < 0:
+                return None
+            data = read_exactly(self.sock, size)
+            if stream == STDOUT:
+                self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return json.loads(line)
+
+    def _exchange(self, code: str) -> Optional[dict]:
+        getattr(self.sock, "_sock", self.sock).sendall((json.dumps({"code": code}) + "\n").encode("utf-8"))
+        return self._read_message(settings.SANDBOX_WALL_TIMEOUT_SECONDS)
+
+    @property
+    def alive(self) -> bool:
+        return not self.closed
+
+    async def run(self, code: str) -> str:
+        try:
+            result = await self.pool._run_blocking(self._exchange, code)
+        except socket.timeout:
+            metrics.incr("sandbox.timeouts")
+            await self.close()
+            return f"Sandbox Error: execution exceeded the {settings.SANDBOX_WALL_TIMEOUT_SECONDS}s time limit."
+        except Exception as e:
+            await self.close()
+            return f"Sandbox Error: {e}"
+
+        if result is None:
+            await self.close()
+            return "Sandbox Error: interpreter exited unexpectedly (CPU or memory limit)."
+        return format_output(result)
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+        await self.pool.retire_dedicated(self.container)
+
+class SandboxSessions:
+    """
+    Stateful interpreters keyed by session id (one per user conversation).
+    - Variables, imports and loaded data persist between runs of the same session.
+    - One run at a time per session; runs of different sessions are independent.
+    - At most SANDBOX_MAX_SESSIONS live at once: the least recently used idle session is evicted
+      to make room, and a new session is refused if every slot is busy.
+    - Sessions idle for SANDBOX_SESSION_IDLE_SECONDS are closed in the background.
+    - A session whose interpreter died (time, CPU or memory limit) is dropped and restarted on the next run;
+      a run whose session was evicted or died before it got the lock starts a new one.
+    """
+
+    def __init__(self, start_session: Callable[[], Awaitable]):
+        self.start_session = start_session
+        self.sessions: "OrderedDict[str, object]" = OrderedDict()
+        self._creating: Dict[str, asyncio.Lock] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._evict_idle_loop())
+
+    async def _drop(self, session_id: str, session):
+        if self.sessions.get(session_id) is session:
+            del self.sessions[session_id]
+        await session.close()
+
+    async def _make_room(self) -> bool:
+        while len(self.sessions) >= settings.SANDBOX_MAX_SESSIONS:
+            victim = next((sid for sid, s in self.sessions.items() if not s.lock.locked()), None)
+            if victim is None:
+                return False
+            await self._drop(victim, self.sessions[victim])
+            metrics.incr("sandbox.sessions_evicted")
+        return True
+
+    async def _get_or_start(self, session_id: str):
+        session = self.sessions.get(session_id)
+        if session and session.alive:
+            self.sessions.move_to_end(session_id)
+            metrics.incr("sandbox.session_reuses")
+            return session
+
+        lock = self._creating.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            session = self.sessions.get(session_id)
+            if session and session.alive:
+                return session
+            if session:
+                await self._drop(session_id, session)
+            if not await self._make_room():
+                return None
+            session = await self.start_session()
+            self.sessions[session_id] = session
+            metrics.incr("sandbox.sessions_created")
+        self._creating.pop(session_id, None)
+        return session
+
+    async def run(self, session_id: str, code: str) -> str:
+        self._ensure_started()
+        known = self.sessions.get(session_id)
+        lost = known is not None and not known.alive # Died since its last run: restarted below
+        for _ in range(2):
+            try:
+                session = await self._get_or_start(session_id)
+            except Exception as e:
+                return f"Sandbox Error: could not start session: {e}"
+            if session is None:
+                metrics.incr("sandbox.rejected")
+                return "Sandbox Error: all sandbox sessions are busy. Try again shortly."
+
+            async with session.lock:
+                # Evicted (_make_room, idle reaper) or died while we waited for the lock: start a new one
+                if not session.alive or self.sessions.get(session_id) is not session:
+                    lost = True
+                    continue
+                start = time.perf_counter()
+                output = await session.run(code)
+                session.last_used = time.monotonic()
+                metrics.observe("sandbox.session_run", (time.perf_counter() - start) * 1000)
+            break
+        else:
+            return "Sandbox Error: the sandbox session was closed before the code could run. Try again."
+
+        if not session.alive:
+            await self._drop(session_id, session)
+            lost = True
+        return output + SESSION_RESET_NOTE if lost else output
+
+    async def _evict_idle_loop(self):
+        while True:
+            await asyncio.sleep(min(60, settings.SANDBOX_SESSION_IDLE_SECONDS))
+            cutoff = time.monotonic() - settings.SANDBOX_SESSION_IDLE_SECONDS
+            for session_id, session in list(self.sessions.items()):
+                if session.last_used < cutoff and not session.lock.locked():
+                    await self._drop(session_id, session)
+                    metrics.incr("sandbox.sessions_evicted")
+
+    async def close_all(self):
+        if self._reaper:
+            self._reaper.cancel()
+        for session_id, session in list(self.sessions.items()):
+            await self._drop(session_id, session)
@@ -0,0 +1,236 @@
+"""
+Sandbox worker: the interpreter that actually runs agent code.
+Not imported by the app: ProcessSandbox starts it as a script (python -I -u sandbox_worker.py '<config json>').
+
+Startup: isolate (network, filesystem, uid) -> preload heavy modules -> apply rlimits -> announce readiness.
+Stateful sessions also run it inside a Docker container (python -c '<source>' '<config json>'),
+where the container is the isolation ("isolate": false).
+Protocol (one JSON object per line on the worker's original stdin/stdout):
+  worker -> {"ready": true, "isolated": bool, "fs_isolated": bool}
+  parent -> {"code": "..."}
+  worker -> {"output": "...", "truncated": bool}
+User code never sees the protocol pipes: fds 0/1/2 are pointed at /dev/null and
+print() goes to a capped in-memory buffer.
+"""
+import io
+import os
+import sys
+import json
+import ctypes
+import socket
+import resource
+import contextlib
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+
+MS_RDONLY = 1
+MS_NOSUID = 2
+MS_NODEV = 4
+MS_REMOUNT = 32
+MS_BIND = 4096
+MS_REC = 16384
+MS_PRIVATE = 1 << 18
+# Per-mount flags (statvfs f_flag uses the same bits) a remount inside a user namespace must keep
+LOCKED_FLAGS = MS_NOSUID | MS_NODEV | 8 | 1024 | 2048 | 4096 # + noexec, noatime, nodiratime, relatime
+
+NOBODY = 65534
+SYSTEM_DIRS = ("/usr", "/lib", "/lib64", "/bin") # Shared libraries; never /etc, /home, /root or the app
+DEVICES = ("/dev/null", "/dev/zero", "/dev/urandom")
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+def _check(result: int, what: str):
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{what}: {os.strerror(errno)}")
+
+def unshare(flags: int):
+    _check(libc.unshare(flags), "unshare")
+
+def mount(source, target: str, fstype, flags: int, data=None):
+    encode = lambda value: value.encode() if value is not None else None
+    _check(libc.mount(encode(source), encode(target), encode(fstype), ctypes.c_ulong(flags), encode(data)), f"mount {target}")
+
+def drop_privileges():
+    """Running as root: become nobody, so RLIMIT_NPROC applies and no host file is ours."""
+    os.setgroups([])
+    os.setgid(NOBODY)
+    os.setuid(NOBODY)
+
+def map_ids(uid: int, gid: int):
+    """In a fresh user namespace: map our own uid/gid to root there (nothing else is mapped)."""
+    for name, content in (("setgroups", "deny"), ("uid_map", f"0 {uid} 1"), ("gid_map", f"0 {gid} 1")):
+        with open(f"/proc/self/{name}", "w") as f:
+            f.write(content)
+
+def python_dirs() -> list:
+    """The interpreter's import path (stdlib, lib-dynload, site-packages): everything user code may import."""
+    dirs = []
+    for path in sys.path:
+        path = os.path.realpath(path) if path else ""
+        if os.path.isdir(path) and path not in dirs:
+            dirs.append(path)
+    return dirs
+
+def bind_read_only(path: str, jail: str):
+    target = jail + path
+    if os.path.islink(path):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.symlink(os.readlink(path), target)
+        return
+    if os.path.isdir(path):
+        os.makedirs(target, exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        open(target, "w").close()
+    mount(path, target, None, MS_BIND | MS_REC)
+    if path not in DEVICES:
+        kept = os.statvfs(path).f_flag & LOCKED_FLAGS
+        mount(None, target, None, MS_BIND | MS_REMOUNT | MS_RDONLY | MS_NOSUID | kept)
+
+def enter_jail(jail: str, size_bytes: int):
+    """
+    chroot into a fresh tmpfs holding read-only binds of the system libraries and the Python
+    installation, a few devices and a writable /tmp: the host filesystem (app code, .env,
+    other users' files) is simply not there.
+    """
+    mount(None, "/", None, MS_REC | MS_PRIVATE) # Nothing we mount propagates back to the host
+    mount("tmpfs", jail, "tmpfs", MS_NOSUID | MS_NODEV, f"size={size_bytes},mode=755")
+    for path in (*SYSTEM_DIRS, *python_dirs(), *DEVICES):
+        if os.path.lexists(path) and not os.path.lexists(jail + path):
+            bind_read_only(path, jail)
+    os.makedirs(jail + "/tmp")
+    os.chmod(jail + "/tmp", 0o1777)
+    os.chroot(jail)
+    os.chdir("/tmp")
+    os.environ["HOME"] = os.environ["TMPDIR"] = "/tmp"
+
+def isolate(config: dict) -> dict:
+    """
+    New network + mount namespace, chroot jail and an unprivileged uid.
+    - As root: the namespaces are created directly, then the worker drops to nobody.
+    - Otherwise (or if root may not unshare, e.g. inside a container): a user namespace maps
+      the app's uid to root inside it, which is enough to mount and chroot.
+    Returns which parts succeeded; the parent refuses workers that are not isolated.
+    """
+    workdir = os.getcwd()
+    isolated_fs = False
+    try:
+        as_root = os.getuid() == 0
+        if as_root:
+            try:
+                unshare(CLONE_NEWNS | CLONE_NEWNET)
+            except OSError:
+                drop_privileges()
+                as_root = False
+        if not as_root:
+            uid, gid = os.getuid(), os.getgid()
+            unshare(CLONE_NEWUSER | CLONE_NEWNS | CLONE_NEWNET)
+            map_ids(uid, gid)
+        enter_jail(workdir, config["file_bytes"] * 4)
+        if as_root:
+            drop_privileges()
+        isolated_fs = True
+    except OSError:
+        if os.getuid() == 0:
+            drop_privileges()
+
+    try:
+        interfaces = {name for _, name in socket.if_nameindex()}
+    except OSError:
+        interfaces = set()
+    return {"isolated": interfaces <= {"lo"}, "fs_isolated": isolated_fs}
+
+def preload(modules):
+    for name in modules:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+def apply_limits(config: dict):
+    cpu = config["cpu_seconds"]
+    # Hard CPU limit: one run, or the whole session's budget for stateful workers
+    hard_cpu = config.get("session_cpu_seconds") or cpu + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (min(cpu, hard_cpu), hard_cpu)) # SIGXCPU, then SIGKILL
+    resource.setrlimit(resource.RLIMIT_AS, (config["memory_bytes"], config["memory_bytes"]))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (config["file_bytes"], config["file_bytes"]))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    # Counted per uid, not per worker: 0 means no new processes or threads at all (no fork bombs,
+    # no children that outlive the worker). Not enforced for root, hence drop_privileges().
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+class CappedWriter(io.TextIOBase):
+    """Keeps at most 'limit' characters of output; the rest is counted and dropped."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        room = self.limit - self.size
+        if room > 0:
+            self.parts.append(s[:room])
+            self.size += min(len(s), room)
+        if len(s) > room:
+            self.truncated = True
+        return len(s)
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+def reset_cpu_limit(config: dict):
+    """RLIMIT_CPU counts the process lifetime: give each run of a session its own allowance."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + config["cpu_seconds"]
+    resource.setrlimit(resource.RLIMIT_CPU, (min(soft, hard), hard))
+
+def run_code(code: str, namespace: dict, max_output: int) -> dict:
+    out = CappedWriter(max_output)
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            exec(compile(code, "<sandbox>", "exec"), namespace)
+        except BaseException as e: # Includes SystemExit / KeyboardInterrupt raised by user code
+            print(f"Runtime Error: {type(e).__name__}: {e}")
+    return {"output": out.getvalue().strip(), "truncated": out.truncated}
+
+def main():
+    config = json.loads(sys.argv[1])
+
+    # Private protocol channel; user code gets /dev/null on the standard fds
+    proto_in = os.fdopen(os.dup(0), "r")
+    proto_out = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+    isolation = isolate(config) if config.get("isolate", True) else {"isolated": False, "fs_isolated": False}
+    preload(config.get("preload", []))
+    apply_limits(config)
+
+    proto_out.write(json.dumps({"ready": True, **isolation}) + "\n")
+    proto_out.flush()
+
+    # Stateful sessions ("once": false) keep this namespace between runs
+    namespace = {"__name__": "__main__"}
+    for line in proto_in:
+        job = json.loads(line)
+        if not config.get("once", True):
+            reset_cpu_limit(config)
+        result = run_code(job["code"], namespace, config["max_output"])
+        proto_out.write(json.dumps(result) + "\n")
+        proto_out.flush()
+        if config.get("once", True):
+            break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.models import CrawledResource, KnowledgeSource, SourceScope
+from backend.services.crawler_service import crawler
+from backend.services.atomic_service import atomic_service
+from backend.pkm.rag_service import rag_service, SHARED_CACHE_USER_ID
+
+# Query parameters that never change page content
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "ref", "ref_src", "igshid"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url: str) -> str:
+    """
+    Purely syntactic canonical form (no request is made: user URLs are never fetched from this server):
+    lowercase scheme/host, default ports and fragments dropped, tracking params removed,
+    remaining query params sorted, trailing slash trimmed.
+    """
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or "https").lower()
+    host = (parts.hostname or "").lower()
+
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    ]
+    query.sort()
+
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+class SharedCrawlService:
+    """
+    Crawls each canonical URL once and fans the result out to every subscriber.
+    - Crawl + fingerprint: one Firecrawl call per resource per refresh.
+    - Atomic Note: one LLM call per *content change*, cached on the resource.
+    - Embeddings: one vectorizer pass into a hidden shared copy; subscribers clone its vectors.
+    """
+
+    async def get_or_create_resource(self, db: AsyncSession, url: str) -> CrawledResource:
+        """Race-safe: concurrent subscriptions to a new URL insert one row (ON CONFLICT DO NOTHING) and both re-select it."""
+        canonical_url = normalize_url(url)
+        query = select(CrawledResource).where(CrawledResource.canonical_url == canonical_url)
+
+        resource = (await db.execute(query)).scalars().first()
+        if not resource:
+            await db.execute(
+                pg_insert(CrawledResource)
+                .values(canonical_url=canonical_url)
+                .on_conflict_do_nothing(index_elements=["canonical_url"])
+            )
+            resource = (await db.execute(query)).scalars().one()
+        return resource
+
+    async def ensure_resource(self, db: AsyncSession, source: KnowledgeSource) -> CrawledResource:
+        """Links legacy sources (created before canonical URLs) to their shared resource."""
+        if source.resource_id:
+            result = await db.execute(select(CrawledResource).where(CrawledResource.id == source.resource_id))
+            resource = result.scalars().first()
+            if resource:
+                return resource
+
+        resource = await self.get_or_create_resource(db, source.url)
+        source.resource_id = resource.id
+        return resource
+
+    async def refresh_resource(self, resource: CrawledResource, max_age_hours: int = 24) -> bool:
+        """
+        Re-crawls the resource if its cached copy is older than 'max_age_hours'.
+        The LLM and vectorizer only run when the content fingerprint changes.
+        Returns True if usable content is available.
+        """
+        is_fresh = (
+            resource.last_crawled_at
+            and resource.content_hash
+            and datetime.utcnow() - resource.last_crawled_at < timedelta(hours=max_age_hours)
+        )
+        if is_fresh:
+            print(f" ♻️ Reusing cached crawl for {resource.canonical_url}")
+            return True
+
+        data = await crawler.crawl_url(resource.canonical_url)
+        if not data or not data.get('content'):
+            resource.error_count = (resource.error_count or 0) + 1
+            return bool(resource.content_hash)
+
+        raw_markdown = data['content']
+        content_hash = hashlib.sha256(raw_markdown.encode('utf-8')).hexdigest()
+        resource.last_crawled_at = datetime.utcnow()
+        resource.error_count = 0
+
+        if content_hash == resource.content_hash:
+            print(f" ✅ Content unchanged for {resource.canonical_url}. Skipping analysis.")
+            return True
+
+        # Content changed: one Atomic Note + one embedding pass for everyone
+        note_obj = await atomic_service.generate_note(raw_markdown, resource.canonical_url)
+        formatted_note_content = atomic_service.format_as_markdown(note_obj)
+
+        shared_doc_id = rag_service.make_doc_id(resource.canonical_url, SHARED_CACHE_USER_ID)
+        await asyncio.to_thread(rag_service.delete_document, shared_doc_id)
+        await asyncio.to_thread(
+            rag_service.ingest_document,
+            text=raw_markdown,
+            summary=formatted_note_content,
+            metadata={
+                "source_url": resource.canonical_url,
+                "title": note_obj.title,
+                "user_id": SHARED_CACHE_USER_ID,
+                "scope": SourceScope.GLOBAL.value,
+                "keywords": note_obj.keywords
+            },
+            store_raw=True
+        )
+
+        resource.title = note_obj.title
+        resource.content = raw_markdown
+        resource.content_hash = content_hash
+        resource.note_markdown = formatted_note_content
+        resource.note_keywords = note_obj.keywords
+        return True
+
+    async def materialize_for_source(self, resource: CrawledResource, source: KnowledgeSource) -> bool:
+        """
+        Makes the shared crawl visible to one subscriber by cloning the precomputed note and chunk vectors.
+        No-op if this subscriber already has the current content.
+        """
+        if not resource.content_hash:
+            return False
+
+        if source.ingested_hash != resource.content_hash:
+            target_user_id = source.user_id if source.scope == SourceScope.PRIVATE else 0
+            shared_doc_id = rag_service.make_doc_id(resource.canonical_url, SHARED_CACHE_USER_ID)
+
+            doc_id = await asyncio.to_thread(
+                rag_service.clone_document,
+                shared_doc_id,
+                {
+                    "source_url": resource.canonical_url,
+                    "title": resource.title,
+                    "user_id": target_user_id,
+                    "scope": source.scope.value
+                }
+            )
+            if not doc_id:
+                return False
+
+            source.ingested_hash = resource.content_hash
+
+        source.last_crawled_at = resource.last_crawled_at
+        source.title = resource.title
+        source.error_count = 0
+        return True
+
+    async def sync_source(self, db: AsyncSession, source: KnowledgeSource) -> bool:
+        """Refresh + materialize for a single subscription (used for instant crawls)."""
+        resource = await self.ensure_resource(db, source)
+        if not await self.refresh_resource(resource, max_age_hours=source.update_frequency_hours or 24):
+            return False
+        return await self.materialize_for_source(resource, source)
+
+# Singleton
+shared_crawl_service = SharedCrawlService()
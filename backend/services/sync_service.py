@@ -5,13 +5,14 @@ from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.db.session import async_session_maker
-from backend.db.models import User, OAuthAccount
+from backend.db.models import User, OAuthAccount, SourceScope
 from backend.pkm.connectors import PKMConnector
 from backend.pkm.parsers import parse_file_bytes
 from backend.pkm.rag_service import rag_service
 from backend.core.config import settings
 
-scheduler = AsyncIOScheduler()
+# Synced files get no LLM-written Atomic Note: the note is the start of the file
+NOTE_PREVIEW_CHARS = 2000
 
 # --- Helper: Authentication Token Refresh ---
 async def refresh_oauth_token(db: AsyncSession, account: OAuthAccount) -> str:
@@ -73,42 +74,61 @@ async def process_file_sync(user_id: int, files_meta: list, access_token: str, p
     """
     print(f" ⏳ Processing {len(files_meta)} files from {provider}...")
 
-    for meta in files_meta:
-        try:
-            content_bytes = None
+    # A few files at a time: downloads overlap, and small images can share one vision request
+    semaphore = asyncio.Semaphore(settings.SYNC_FILE_CONCURRENCY)
+
+    async def process_one(meta: dict):
+        async with semaphore:
+            await process_single_file(user_id, meta, access_token, provider)
+
+    await asyncio.gather(*(process_one(meta) for meta in files_meta))
+
+async def process_single_file(user_id: int, meta: dict, access_token: str, provider: str):
+    """Downloads, parses and indexes one file."""
+    try:
+        content_bytes = None
+        
+        # 1. Download Content based on Provider
+        if provider == "GoogleDrive":
+            content_bytes = await PKMConnector.download_google_content(
+                meta['download_url'], 
+                access_token
+            )
+        elif provider == "OneDrive":
+            content_bytes = await PKMConnector.download_onedrive_content(
+                meta['download_url']
+            )
+
+        # 2. Parse & Ingest
+        if content_bytes:
+            # Extract text from PDF/Docx/Txt bytes
+            text = await parse_file_bytes(content_bytes, meta['name'], user_id=user_id)
             
-            # 1. Download Content based on Provider
-            if provider == "GoogleDrive":
-                content_bytes = await PKMConnector.download_google_content(
-                    meta['download_url'], 
-                    access_token
-                )
-            elif provider == "OneDrive":
-                content_bytes = await PKMConnector.download_onedrive_content(
-                    meta['download_url']
+            if text:
+                # Run RAG ingestion in a thread (CPU bound) to avoid blocking async loop.
+                # Stable doc id per file: the previous sync's copy is replaced, not duplicated.
+                source = f"{provider}: {meta['name']}"
+                await asyncio.to_thread(rag_service.delete_document, rag_service.make_doc_id(source, user_id))
+                await asyncio.to_thread(
+                    rag_service.ingest_document,
+                    text=text,
+                    summary=text[:NOTE_PREVIEW_CHARS],
+                    metadata={
+                        "source_url": source,
+                        "title": meta['name'],
+                        "user_id": user_id,
+                        "scope": SourceScope.PRIVATE.value
+                    },
+                    store_raw=True
                 )
-
-            # 2. Parse & Ingest
-            if content_bytes:
-                # Extract text from PDF/Docx/Txt bytes
-                text = parse_file_bytes(content_bytes, meta['name'])
-                
-                if text:
-                    # Run RAG ingestion in a thread (CPU bound) to avoid blocking async loop
-                    await asyncio.to_thread(
-                        rag_service.ingest_text,
-                        text=text,
-                        source=f"{provider}: {meta['name']}",
-                        user_id=user_id
-                    )
-                    print(f" ✅ Indexed: {meta['name']}")
-                else:
-                    print(f" ⚠️ Empty/Unsupported: {meta['name']}")
+                print(f" ✅ Indexed: {meta['name']}")
             else:
-                print(f" ❌ Download Failed: {meta['name']}")
+                print(f" ⚠️ Empty/Unsupported: {meta['name']}")
+        else:
+            print(f" ❌ Download Failed: {meta['name']}")
 
-        except Exception as e:
-            print(f" ❌ Error processing {meta['name']}: {str(e)}")
+    except Exception as e:
+        print(f" ❌ Error processing {meta['name']}: {str(e)}")
             
 async def sync_all_users():
     """
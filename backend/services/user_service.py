@@ -1,15 +1,33 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from backend.db.models import UserProfile
+from backend.core.cache import TTLCache
+from backend.core.config import settings
+
+# user_id -> {"weekly_tokens": int, "agent_preferences": dict}
+# Written through by PATCH /preferences, invalidated when tokens change.
+profile_cache = TTLCache("profile", settings.PROFILE_CACHE_TTL_SECONDS)
+
+def profile_snapshot(profile: UserProfile) -> dict:
+    """The cached (and GET /preferences) view of a profile."""
+    return {
+        "weekly_tokens": profile.weekly_tokens,
+        "agent_preferences": dict(profile.agent_preferences or {})
+    }
 
 async def get_user_agent_config(db: AsyncSession, user_id: int) -> dict:
     """
-    Retrieves the real user preferences from Postgres.
+    Retrieves the real user preferences from Postgres (via profile_cache).
     Returns a default dict if no profile exists.
     """
-    result = await db.execute(select(UserProfile).where(UserProfile.user_id == user_id))
-    profile = result.scalars().first()
-    
+    snapshot = await profile_cache.get(user_id)
+    if snapshot is None:
+        result = await db.execute(select(UserProfile).where(UserProfile.user_id == user_id))
+        profile = result.scalars().first()
+        if profile:
+            snapshot = profile_snapshot(profile)
+            await profile_cache.set(user_id, snapshot)
+
     # Default Defaults
     defaults = {
         "mode": "productivity",
@@ -17,9 +35,9 @@ async def get_user_agent_config(db: AsyncSession, user_id: int) -> dict:
         "refinement_level": "standard",
         "model": "gpt-4o"
     }
-    
-    if profile and profile.agent_preferences:
+
+    if snapshot and snapshot["agent_preferences"]:
         # Merge DB prefs over defaults
-        return {**defaults, **profile.agent_preferences}
-    
-    return defaults
\ No newline at end of file
+        return {**defaults, **snapshot["agent_preferences"]}
+
+    return defaults
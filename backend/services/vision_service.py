@@ -1,53 +1,237 @@
+import re
 import base64
-from typing import Optional
+import asyncio
+import mimetypes
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage
 from backend.core.config import settings
+from backend.core.metrics import metrics
+from backend.core.rate_limiter import rate_limiter, BACKGROUND
+from backend.services.image_processing import prepare_image, hamming
+
+IMAGE_PROMPT = """
+Analyze this image (Filename: {filename}).
+Provide a detailed, descriptive summary of its contents.
+- If it is a diagram or chart, explain the data and relationships.
+- If it is a document screenshot, transcribe the key text.
+- If it is a photo, describe the objects and context.
+
+Output ONLY the description.
+"""
+
+BATCH_PROMPT = """
+Analyze each of the {count} images below (filenames: {filenames}).
+For every image, provide a detailed, descriptive summary of its contents.
+- If it is a diagram or chart, explain the data and relationships.
+- If it is a document screenshot, transcribe the key text.
+- If it is a photo, describe the objects and context.
+
+Answer with one section per image, in order, each starting with a line "### IMAGE <n>".
+Output ONLY the sections.
+"""
 
 class VisionService:
+    """
+    Image descriptions for RAG indexing.
+    - Pre-processing (process pool): EXIF rotation, downsizing to the model's useful resolution,
+      re-encoding and the real MIME type, so multi-MB phone photos upload as a few hundred KB.
+    - Dedup: a perceptual hash close to an image already described in the same scope (user)
+      reuses that description instead of calling the model (bounded: VISION_DEDUP_MAX_SCOPES most
+      recently active scopes, VISION_DEDUP_MAX_ENTRIES each). Not for text-like images: every page
+      of a scan or screenshot looks alike to a 64-bit hash, whatever the words say.
+    - Batching: small images arriving within VISION_BATCH_WINDOW_MS share one multi-image request.
+    """
+
     def __init__(self):
         # We use GPT-4o for high-quality image analysis
         self.vision_model = ChatOpenAI(
-            model="gpt-4o", 
+            model="gpt-4o",
             temperature=0,
             max_tokens=1000,
-            api_key=settings.OPENAI_API_KEY
+            api_key=settings.OPENAI_API_KEY,
+            max_retries=0 # 429 backoff is handled by the shared rate limiter
         )
+        self._pool: Optional[ProcessPoolExecutor] = None # Started on first use
+        self._seen: "OrderedDict[str, OrderedDict[int, str]]" = OrderedDict() # scope -> phash -> description, LRU of scopes
+        self._pending: List[Tuple[dict, str, asyncio.Future]] = []
+        self._flush_timer: Optional[asyncio.Task] = None
 
     def _encode_image(self, image_bytes: bytes) -> str:
         """Encodes bytes to Base64 string."""
         return base64.b64encode(image_bytes).decode('utf-8')
 
-    async def analyze_image(self, image_bytes: bytes, filename: str) -> str:
-        """Generates a detailed text description of an image for RAG indexing."""
-        base64_image = self._encode_image(image_bytes)
-        
-        prompt = f"""
-        Analyze this image (Filename: {filename}). 
-        Provide a detailed, descriptive summary of its contents.
-        - If it is a diagram or chart, explain the data and relationships.
-        - If it is a document screenshot, transcribe the key text.
-        - If it is a photo, describe the objects and context.
-        
-        Output ONLY the description.
-        """
+    # --- Pre-processing ---
+
+    async def prepare(self, image_bytes: bytes, filename: str) -> dict:
+        """Pre-processed image: data, mime, size, phash, text_like (screenshot/scan), ocr_data, source_bytes."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=settings.VISION_PREPROCESS_WORKERS)
+        try:
+            with metrics.timer("vision.preprocess"):
+                image = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, prepare_image, image_bytes,
+                    settings.VISION_MAX_LONG_SIDE, settings.VISION_MAX_SHORT_SIDE, settings.VISION_JPEG_QUALITY
+                )
+        except Exception as e:
+            # Undecodable here (e.g. HEIC without a plugin): send as-is and let the model try
+            print(f"⚠️ Image pre-processing failed for {filename}: {e}")
+            mime = mimetypes.guess_type(filename)[0] or "image/jpeg"
+            return {"data": image_bytes, "mime": mime, "width": None, "height": None,
+                    "phash": None, "text_like": False, "ocr_data": None, "source_bytes": len(image_bytes)}
+
+        metrics.incr("vision.bytes_saved", image["source_bytes"] - len(image["data"]))
+        return image
+
+    # --- Dedup ---
+
+    def _find_duplicate(self, scope: Optional[str], phash: Optional[int]) -> Optional[str]:
+        if scope is None or phash is None:
+            return None
+        seen = self._seen.get(scope)
+        if seen is None:
+            return None
+        self._seen.move_to_end(scope)
+        for known, description in seen.items():
+            if hamming(known, phash) <= settings.VISION_DEDUP_MAX_DISTANCE:
+                seen.move_to_end(known)
+                return description
+        return None
+
+    def _remember(self, scope: Optional[str], phash: Optional[int], description: str):
+        if scope is None or phash is None:
+            return
+        seen = self._seen.setdefault(scope, OrderedDict())
+        self._seen.move_to_end(scope)
+        seen[phash] = description
+        while len(seen) > settings.VISION_DEDUP_MAX_ENTRIES:
+            seen.popitem(last=False)
+        while len(self._seen) > settings.VISION_DEDUP_MAX_SCOPES:
+            self._seen.popitem(last=False)
+
+    # --- Model calls ---
+
+    def _image_block(self, image: dict, detail: str) -> dict:
+        return {
+            "type": "image_url",
+            "image_url": {"url": f"data:{image['mime']};base64,{self._encode_image(image['data'])}", "detail": detail},
+        }
+
+    def _is_small(self, image: dict) -> bool:
+        return bool(image["width"]) and max(image["width"], image["height"]) <= settings.VISION_BATCH_MAX_SIDE
 
-        message = HumanMessage(
-            content=[
-                {"type": "text", "text": prompt},
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                },
-            ]
+    async def _describe(self, images: List[dict], filenames: List[str]) -> List[str]:
+        """One request for all images; a multi-image answer is split on its '### IMAGE n' headers."""
+        # Small images lose nothing at low detail (one 512px tile)
+        detail = "low" if all(self._is_small(image) for image in images) else "high"
+        if len(images) == 1:
+            content = [{"type": "text", "text": IMAGE_PROMPT.format(filename=filenames[0])}]
+        else:
+            content = [{"type": "text", "text": BATCH_PROMPT.format(count=len(images), filenames=", ".join(filenames))}]
+        content += [self._image_block(image, detail) for image in images]
+
+        # Image analysis runs during syncs -> background lane
+        # Estimate: high-detail images cost ~1k input tokens + up to 1k output tokens each
+        model = self.vision_model if len(images) == 1 else self.vision_model.bind(max_tokens=1000 * len(images))
+        metrics.incr("vision.requests")
+        response = await rate_limiter.run(
+            "openai", "gpt-4o",
+            lambda: model.ainvoke([HumanMessage(content=content)]),
+            priority=BACKGROUND,
+            est_tokens=2000 * len(images)
         )
+        if len(images) == 1:
+            return [response.content]
+
+        sections = [s.strip() for s in re.split(r"^###\s*IMAGE\s*\d+\s*$", response.content, flags=re.MULTILINE | re.IGNORECASE)[1:]]
+        if len(sections) != len(images):
+            raise ValueError(f"expected {len(images)} sections, got {len(sections)}")
+        return sections
+
+    # --- Batching ---
+
+    async def _describe_batched(self, image: dict, filename: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((image, filename, future))
+        if len(self._pending) >= settings.VISION_BATCH_MAX_IMAGES:
+            self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.VISION_BATCH_WINDOW_MS / 1000)
+        self._flush_timer = None
+        self._flush()
+
+    def _flush(self):
+        if self._flush_timer:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[Tuple[dict, str, asyncio.Future]]):
+        images, filenames, futures = zip(*batch)
+        try:
+            descriptions = await self._describe(list(images), list(filenames))
+            if len(batch) > 1:
+                metrics.incr("vision.batched_images", len(batch))
+        except Exception as e:
+            if len(batch) == 1:
+                futures[0].set_exception(e)
+                return
+            # Unusable multi-image answer: fall back to one request per image
+            print(f"⚠️ Batched vision request failed ({e}), retrying images one by one")
+            descriptions = []
+            for image, filename in zip(images, filenames):
+                try:
+                    descriptions.append((await self._describe([image], [filename]))[0])
+                except Exception as single_error:
+                    descriptions.append(single_error)
+
+        for future, description in zip(futures, descriptions):
+            if future.done():
+                continue
+            if isinstance(description, Exception):
+                future.set_exception(description)
+            else:
+                future.set_result(description)
+
+    async def analyze_image(self, image_bytes: bytes, filename: str, dedup_scope: Optional[str] = None, prepared: Optional[dict] = None) -> str:
+        """
+        Generates a detailed text description of an image for RAG indexing.
+        dedup_scope (e.g. "user:42") enables near-duplicate reuse; descriptions never cross scopes.
+        prepared: the result of prepare() if the caller already has it.
+        """
+        metrics.incr("vision.images")
+        image = prepared or await self.prepare(image_bytes, filename)
+        if image["text_like"]:
+            dedup_scope = None
+
+        duplicate = self._find_duplicate(dedup_scope, image["phash"])
+        if duplicate is not None:
+            metrics.incr("vision.dedup_hits")
+            return duplicate
 
         try:
-            response = await self.vision_model.ainvoke([message])
-            return response.content
+            if self._is_small(image):
+                description = await self._describe_batched(image, filename)
+            else:
+                description = (await self._describe([image], [filename]))[0]
         except Exception as e:
             print(f"Vision Analysis Failed: {e}")
             return f"[Image Analysis Failed for {filename}]"
 
+        self._remember(dedup_scope, image["phash"], description)
+        return description
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
 # Singleton
-vision_service = VisionService()
\ No newline at end of file
+vision_service = VisionService()
@@ -1,6 +1,7 @@
 import asyncio
 from datetime import datetime, timedelta
-from sqlalchemy import select, or_
+from typing import Optional
+from sqlalchemy import select, or_, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.db.session import async_session_maker
@@ -8,6 +9,45 @@ from backend.db.models import KnowledgeSource, SourceScope
 from backend.services.crawler_service import crawler
 from backend.pkm.rag_service import rag_service
 from backend.services.ingestion_service import ingestion_service
+from backend.services.shared_crawl_service import shared_crawl_service
+
+async def ingest_domain_source(source: KnowledgeSource) -> Optional[str]:
+    """
+    Streams a domain crawl straight into the ingestion pipeline.
+    Each page is analysed and stored as soon as Firecrawl returns it; the crawler's bounded
+    queue applies back-pressure while a page is being ingested.
+    Returns the title of the first ingested page (used as the source title), or None.
+    """
+    target_user_id = source.user_id if source.scope == SourceScope.PRIVATE else 0
+    first_title = None
+    page_count = 0
+
+    async for page in crawler.crawl_domain(source.url, limit=source.crawl_depth):
+        if not page.get('content'):
+            continue
+
+        try:
+            note_obj = await ingestion_service.process_and_ingest(
+                raw_text=page['content'],
+                metadata={
+                    "source_url": page.get('source_url') or source.url,
+                    "title": page.get('title'),
+                    "user_id": target_user_id,
+                    "scope": source.scope.value
+                },
+                store_raw=True
+            )
+        except Exception as e:
+            # One bad page should not abort the rest of the crawl
+            print(f"   ❌ Page ingestion failed ({page.get('source_url')}): {e}")
+            continue
+
+        page_count += 1
+        if first_title is None:
+            first_title = note_obj.title
+
+    print(f" ↳ Streamed {page_count} pages from {source.url}")
+    return first_title
 
 async def run_watcher_cycle():
     """Cron Task: Checks for sources that need updating."""
@@ -32,38 +72,29 @@ async def run_watcher_cycle():
         
         print(f" ↳ Found {len(sources_to_update)} sources needing update.")
         
+        # 2. Group single-page sources by canonical URL so each page is crawled once
+        shared_groups = {}
+        
         for source in sources_to_update:
             print(f" ⟳ Updating Source: {source.url} (Scope: {source.scope})")
             
             try:
-                # 2. Perform Crawl
-                data = await crawler.crawl_url(source.url)
-                
-                if data and data['content']:
-                    # 3. Ingestion
-                    # If Scope is GLOBAL, ingest with a special 'global' user_id (e.g. 0), or handle permissions in the RAG search logic.
-                    target_user_id = source.user_id if source.scope == SourceScope.PRIVATE else 0
-                    
-                    note_obj = await ingestion_service.process_and_ingest(
-                        raw_text=data['content'],
-                        metadata={
-                            "source_url": source.url,
-                            # We pass the scraped title as a fallback, 
-                            # but the AI will generate a better one.
-                            "title": data.get('title'), 
-                            "user_id": target_user_id,
-                            "scope": source.scope.value
-                        },
-                        store_raw=True 
-                    )
-                    
-                    # 4. Update Source Status
-                    source.last_crawled_at = datetime.utcnow()
-                    source.title = note_obj.title # Update DB with the smart AI title
-                    source.error_count = 0
-                    
+                # 2a. Domain Crawl: pages are ingested as they arrive
+                if (source.crawl_depth or 1) > 1:
+                    title = await ingest_domain_source(source)
+
+                    if title:
+                        source.last_crawled_at = datetime.utcnow()
+                        source.title = source.title or title
+                        source.error_count = 0
+                    else:
+                        source.error_count += 1
+
                 else:
-                    source.error_count += 1
+                    # 2b. Single Page: resolve the shared resource, crawl later
+                    resource = await shared_crawl_service.ensure_resource(db, source)
+                    shared_groups.setdefault(resource.id, (resource, []))[1].append(source)
+                    continue
             
             except Exception as e:
                 print(f"   ❌ Watcher Error: {e}")
@@ -72,4 +103,28 @@ async def run_watcher_cycle():
             
             # Commit per source to save progress
             db.add(source)
-            await db.commit()
\ No newline at end of file
+            await db.commit()
+        
+        # 3. One crawl / note / embedding pass per canonical URL, fanned out to every subscriber
+        print(f" ↳ {len(shared_groups)} unique pages for {sum(len(g[1]) for g in shared_groups.values())} subscriptions.")
+        
+        for resource, subscribers in shared_groups.values():
+            try:
+                max_age = min(s.update_frequency_hours or 24 for s in subscribers)
+                has_content = await shared_crawl_service.refresh_resource(resource, max_age_hours=max_age)
+                
+                for source in subscribers:
+                    if not (has_content and await shared_crawl_service.materialize_for_source(resource, source)):
+                        source.error_count += 1
+            
+            except Exception as e:
+                print(f"   ❌ Watcher Error ({resource.canonical_url}): {e}")
+                resource.error_count = (resource.error_count or 0) + 1
+                resource.last_error = str(e)
+                for source in subscribers:
+                    source.error_count += 1
+                    source.last_error = str(e)
+            
+            # Commit per resource to save progress
+            db.add(resource)
+            await db.commit()
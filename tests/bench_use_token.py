@@ -0,0 +1,121 @@
+"""
+Concurrency benchmark for POST /agent/use-token (not collected by pytest).
+Needs a real PostgreSQL database (settings.DATABASE_URL); creates throwaway users and removes them afterwards.
+
+    python -m tests.bench_use_token --users 200 --requests 5000 --concurrency 100
+
+Correctness: every user gets exactly min(requests, tokens available) successes, no token is
+spent twice, and users whose week expired (here: with no tokens left) get a fresh week first.
+Throughput: requests/s and p50/p99 latency over the whole run.
+"""
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+
+from fastapi import Request
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import delete, insert, select
+
+from backend.app.main import app, current_active_user
+from backend.db.models import User, UserProfile
+from backend.db.session import async_session_maker
+from backend.core.metrics import LatencyTracker
+from backend.services.gamification_engine import WEEKLY_TOKENS
+
+EMAIL_DOMAIN = "bench.lifeos.dev"
+
+async def create_users(count: int) -> dict:
+    """Half the users start mid-week with 1 token left, half with an expired week and 0 tokens."""
+    now = datetime.utcnow()
+    async with async_session_maker() as db:
+        ids = (await db.execute(
+            insert(User).returning(User.id),
+            [{"email": f"user{i}-{time.time_ns()}@{EMAIL_DOMAIN}", "hashed_password": "x",
+              "is_active": True, "is_superuser": False, "is_verified": True} for i in range(count)]
+        )).scalars().all()
+
+        expected = {}
+        rows = []
+        for i, user_id in enumerate(ids):
+            if i % 2:
+                rows.append({"user_id": user_id, "weekly_tokens": 1, "tokens_used": 2, "last_reset_date": now})
+                expected[user_id] = 1
+            else:
+                rows.append({"user_id": user_id, "weekly_tokens": 0, "tokens_used": 3,
+                             "last_reset_date": now - timedelta(days=8)})
+                expected[user_id] = WEEKLY_TOKENS
+        await db.execute(insert(UserProfile), rows)
+        await db.commit()
+    return expected
+
+async def remove_users():
+    async with async_session_maker() as db:
+        await db.execute(delete(User).where(User.email.like(f"%@{EMAIL_DOMAIN}")))
+        await db.commit()
+
+async def run(users: int, requests: int, concurrency: int):
+    expected_tokens = await create_users(users)
+    user_ids = list(expected_tokens)
+    targets = [random.choice(user_ids) for _ in range(requests)]
+
+    async def bench_user(request: Request) -> User:
+        return User(id=int(request.headers["X-Bench-User"]), email=f"bench@{EMAIL_DOMAIN}", is_active=True)
+    app.dependency_overrides[current_active_user] = bench_user
+
+    latencies = LatencyTracker(window=requests)
+    successes, statuses = Counter(), Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        async def fire(user_id: int):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/agent/use-token", headers={"X-Bench-User": str(user_id)})
+                latencies.record((time.perf_counter() - start) * 1000)
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    successes[user_id] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(fire(user_id) for user_id in targets))
+        elapsed = time.perf_counter() - start
+
+    app.dependency_overrides.clear()
+
+    # Correctness: successes per user == min(calls, tokens available), and the DB agrees
+    calls = Counter(targets)
+    async with async_session_maker() as db:
+        profiles = {p.user_id: p for p in (await db.execute(
+            select(UserProfile).where(UserProfile.user_id.in_(user_ids))
+        )).scalars().all()}
+
+    errors = []
+    for user_id, available in expected_tokens.items():
+        granted = successes[user_id]
+        if granted != min(calls[user_id], available):
+            errors.append(f"user {user_id}: {granted} successes for {calls[user_id]} calls, {available} tokens")
+        if profiles[user_id].weekly_tokens != available - granted:
+            errors.append(f"user {user_id}: {profiles[user_id].weekly_tokens} tokens left, expected {available - granted}")
+
+    await remove_users()
+
+    print(f"⏱️ {requests} requests, {concurrency} concurrent, {users} users: {elapsed:.2f}s ({requests / elapsed:.0f} req/s)")
+    print(f"   Latency: {latencies.snapshot()}")
+    print(f"   Status codes: {dict(statuses)}")
+    if errors:
+        print(f"❌ {len(errors)} correctness errors, e.g.:")
+        for error in errors[:10]:
+            print(f"   {error}")
+        raise SystemExit(1)
+    print("✅ Token accounting consistent under concurrency")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.requests, args.concurrency))